@@ -1,122 +1,386 @@
-from typing import final
-import polars as pl
-import datetime as dt
-import pandas as pd
-import time
-import requests
-import json
-import re
-from scripts.query_tracker import QueryTracker as QueryTracker
-from scripts.queries import gen_queries
-from scripts.serper import get_linkedin_urls_sync
-from scripts.deduplicate import deduplicate_linkedin_urls as deduplicate_linkedin_urls
-from scripts.enrich_urls import enrich_urls_sync
-from scripts.validateprofile import validate_profiles as validate_profiles
-from scripts.findymail import findymail_sync
-from scripts.Logger import Logger as Logger
-from scripts.creds import API_KEYS as API_KEYS
+import argparse
 import itertools
+import json
+import os
+import sys
+import time
 
-def main():
-    all_start = time.time()
-    filepath = "input.csv"
-    input_df = pl.read_csv(filepath)
-    logger = Logger()
-    query_tracker = QueryTracker()
+# Command line
+# Every stage module is imported by the command that needs it, so short commands do not pay for Polars,
+# aiohttp or the OpenAI client. The stage commands read and write {query: data} JSON files in STAGE_DIR,
+# so one expensive stage can be re-run on saved inputs without running the whole pipeline again.
+#   python main.py                                  full pipeline with the settings below (same as "run")
+#   python main.py run --input input.csv --max-queries 1000 --hedge
+#   python main.py queries --input input.csv        input.csv           -> stages/queries.json
+#   python main.py search                           stages/queries.json -> stages/urls.json
+#   python main.py dedup                            stages/urls.json    -> stages/deduplicated.json
+#   python main.py enrich                           ...                 -> stages/profiles.json
+#   python main.py validate                         ...                 -> stages/validated.json
+#   python main.py email                            ...                 -> stages/emails.json
+#   python main.py output --input input.csv         stages/emails.json  -> output.csv
+# --from and --to read and write other files, "python main.py <command> -h" lists the options of a command.
+# The settings below are the defaults of the matching options.
+INPUT_FILE = "input.csv"
+OUTPUT_FILE = "output.csv"
+STAGE_DIR = "stages"
+STAGE_FILES = {
+    "queries": "queries.json",
+    "search": "urls.json",
+    "dedup": "deduplicated.json",
+    "enrich": "profiles.json",
+    "validate": "validated.json",
+    "email": "emails.json",
+}
+
+# Set to True to send one "(title1 OR title2 ...)" query per company form and keep every profile in the top results
+CONSOLIDATE_QUERIES = False
+# Order queries by the hit rates learned from previous runs (query_stats.json) so likely contacts are found first
+PRIORITIZE_QUERIES = True
+# Only send the first N queries (after prioritizing), None sends all of them
+MAX_SERPER_QUERIES = None
+# Stop starting new Serper queries after this many seconds, None runs them all
+SERPER_TIME_LIMIT = None
+# Set to True to send a duplicate Icypeas/Findymail request when one runs past the p95 latency (max 2% extra requests)
+HEDGE_REQUESTS = False
+# Set to True to submit Findymail lookups with a webhook_url and collect results on a local callback receiver
+# (see scripts/findymail_webhook.py for PUBLIC_URL, which Findymail must be able to reach)
+FINDYMAIL_WEBHOOK = False
+# Set to "record" to save every provider request/response to CASSETTE_PATH, or "replay" to serve them back
+# offline with the recorded latencies scaled by CASSETTE_TIME_SCALE (0 = no delay)
+CASSETTE_MODE = None
+CASSETTE_PATH = "cassette.jsonl.gz"
+CASSETTE_TIME_SCALE = 1.0
+# Set to True to only run companies that are new or changed since the last run (run_manifest.json) and carry
+# over the contacts of the rest. The manifest is written after every run either way.
+DELTA_RUN = False
+# Set to True to generate queries, deduplicate URLs and build the output with Polars frames (scripts/frames.py)
+# instead of per-item Python loops, same results but scales to millions of rows
+FRAME_STAGES = False
+# Set to True to write cProfile/tracemalloc/event-loop lag results for each stage to profiles/<timestamp>/
+PROFILE = False
+# Drop profiles and contacts in the suppression index (scripts/suppression.py) after deduplication, before
+# Findymail and before the output is written. Nothing is dropped until an index has been built.
+SUPPRESS_DELIVERED = True
+
+# option name -> (flags, argparse keyword arguments)
+OPTIONS = {
+    "input": (["--input"], dict(default=INPUT_FILE, help="input CSV with company, Root Domain and job titles columns")),
+    "output": (["--output"], dict(default=OUTPUT_FILE, help="output CSV")),
+    "consolidate": (["--consolidate"], dict(action=argparse.BooleanOptionalAction, default=CONSOLIDATE_QUERIES, help="one OR-combined query per company form")),
+    "prioritize": (["--prioritize"], dict(action=argparse.BooleanOptionalAction, default=PRIORITIZE_QUERIES, help="order queries by learned hit rates")),
+    "max_queries": (["--max-queries"], dict(type=int, default=MAX_SERPER_QUERIES, help="only send the first N queries")),
+    "time_limit": (["--time-limit"], dict(type=float, default=SERPER_TIME_LIMIT, help="stop starting Serper queries after this many seconds")),
+    "hedge": (["--hedge"], dict(action=argparse.BooleanOptionalAction, default=HEDGE_REQUESTS, help="hedge slow Icypeas/Findymail requests")),
+    "webhook": (["--webhook"], dict(action=argparse.BooleanOptionalAction, default=FINDYMAIL_WEBHOOK, help="Findymail webhook mode")),
+    "delta": (["--delta"], dict(action=argparse.BooleanOptionalAction, default=DELTA_RUN, help="only run new or changed companies")),
+    "frames": (["--frames"], dict(action=argparse.BooleanOptionalAction, default=FRAME_STAGES, help="run the CPU-side stages on Polars frames")),
+    "cassette": (["--cassette"], dict(choices=["record", "replay"], default=CASSETTE_MODE, help="record or replay provider traffic")),
+    "cassette_path": (["--cassette-path"], dict(default=CASSETTE_PATH)),
+    "cassette_time_scale": (["--cassette-time-scale"], dict(type=float, default=CASSETTE_TIME_SCALE)),
+    "profile": (["--profile"], dict(action=argparse.BooleanOptionalAction, default=PROFILE, help="write per-stage profiles to profiles/<timestamp>/")),
+    "suppress": (["--suppress"], dict(action=argparse.BooleanOptionalAction, default=SUPPRESS_DELIVERED, help="drop previously delivered contacts")),
+}
+PROVIDER_OPTIONS = ["cassette", "cassette_path", "cassette_time_scale", "profile"]
+# command -> (options, file read by default, file written by default)
+COMMANDS = {
+    "run": (["input", "output", "consolidate", "prioritize", "max_queries", "time_limit", "hedge", "webhook", "delta", "frames", "suppress"] + PROVIDER_OPTIONS, None, None),
+    "queries": (["input", "consolidate", "prioritize", "frames", "profile"], None, "queries"),
+    "search": (["max_queries", "time_limit"] + PROVIDER_OPTIONS, "queries", "search"),
+    "dedup": (["frames", "suppress", "profile"], "search", "dedup"),
+    "enrich": (["hedge"] + PROVIDER_OPTIONS, "dedup", "enrich"),
+    "validate": (PROVIDER_OPTIONS, "enrich", "validate"),
+    "email": (["hedge", "webhook", "suppress"] + PROVIDER_OPTIONS, "validate", "email"),
+    "output": (["input", "output", "frames"], "email", None),
+}
+
+
+def stage_path(stage):
+    return os.path.join(STAGE_DIR, STAGE_FILES[stage])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Find LinkedIn contacts and emails for the companies in an input CSV")
+    subparsers = parser.add_subparsers(dest="command")
+    # No command runs the whole pipeline, settings a command has no option for keep their default
+    parser.set_defaults(command="run", **{name: kwargs.get("default") for name, (_, kwargs) in OPTIONS.items()})
+    for command, (options, source, target) in COMMANDS.items():
+        subparser = subparsers.add_parser(command)
+        for name in options:
+            flags, kwargs = OPTIONS[name]
+            subparser.add_argument(*flags, dest=name, **kwargs)
+        if source:
+            subparser.add_argument("--from", dest="source", default=stage_path(source), help="stage file to read")
+        if target:
+            subparser.add_argument("--to", dest="target", default=stage_path(target), help="stage file to write")
+    return parser
 
-    print(f"processing {len(input_df)} companies")
-    logger.total_input_companies = len(input_df)
 
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        run_pipeline(args)
+    elif args.command == "queries":
+        run_queries(args)
+    elif args.command == "output":
+        run_output(args)
+    else:
+        run_stage(args)
+
+
+def read_stage(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_stage(path, items):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    print(f"Wrote {len(items)} items to {path}")
+
+
+# Return: (input rows with the company key, unique companies, job titles)
+def read_input(path):
+    import polars as pl
+    from scripts.normalize import add_company_key, unique_companies
+    input_df = pl.read_csv(path)
     # Extract job titles and turn it into a list
     str_job_titles = input_df["job titles"][0]
-    job_titles = [title.strip() for title in str_job_titles.split(",")] 
-    companies_data = [
-        {"company": row["company"], "Root Domain": row["Root Domain"]}
-        for row in input_df.iter_rows(named=True)
-    ]
+    job_titles = [title.strip() for title in str_job_titles.split(",")]
+    # Collapse duplicate rows (one per product) to unique companies, results are fanned back out in output_results
+    input_df = add_company_key(input_df)
+    return input_df, unique_companies(input_df), job_titles
+
+
+# Return: (tracker, logger, profiler) for one command, the first stage of a run starts a fresh allqueries.csv
+def start_command(args, append=False):
+    from scripts.query_tracker import QueryTracker
+    from scripts.Logger import Logger
+    profiler = None
+    if args.profile:
+        from scripts.profiler import RunProfiler
+        profiler = RunProfiler()
+    if args.cassette:
+        from scripts import cassette
+        if args.cassette == "record":
+            cassette.start_recording(args.cassette_path)
+        else:
+            cassette.start_replay(args.cassette_path, args.cassette_time_scale)
+    return QueryTracker(append=append), Logger(), profiler
+
+
+def finish_command(args, logger, profiler):
+    logger.output()
+    if args.cassette:
+        from scripts import cassette
+        cassette.stop()
+    if profiler is not None:
+        profiler.write_summary()
+
+
+def run_pipeline(args):
+    from scripts.manifest import RunManifest
+    from scripts.profiler import profile_stage
+
+    all_start = time.time()
+    query_tracker, logger, profiler = start_command(args)
+    input_df, companies_data, job_titles = read_input(args.input)
+
+    print(f"processing {len(companies_data)} unique companies from {len(input_df)} rows")
+    logger.total_input_companies = len(companies_data)
+    manifest = RunManifest()
+    all_companies = companies_data
+    carried_contacts = {}
+    if args.delta:
+        companies_data, carried_contacts, unchanged = manifest.diff(companies_data, job_titles)
+        print(f"Delta run: {len(companies_data)} new or changed companies, {unchanged} unchanged with {len(carried_contacts)} carried contacts")
     # Generate Queries
-    queries = gen_queries(companies_data, job_titles, logger)
+    with profile_stage(profiler, "queries"):
+        generated_queries, prioritizer = generate_queries(companies_data, job_titles, logger, args)
+        queries = limit_queries(generated_queries, args)
     logger.add_queries(len(queries))
     print(f"Generated {len(queries)} queries")
 
-    # Debugging print
-    # pretty_queries = json.dumps(queries, indent=2)
-    # print(pretty_queries)
+    urls = search_stage(queries, query_tracker, logger, profiler, args)
+    deduplicated_urls = dedup_stage(urls, query_tracker, logger, profiler, args)
+    icypeas_profiles = enrich_stage(deduplicated_urls, query_tracker, logger, profiler, args)
+    validated_profiles = validate_stage(icypeas_profiles, query_tracker, logger, profiler, args)
+    emails = email_stage(validated_profiles, query_tracker, logger, profiler, args)
+
+    # Done
+    # Carried contacts go after this run's, both only ever hold queries for their own companies
+    emails = {**emails, **carried_contacts}
+    output_stage(emails, input_df, profiler, args)
+    incomplete = manifest.update(all_companies, companies_data, job_titles, generated_queries, queries, emails, query_tracker.filename, all_start)
+    if incomplete:
+        print(f"{incomplete} companies did not finish and will run again on the next delta run")
+
+    finish_command(args, logger, profiler)
+    if prioritizer is not None:
+        prioritizer.learn(queries, query_tracker.filename)
+
+    print(f"Total runtime: {time.time() - all_start:.2f} seconds")
+
+
+# queries command: input CSV -> all generated queries, --max-queries is applied when they are searched
+def run_queries(args):
+    from scripts.profiler import profile_stage
+    query_tracker, logger, profiler = start_command(args)
+    input_df, companies_data, job_titles = read_input(args.input)
+    logger.total_input_companies = len(companies_data)
+    with profile_stage(profiler, "queries"):
+        queries, _ = generate_queries(companies_data, job_titles, logger, args)
+    logger.add_queries(len(queries))
+    write_stage(args.target, queries)
+    if profiler is not None:
+        profiler.write_summary()
+
+
+# search, dedup, enrich, validate and email commands: stage file -> stage function -> stage file
+def run_stage(args):
+    stage = {
+        "search": search_stage,
+        "dedup": dedup_stage,
+        "enrich": enrich_stage,
+        "validate": validate_stage,
+        "email": email_stage,
+    }[args.command]
+    items = read_stage(args.source)
+    if args.command == "search":
+        items = limit_queries(items, args)
+    query_tracker, logger, profiler = start_command(args, append=True)
+    write_stage(args.target, stage(items, query_tracker, logger, profiler, args))
+    finish_command(args, logger, profiler)
+
+
+# output command: email stage file + input CSV -> output CSV
+def run_output(args):
+    emails = read_stage(args.source)
+    input_df, _, _ = read_input(args.input)
+    output_stage(emails, input_df, None, args)
+    print(f"Wrote {args.output}")
+
+
+# Return: ({query: data} in the order they should be sent, prioritizer or None)
+def generate_queries(companies_data, job_titles, logger, args):
+    if args.consolidate:
+        from scripts.queries import gen_consolidated_queries
+        queries = gen_consolidated_queries(companies_data, job_titles, logger)
+    elif args.frames:
+        from scripts.frames import queries_frame, frame_to_items
+        queries = frame_to_items(queries_frame(companies_data, job_titles))
+    else:
+        from scripts.queries import gen_queries
+        queries = gen_queries(companies_data, job_titles, logger)
+    prioritizer = None
+    if args.prioritize:
+        from scripts.prioritizer import QueryPrioritizer
+        prioritizer = QueryPrioritizer()
+        queries = prioritizer.order(queries)
+    return queries, prioritizer
+
+
+def limit_queries(queries, args):
+    if args.max_queries is None:
+        return queries
+    return dict(itertools.islice(queries.items(), args.max_queries))
+
+
+def search_stage(queries, query_tracker, logger, profiler, args):
+    from scripts.serper import get_linkedin_urls_sync
+    from scripts.profiler import profile_stage
     print("Serper starting...")
     serper_start = time.time()
     # Serper Request API Limit 300 / s
-    urls = get_linkedin_urls_sync(queries, query_tracker, logger)
+    with profile_stage(profiler, "serper"):
+        urls = get_linkedin_urls_sync(queries, query_tracker, logger, profiler, args.time_limit)
     print(len(urls))
     print(f"Serper runtime: {time.time() - serper_start:.2f} seconds")
     print(f"QPS: {len(queries)/(time.time() - serper_start):.2f}")
+    return urls
+
 
-    # Debugging print
-    # pretty_urls = json.dumps(urls, indent=2)
-    # print(pretty_urls)
-    
-    # Deduplicate
+def dedup_stage(urls, query_tracker, logger, profiler, args):
+    from scripts.profiler import profile_stage
     print("Deduplicating URLs...")
-    deduplicated_urls = deduplicate_linkedin_urls(urls, query_tracker)
+    with profile_stage(profiler, "dedup"):
+        if args.frames:
+            from scripts.frames import urls_frame, deduplicate_frame, frame_to_items
+            deduplicated_urls = frame_to_items(deduplicate_frame(urls_frame(urls), query_tracker))
+        else:
+            from scripts.deduplicate import deduplicate_linkedin_urls
+            deduplicated_urls = deduplicate_linkedin_urls(urls, query_tracker)
     logger.add_deduplicated(len(deduplicated_urls))
+    if args.suppress:
+        from scripts.suppression import apply, suppress_urls
+        deduplicated_urls = apply(suppress_urls, deduplicated_urls, query_tracker, logger)
+    return deduplicated_urls
 
-    # Debugging print
-    # pretty_deduplicated = json.dumps(deduplicated_urls, indent=2)
-    # print(pretty_deduplicated)
-    # print(f"Deduplicated: {type(deduplicated_urls)}")
-    
-    # Icypeas
+
+def enrich_stage(deduplicated_urls, query_tracker, logger, profiler, args):
+    from scripts.enrich_urls import enrich_urls_sync
+    from scripts.profiler import profile_stage
     print("Enriching URLs with Icypeas...")
     icy_start = time.time()
-    icypeas_profiles = enrich_urls_sync(deduplicated_urls, query_tracker, logger)
+    with profile_stage(profiler, "icypeas"):
+        icypeas_hedger = None
+        if args.hedge:
+            from scripts.hedging import Hedger
+            icypeas_hedger = Hedger("Icypeas", logger)
+        icypeas_profiles = enrich_urls_sync(deduplicated_urls, query_tracker, logger, profiler, icypeas_hedger)
     print(f"Icy runtime: {time.time() - icy_start:.2f} seconds")
+    return icypeas_profiles
 
-    # Debugging print
-    # pretty_enrich = json.dumps(icypeas_profiles, indent=2)
-    # print(pretty_enrich)    
 
-    # Validate
+def validate_stage(icypeas_profiles, query_tracker, logger, profiler, args):
+    from scripts.validateprofile import validate_profiles
+    from scripts.profiler import profile_stage
     print("Validating profiles...")
     validate_start = time.time()
-    validated_profiles = validate_profiles(icypeas_profiles, query_tracker, logger)
+    with profile_stage(profiler, "validate"):
+        validated_profiles = validate_profiles(icypeas_profiles, query_tracker, logger, profiler)
     logger.add_matches(len(validated_profiles))
     print(f"Validation runtime: {time.time() - validate_start:.2f} seconds")
+    return validated_profiles
+
 
-    # Debugging print
-    # pretty_print = json.dumps(validated_profiles, indent=2)
-    # print(pretty_print)
-    
-    # findymail_start_response = requests.get("https://app.findymail.com/api/credits",
-    # headers={
-    #   "Authorization": f"Bearer {API_KEYS['FINDMYMAIL_API_KEY']}"
-    # })
-    # start_data = findymail_start_response.json()
-    # start_credits = start_data.get("credits")
-
-    # Findymail
+def email_stage(validated_profiles, query_tracker, logger, profiler, args):
+    from scripts.profiler import profile_stage
+    if args.suppress:
+        from scripts.suppression import apply, suppress_profiles
+        validated_profiles = apply(suppress_profiles, validated_profiles, query_tracker, logger)
     print("Finding emails with Findymail...")
     findymail_start = time.time()
-    emails = findymail_sync(validated_profiles, query_tracker, logger)
+    with profile_stage(profiler, "findymail"):
+        if args.webhook:
+            from scripts.findymail_webhook import findymail_webhook_sync
+            emails = findymail_webhook_sync(validated_profiles, query_tracker, logger, profiler)
+        else:
+            from scripts.findymail import findymail_sync
+            findymail_hedger = None
+            if args.hedge:
+                from scripts.hedging import Hedger
+                findymail_hedger = Hedger("Findymail", logger)
+            emails = findymail_sync(validated_profiles, query_tracker, logger, profiler, findymail_hedger)
     print(f"Findymail runtime: {time.time() - findymail_start:.2f} seconds")
+    if args.suppress:
+        from scripts.suppression import apply, suppress_emails
+        emails = apply(suppress_emails, emails, query_tracker, logger)
+    return emails
 
-    # findymail_end_response = requests.get("https://app.findymail.com/api/credits",
-    # headers={
-    #   "Authorization": f"Bearer {API_KEYS['FINDMYMAIL_API_KEY']}"
-    # })
-    # end_data = findymail_end_response.json()
-    # end_credits = end_data.get("credits")
-    
-    # Debugging print
-    # pretty_emails = json.dumps(emails, indent=2)
-    # print(pretty_emails)
 
-    # Done
-    final_output_df = output_results(emails, input_df)
-    final_output_df.write_csv("output.csv")
-    
-    logger.output()
-    
-    
-    print(f"Total runtime: {time.time() - all_start:.2f} seconds")
+def output_stage(emails, input_df, profiler, args):
+    from scripts.profiler import profile_stage
+    with profile_stage(profiler, "output"):
+        if args.frames:
+            from scripts.frames import output_frame
+            final_output_df = output_frame(emails, input_df)
+        else:
+            final_output_df = output_results(emails, input_df)
+        final_output_df.write_csv(args.output)
+
 
 # Function to output results into csv file
 # Needs to add all the previous columns from raw df input
@@ -145,7 +409,7 @@ profiles = {
 # One row in the raw_df means one company but there might be 0 - multiple profiles per company
 # match the profile to the company based on the "domain" value on
 # the profile dict to the 'Root Domain' column in raw_df
-def output_results(profiles, raw_df: pl.DataFrame) -> pl.DataFrame:
+def output_results(profiles, raw_df: "pl.DataFrame") -> "pl.DataFrame":
     """
     Combines profile data with an existing Polars DataFrame and formats it for output.
 
@@ -156,7 +420,9 @@ def output_results(profiles, raw_df: pl.DataFrame) -> pl.DataFrame:
     Returns:
         pl.DataFrame: A new Polars DataFrame with the combined data.
     """
-    
+    import polars as pl
+    from scripts.normalize import COMPANY_KEY
+
     # 1. Create a DataFrame from the profiles dictionary
     profile_data = []
     for search_query, profile_info in profiles.items():
@@ -182,6 +448,8 @@ def output_results(profiles, raw_df: pl.DataFrame) -> pl.DataFrame:
 
     # If no valid profiles were found, return the original DataFrame
     if not profile_data:
+        if COMPANY_KEY in raw_df.columns:
+            raw_df = raw_df.drop(COMPANY_KEY)
         return raw_df.with_columns(
             pl.lit(None, pl.Utf8).alias('Full Name'),
             pl.lit(None, pl.Utf8).alias('First Name'),
@@ -198,10 +466,15 @@ def output_results(profiles, raw_df: pl.DataFrame) -> pl.DataFrame:
     # 2. Join the raw_df with the profiles_df on the 'Root Domain' column
     # The 'left_join' ensures that all rows from the original raw_df are kept
     # and matching profile data is added. Companies without matching profiles will have nulls.
-    final_df = raw_df.join(profiles_df, on='Root Domain', how='left')
+    # When the input was collapsed to unique companies (see scripts/normalize.py) the profile domain is the
+    # normalized company key, so every original row for that company gets the profiles.
+    if COMPANY_KEY in raw_df.columns:
+        final_df = raw_df.join(profiles_df, left_on=COMPANY_KEY, right_on='Root Domain', how='left').drop(COMPANY_KEY)
+    else:
+        final_df = raw_df.join(profiles_df, on='Root Domain', how='left')
 
     return final_df
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -13,6 +13,10 @@ class Logger:
         self.total_matches = 0
         self.total_emails_found = 0
         self.total_input_companies = 0
+        self.hedged_requests = {}  # provider -> [hedges sent, hedges that won]
+        self.breaker_skips = 0  # Findymail lookups skipped by an open domain circuit breaker
+        self.key_usage = {}  # provider -> {key label: [requests, credits]}
+        self.suppressed = 0  # profiles and contacts dropped by the suppression index
 
     def add_found_email(self, count):
         with self.lock:
@@ -59,6 +63,26 @@ class Logger:
             self.total_emails_found += count
             self.findymail_credits += count  # Assuming 1 credit per found email
 
+    def add_hedge(self, provider, won):
+        with self.lock:
+            counts = self.hedged_requests.setdefault(provider, [0, 0])
+            counts[0] += 1
+            counts[1] += int(won)
+
+    def add_breaker_skip(self, count):
+        with self.lock:
+            self.breaker_skips += count
+
+    def add_suppressed(self, count):
+        with self.lock:
+            self.suppressed += count
+
+    def add_key_usage(self, provider, label, credits):
+        with self.lock:
+            counts = self.key_usage.setdefault(provider, {}).setdefault(label, [0, 0])
+            counts[0] += 1
+            counts[1] += credits
+
     def output(self):
         print(f"Total input companies: {self.total_input_companies}")
         print(f"Total queries processed: {self.total_queries_processed}")
@@ -76,5 +100,18 @@ class Logger:
         findymail_cost = self.findymail_credits * 0.00599625
         print(f"Findymail credits used & cost: {self.findymail_credits} credits (${findymail_cost:.4f})")
         
+        for provider, (hedges, wins) in self.hedged_requests.items():
+            print(f"{provider} hedged requests: {hedges} sent, {wins} answered first")
+        if self.breaker_skips:
+            print(f"Findymail lookups skipped by domain circuit breaker: {self.breaker_skips}")
+        if self.suppressed:
+            print(f"Previously delivered profiles and contacts suppressed: {self.suppressed}")
+        for provider, keys in self.key_usage.items():
+            # Only worth a breakdown when the provider has a pool of several keys
+            if len(keys) > 1:
+                unit = "tokens" if provider == "OpenAI" else "credits"
+                for label, (requests, credits) in keys.items():
+                    print(f"{provider} key {label}: {requests} requests, {credits} {unit}")
+        
         print("---------------------------------")
         print(f"Total cost: ${serper_cost + icypeas_cost + openai_cost + findymail_cost:.4f}")
\ No newline at end of file
@@ -0,0 +1,363 @@
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows, peak memory falls back to tracemalloc
+    resource = None
+
+# Micro-benchmarks for the CPU-side pipeline steps
+# Every step runs on synthetic inputs shaped like input.csv / allqueries.csv at each size, recording the best
+# wall time over REPEATS runs and the peak memory of one extra run. Peak memory is the growth of the process's
+# maximum resident set size over the step, measured in a fresh process per step and size (--peak), because
+# tracemalloc only sees Python allocations and misses the Polars/Arrow buffers of the frame steps; without the
+# resource module it falls back to tracemalloc. Results are compared against
+# BASELINE_FILE and the command exits with status 1 when a step got slower or bigger than the thresholds allow,
+# or when there is no baseline to compare against, so it can gate CI:
+#   python -m scripts.benchmark --save                      record a baseline on this machine
+#   python -m scripts.benchmark                             compare against it
+#   python -m scripts.benchmark --no-baseline-ok            only print the numbers when there is no baseline
+#   python -m scripts.benchmark --sizes 1000,10000000       other sizes (items per step, 10M takes a while)
+#   python -m scripts.benchmark --only dedup,output          a subset of the steps
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+REPEATS = 5
+TIME_THRESHOLD = 1.30  # fail when more than 30% slower than the baseline
+MEMORY_THRESHOLD = 1.20
+MIN_SECONDS = 0.02  # steps faster than this are too noisy to compare
+MIN_PEAK_BYTES = 5_000_000  # resident set sizes move in pages, smaller peaks are noise
+THREADS = 8
+CURRENT_END_DATE = "0001-01-01T00:00:00.000Z"
+FALLBACK_TITLES = ["owner", "CEO", "President", "Product Manager", "Design Engineer", "Marketing Director"]
+
+
+# Company names, domains and job titles from input.csv when present, repeated with a suffix to reach any size
+def sample_shapes(path="input.csv"):
+    companies, titles = [("Corza Ophthalmology", "corzaeye.com")], FALLBACK_TITLES
+    if os.path.exists(path):
+        import polars as pl
+        df = pl.read_csv(path, columns=["company", "Root Domain", "job titles"])
+        pairs = df.select("company", "Root Domain").drop_nulls().unique(maintain_order=True).rows()
+        companies = pairs or companies
+        if df["job titles"][0]:
+            titles = [title.strip() for title in df["job titles"][0].split(",")]
+    return companies, titles
+
+
+def synthetic_companies(n, shapes):
+    companies, _ = shapes
+    out = []
+    for i in range(n):
+        name, domain = companies[i % len(companies)]
+        stem, _, tld = domain.rpartition(".")
+        out.append({"company": f"{name} {i}", "Root Domain": f"{stem}{i}.{tld}"})
+    return out
+
+
+# n Serper results, 70% with a URL and roughly a third of those duplicates
+def synthetic_urls(n, shapes):
+    _, titles = shapes
+    rng = random.Random(n)
+    urls = {}
+    for i in range(n):
+        title = titles[i % len(titles)]
+        company = i // (2 * len(titles))
+        url = f"https://www.linkedin.com/in/person-{rng.randrange(max(1, n // 2))}" if rng.random() < 0.7 else ""
+        urls[f"co{company}.com {title} site:linkedin.com/in #{i}"] = {
+            "url": url, "company": f"Company {company}", "title": title, "domain": f"co{company}.com"
+        }
+    return urls
+
+
+def synthetic_enrichments(n):
+    rng = random.Random(n)
+    enrichments = {}
+    for i in range(n):
+        works_for = [
+            {"name": f"Past {j}", "jobTitle": "Engineer", "endDate": "2019-06-01T00:00:00.000Z"}
+            for j in range(rng.randrange(4))
+        ]
+        works_for.insert(rng.randrange(len(works_for) + 1), {"name": f"Company {i}", "jobTitle": "CEO", "endDate": CURRENT_END_DATE})
+        enrichments[f"q{i}"] = {
+            "URL": f"https://www.linkedin.com/in/person-{i}", "company": f"Company {i}", "domain": f"co{i}.com",
+            "job_titles": ["CEO"], "icypeas_response": {"firstname": "A", "lastname": "B", "worksFor": works_for},
+        }
+    return enrichments
+
+
+# n validated profiles spread over n / 2 companies, joined to an input frame with 3 rows per company
+def synthetic_output(n):
+    import polars as pl
+    from .normalize import add_company_key
+    companies = max(1, n // 2)
+    profiles = {
+        f"co{i % companies}.com CEO site:linkedin.com/in #{i}": {
+            "URL": f"https://www.linkedin.com/in/person-{i}", "domain": f"co{i % companies}.com",
+            "validation_result": {"valid": True, "firstname": "A", "lastname": "B", "currentCompany": "C",
+                                  "currentJobTitle": "CEO", "findmymail": "a@b.com"},
+            "openAI_usage": "300",
+        } for i in range(n)
+    }
+    raw_df = add_company_key(pl.DataFrame({
+        "Root Domain": [f"https://www.co{i % companies}.com/shop" for i in range(3 * companies)],
+        "company": [f"Company {i % companies}" for i in range(3 * companies)],
+    }))
+    return profiles, raw_df
+
+
+def run_threads(n, func):
+    per_thread = max(1, n // THREADS)
+    threads = [threading.Thread(target=lambda: [func(i) for i in range(per_thread)]) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# name -> (setup(n, shapes) -> args, step(*args)), setup is not timed
+# workdir: scratch directory for the steps that write files, removed by the caller
+def benchmarks(workdir):
+    from .queries import gen_queries
+    from .deduplicate import deduplicate_linkedin_urls
+    from .validateprofile import current_work, current_role_candidates
+    from .Logger import Logger
+    from .query_tracker import QueryTracker
+    from . import frames
+    from main import output_results
+
+    def tracker_setup(n, shapes):
+        # QueryTracker truncates the file, so every run starts from an empty one
+        return (n, QueryTracker(os.path.join(workdir, "allqueries.csv")))
+
+    return {
+        "gen_queries": (
+            lambda n, shapes: (synthetic_companies(max(1, n // (2 * len(shapes[1]))), shapes), shapes[1]),
+            lambda companies, titles: gen_queries(companies, titles, None),
+        ),
+        "queries_frame": (
+            lambda n, shapes: (synthetic_companies(max(1, n // (2 * len(shapes[1]))), shapes), shapes[1]),
+            frames.queries_frame,
+        ),
+        "dedup": (
+            lambda n, shapes: (synthetic_urls(n, shapes),),
+            lambda urls: deduplicate_linkedin_urls(urls, _NullTracker()),
+        ),
+        "dedup_frame": (
+            lambda n, shapes: (synthetic_urls(n, shapes),),
+            lambda urls: frames.deduplicate_frame(frames.urls_frame(urls), _NullTracker()),
+        ),
+        "current_work": (
+            lambda n, shapes: ([profile["icypeas_response"]["worksFor"] for profile in synthetic_enrichments(n).values()],),
+            lambda works: [current_work(works_for) for works_for in works],
+        ),
+        "current_roles_loop": (
+            lambda n, shapes: (synthetic_enrichments(n),),
+            current_roles_loop,
+        ),
+        "current_roles_frame": (
+            lambda n, shapes: (synthetic_enrichments(n),),
+            current_role_candidates,
+        ),
+        "logger_contention": (
+            lambda n, shapes: (n, Logger()),
+            lambda n, logger: run_threads(n, lambda i: logger.add_serper(1)),
+        ),
+        "query_tracker_log": (
+            tracker_setup,
+            lambda n, tracker: run_threads(n, lambda i: tracker.log(f"query {i}", "Profile validated but no email found")),
+        ),
+        "output_results": (
+            lambda n, shapes: synthetic_output(n),
+            output_results,
+        ),
+        "output_frame": (
+            lambda n, shapes: synthetic_output(n),
+            frames.output_frame,
+        ),
+    }
+
+
+# Same result as validateprofile.current_role_candidates written as a plain loop, the reference for the
+# frame version (current_work only finds the first current role and applies no company rules)
+def current_roles_loop(cleaned_enrichments):
+    import polars as pl
+    from .validateprofile import CURRENT_END_DATES, MAX_CANDIDATE_ROLES, domain_name, normalized_company_key as normalized
+
+    # Domain names need the public-suffix rules of the shared expression, applied to all profiles at once
+    domains = pl.DataFrame({"domain": [profile.get("domain") for profile in cleaned_enrichments.values()]}, schema={"domain": pl.Utf8})
+    domains = dict(zip(cleaned_enrichments, domains.select(domain_name("domain"))["domain"].to_list()))
+    candidates = {}
+    for query, profile in cleaned_enrichments.items():
+        works_for = (profile.get("icypeas_response") or {}).get("worksFor") or ()
+        current = [(index, work) for index, work in enumerate(works_for) if work.get("endDate") in CURRENT_END_DATES]
+        if not current:
+            continue
+        target = normalized(profile.get("company"))
+        domain = domains[query]
+        roles = []
+        for index, work in current:
+            company = normalized(work.get("name"))
+            rule = bool(company) and company in (target, domain)
+            roles.append({"role_index": index, "name": work.get("name"), "jobTitle": work.get("jobTitle"), "company_rule": rule})
+        roles.sort(key=lambda role: not role["company_rule"])
+        candidates[query] = roles[:MAX_CANDIDATE_ROLES]
+    return candidates
+
+
+class _NullTracker:
+    def log(self, query, exit_reason):
+        pass
+
+
+# Maximum resident set size of this process in bytes
+def max_rss():
+    # On Linux VmHWM is this process's own high-water mark, ru_maxrss can still hold the parent's from the fork
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+# Reset VmHWM to the current resident set size, so it only covers what runs next (Linux only, elsewhere the
+# setup's own peak can hide a smaller step peak)
+def reset_max_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# Peak memory of one run of a step, in this process: python -m scripts.benchmark --peak <name> <n>
+def step_peak(name, n):
+    with tempfile.TemporaryDirectory() as workdir:
+        setup, step = benchmarks(workdir)[name]
+        args = setup(n, sample_shapes())
+        gc.collect()
+        reset_max_rss()
+        before = max_rss()
+        step(*args)
+        return max_rss() - before
+
+
+def traced_peak(setup, step, n, shapes):
+    args = setup(n, shapes)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        step(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, setup, step, n, shapes):
+    seconds = None
+    for _ in range(REPEATS if n < 1_000_000 else 1):
+        args = setup(n, shapes)
+        gc.collect()
+        start = time.perf_counter()
+        step(*args)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    # The two measures are stored under different names, a baseline is only compared with the same kind
+    if resource is None:
+        return {"seconds": round(seconds, 6), "peak_traced_bytes": traced_peak(setup, step, n, shapes)}
+    child = subprocess.run(
+        [sys.executable, "-m", "scripts.benchmark", "--peak", name, str(n)], capture_output=True, text=True, check=True
+    )
+    return {"seconds": round(seconds, 6), "peak_rss_bytes": int(child.stdout.split()[-1])}
+
+
+# Size of the OpenAI request body per fuzzy-match check, a proxy for input tokens
+def prompt_sizes():
+    from .openAI import COMPANY_SYSTEM_PROMPT, JOB_TITLE_SYSTEM_PROMPT
+    company = json.dumps({"target": "Electro-Harmonix", "candidate": "Electro-Harmonix / New Sensor Corp."})
+    title = json.dumps({"targets": FALLBACK_TITLES, "candidate": "Senior Design Engineer"})
+    return {
+        "openai_company_bytes": len(COMPANY_SYSTEM_PROMPT.encode("utf-8")) + len(company),
+        "openai_job_title_bytes": len(JOB_TITLE_SYSTEM_PROMPT.encode("utf-8")) + len(title),
+    }
+
+
+# Return: list of regression messages
+def compare(results, baseline):
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if "seconds" in result and base["seconds"] >= MIN_SECONDS and result["seconds"] > base["seconds"] * TIME_THRESHOLD:
+            regressions.append(f"{key}: {result['seconds']:.4f}s vs baseline {base['seconds']:.4f}s")
+        for peak in ("peak_rss_bytes", "peak_traced_bytes"):
+            if peak in result and base.get(peak, 0) >= MIN_PEAK_BYTES and result[peak] > base[peak] * MEMORY_THRESHOLD:
+                regressions.append(f"{key}: peak {result[peak] / 1e6:.1f}MB vs baseline {base[peak] / 1e6:.1f}MB")
+        if "bytes" in result and result["bytes"] > base["bytes"]:
+            regressions.append(f"{key}: {result['bytes']} bytes vs baseline {base['bytes']} bytes")
+    return regressions
+
+
+def main(argv):
+    if "--peak" in argv:
+        name, n = argv[argv.index("--peak") + 1:argv.index("--peak") + 3]
+        print(step_peak(name, int(n)))
+        return 0
+    save = "--save" in argv
+    no_baseline_ok = "--no-baseline-ok" in argv
+    sizes = DEFAULT_SIZES
+    only = None
+    if "--sizes" in argv:
+        sizes = [int(size) for size in argv[argv.index("--sizes") + 1].split(",")]
+    if "--only" in argv:
+        only = set(argv[argv.index("--only") + 1].split(","))
+
+    shapes = sample_shapes()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, (setup, step) in benchmarks(workdir).items():
+            if only and name not in only:
+                continue
+            for n in sizes:
+                result = measure(name, setup, step, n, shapes)
+                results[f"{name}[{n}]"] = result
+                peak = result.get("peak_rss_bytes", result.get("peak_traced_bytes"))
+                print(f"{name:22} {n:>10}  {result['seconds']:9.4f}s  peak {peak / 1e6:9.1f}MB")
+    for name, size in prompt_sizes().items():
+        results[name] = {"bytes": size}
+        print(f"{name:22} {size:>10} bytes")
+
+    if save:
+        baseline = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {BASELINE_FILE}")
+        return 0
+    if not os.path.exists(BASELINE_FILE):
+        print(f"No baseline at {BASELINE_FILE}, run with --save first")
+        return 0 if no_baseline_ok else 1
+    with open(BASELINE_FILE, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
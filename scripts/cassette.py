@@ -0,0 +1,190 @@
+import asyncio
+import collections
+import contextlib
+import gzip
+import hashlib
+import json
+import threading
+import time
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+# Record/replay of provider HTTP traffic
+# In record mode every provider request made through http_post/requests_post is performed normally and the
+# response (status, raw body, observed latency) is written to a gzipped JSON lines cassette, replacing an
+# earlier recording at the same path.
+# In replay mode nothing goes over the network: responses are served from the cassette, matched by method,
+# URL and request body (first-in first-out for repeats), after sleeping the recorded latency * time_scale.
+# Body fields in UNKEYED_FIELDS differ between runs (webhook URLs carry a random correlation id) and are left
+# out of the match. A request without a recorded response raises CassetteMiss, which stops the run instead of
+# being logged as a provider error like the other per-item failures.
+# API keys and other headers are never written to the cassette.
+#
+# Enable with CASSETTE_MODE in main.py, or programmatically with start_recording/start_replay/stop.
+
+# The active cassette, None means plain network requests
+active = None
+UNKEYED_FIELDS = {"webhook_url"}
+
+
+# Raised in replay mode when a request has no recorded response left
+# Stage modules re-raise it from their per-item error handlers, a replay that diverges from the recording
+# would otherwise finish with made-up results
+class CassetteMiss(Exception):
+    pass
+
+
+def _request_key(method, url, json_body=None, data=None):
+    if isinstance(json_body, dict):
+        json_body = {field: value for field, value in json_body.items() if field not in UNKEYED_FIELDS}
+    if json_body is not None:
+        body = json.dumps(json_body, sort_keys=True, separators=(",", ":"))
+    elif data is not None:
+        body = data.decode("utf-8") if isinstance(data, bytes) else str(data)
+    else:
+        body = ""
+    digest = hashlib.sha1(body.encode("utf-8")).hexdigest()
+    return f"{method} {url} {digest}"
+
+
+class Cassette:
+    def __init__(self, path, mode, time_scale=1.0):
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.lock = threading.Lock()
+        self.count = 0
+        if mode == "record":
+            self.file = gzip.open(path, "wt", encoding="utf-8")
+            self.recorded = None
+        else:
+            self.file = None
+            self.recorded = collections.defaultdict(collections.deque)
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recorded[entry["key"]].append(entry)
+
+    def record(self, key, url, status, body, latency):
+        line = json.dumps({"key": key, "url": url, "status": status, "body": body.decode("utf-8", errors="surrogateescape"), "latency": round(latency, 6)})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.count += 1
+
+    def take(self, key):
+        with self.lock:
+            entries = self.recorded.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded response for {key}")
+            self.count += 1
+            return entries.popleft()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Response object handed back to the stage modules, supports the subset of the aiohttp/requests APIs they use
+class CassetteResponse:
+    def __init__(self, url, status, body):
+        self.url = url
+        self.status = status
+        self.status_code = status  # requests naming
+        self.body = body
+
+    async def read(self):
+        return self.body
+
+    @property
+    def content(self):
+        return self.body
+
+    # requests exposes .text as an attribute, aiohttp callers only use read()/json()
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json_sync(self):
+        return json.loads(self.body)
+
+    async def json(self, **kwargs):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            request_url = URL(self.url)
+            request_info = aiohttp.RequestInfo(request_url, "POST", CIMultiDictProxy(CIMultiDict()), request_url)
+            raise aiohttp.ClientResponseError(request_info, (), status=self.status, message="recorded error response")
+
+
+# requests.Response stand-in, json() is synchronous there
+class _SyncCassetteResponse(CassetteResponse):
+    def json(self, **kwargs):
+        return self.json_sync()
+
+
+# Drop-in for "async with session.post(url, ...) as response:"
+@contextlib.asynccontextmanager
+async def http_post(session, url, headers=None, json=None, data=None):
+    cassette = active
+    if cassette is None:
+        async with session.post(url, headers=headers, json=json, data=data) as response:
+            yield response
+        return
+    key = _request_key("POST", url, json, data)
+    if cassette.mode == "replay":
+        entry = cassette.take(key)
+        if cassette.time_scale:
+            await asyncio.sleep(entry["latency"] * cassette.time_scale)
+        yield CassetteResponse(url, entry["status"], entry["body"].encode("utf-8", errors="surrogateescape"))
+        return
+    start = time.perf_counter()
+    async with session.post(url, headers=headers, json=json, data=data) as response:
+        body = await response.read()
+        latency = time.perf_counter() - start
+        cassette.record(key, url, response.status, body, latency)
+    yield CassetteResponse(url, response.status, body)
+
+
+# Drop-in for requests.post(url, headers=..., json=...)
+def requests_post(url, headers=None, json=None):
+    import requests
+
+    cassette = active
+    if cassette is None:
+        return requests.post(url, headers=headers, json=json)
+    key = _request_key("POST", url, json)
+    if cassette.mode == "replay":
+        entry = cassette.take(key)
+        if cassette.time_scale:
+            time.sleep(entry["latency"] * cassette.time_scale)
+        return _SyncCassetteResponse(url, entry["status"], entry["body"].encode("utf-8", errors="surrogateescape"))
+    start = time.perf_counter()
+    response = requests.post(url, headers=headers, json=json)
+    latency = time.perf_counter() - start
+    cassette.record(key, url, response.status_code, response.content, latency)
+    return _SyncCassetteResponse(url, response.status_code, response.content)
+
+
+def start_recording(path):
+    global active
+    active = Cassette(path, "record")
+    print(f"Recording provider traffic to {path}")
+
+
+# time_scale: 1.0 replays the recorded latencies, 0.5 twice as fast, 0 without any delay
+def start_replay(path, time_scale=1.0):
+    global active
+    active = Cassette(path, "replay", time_scale)
+    print(f"Replaying provider traffic from {path} (time scale {time_scale})")
+
+
+def stop():
+    global active
+    if active is not None:
+        active.close()
+        print(f"Cassette {active.mode}: {active.count} responses")
+        active = None
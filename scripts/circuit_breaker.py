@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import time
+
+# Per-domain circuit breaker for Findymail lookups
+# When Findymail answers with no email for several people at a domain in a row, the remaining lookups
+# for that domain almost always fail too. After misses for FAILURE_THRESHOLD different names in a row the breaker
+# for the domain opens and its remaining lookups are skipped with the tracker reason "Findymail circuit open for
+# domain". Misses are counted per name, so re-running a list does not count the same person again.
+# Until a domain has produced an email, at most FAILURE_THRESHOLD of its lookups are in flight at once, so the
+# breaker can open before the rest of the domain's lookups have taken a concurrency slot.
+# State is kept in BREAKER_FILE across runs; open breakers and failure counts expire after BREAKER_TTL seconds.
+BREAKER_FILE = "findymail_breakers.json"
+FAILURE_THRESHOLD = 3
+BREAKER_TTL = 7 * 24 * 3600
+
+
+class DomainBreaker:
+    def __init__(self, filename=BREAKER_FILE, threshold=FAILURE_THRESHOLD, ttl=BREAKER_TTL):
+        self.filename = filename
+        self.threshold = threshold
+        self.ttl = ttl
+        self.state = {}  # domain -> {"misses": names missed since the last email, "updated": time of last change}
+        self.proven = set()  # domains with an email found in this run, not limited to threshold probes
+        self.probes = {}  # domain -> asyncio.Semaphore(threshold)
+        if filename and os.path.exists(filename):
+            with open(filename, encoding="utf-8") as f:
+                now = time.time()
+                # Entries without names (older state files) are dropped, they cannot tell people apart
+                self.state = {
+                    domain: entry for domain, entry in json.load(f).items()
+                    if "misses" in entry and now - entry.get("updated", 0) < ttl
+                }
+
+    def is_open(self, domain):
+        entry = self.state.get(domain)
+        return entry is not None and len(entry["misses"]) >= self.threshold
+
+    # name: the person looked up, a repeated miss for the same name is not counted again
+    def record(self, domain, name, found):
+        if found:
+            self.state.pop(domain, None)
+            self.proven.add(domain)
+            return
+        entry = self.state.setdefault(domain, {"misses": [], "updated": 0})
+        key = name.strip().lower()
+        if key not in entry["misses"]:
+            entry["misses"].append(key)
+            entry["updated"] = time.time()
+
+    # Run lookup() for domain unless its breaker is open
+    # Return: (True, lookup result) or (False, None) when skipped
+    async def call(self, domain, lookup):
+        if not domain or self.threshold <= 0:
+            return True, await lookup()
+        if self.is_open(domain):
+            return False, None
+        if domain in self.proven:
+            return True, await lookup()
+        probes = self.probes.setdefault(domain, asyncio.Semaphore(self.threshold))
+        async with probes:
+            # Re-check, the breaker may have opened while this lookup waited for a probe
+            if self.is_open(domain):
+                return False, None
+            return True, await lookup()
+
+    def save(self):
+        if not self.filename:
+            return
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.filename)
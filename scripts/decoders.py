@@ -0,0 +1,147 @@
+import functools
+import json
+import typing
+from typing import List, Optional, TypedDict
+
+try:
+    import msgspec
+except ImportError:  # in the README install command, the stdlib fallback below decodes the same fields without it
+    msgspec = None
+
+# Typed decoding of provider responses
+# Each schema lists only the fields the pipeline reads, everything else in the response is skipped while
+# decoding. Decoded values are plain dicts/lists so the stage modules keep using .get() on them.
+# With msgspec installed (pip install msgspec) decoding and validation happen in one C pass, otherwise
+# json.loads is used and the result is projected and checked against the same schemas in Python.
+
+
+# Raised for a response that is not JSON or does not match the schema
+# code: "<provider>.json" (not valid JSON) or "<provider>.schema" (wrong shape), detail says where
+class DecodeError(ValueError):
+    def __init__(self, provider, code, detail):
+        super().__init__(f"{code}: {detail}")
+        self.provider = provider
+        self.code = code
+        self.detail = detail
+
+
+# Serper: [{"organic": [{"link", "title", "snippet"}, ...]}] (one entry per search in the batch payload)
+class SerperOrganic(TypedDict, total=False):
+    link: str
+    title: str
+    snippet: str
+
+
+class SerperSearch(TypedDict, total=False):
+    organic: List[SerperOrganic]
+
+
+# Icypeas bulk scrape: {"success", "data": [{"status", "result": {"url", "firstname", "lastname", "worksFor"}}]}
+class IcypeasWork(TypedDict, total=False):
+    name: Optional[str]
+    jobTitle: Optional[str]
+    endDate: Optional[str]
+
+
+class IcypeasProfile(TypedDict, total=False):
+    url: Optional[str]
+    firstname: Optional[str]
+    lastname: Optional[str]
+    worksFor: Optional[List[IcypeasWork]]
+
+
+class IcypeasItem(TypedDict, total=False):
+    status: str
+    result: Optional[IcypeasProfile]
+
+
+class IcypeasBulk(TypedDict, total=False):
+    success: bool
+    data: List[IcypeasItem]
+
+
+# OpenAI chat completion: {"choices": [{"message": {"content"}}], "usage": {"total_tokens"}}
+class OpenAIMessage(TypedDict, total=False):
+    content: Optional[str]
+
+
+class OpenAIChoice(TypedDict, total=False):
+    message: OpenAIMessage
+
+
+class OpenAIUsage(TypedDict, total=False):
+    total_tokens: int
+
+
+class OpenAICompletion(TypedDict, total=False):
+    choices: List[OpenAIChoice]
+    usage: Optional[OpenAIUsage]
+
+
+# Findymail name search: {"contact": {"email"}}
+class FindymailContact(TypedDict, total=False):
+    email: Optional[str]
+
+
+class FindymailSearch(TypedDict, total=False):
+    contact: Optional[FindymailContact]
+
+
+def _make_decoder(provider, schema):
+    if msgspec is not None:
+        decoder = msgspec.json.Decoder(schema)
+
+        def decode(raw):
+            try:
+                return decoder.decode(raw)
+            except msgspec.ValidationError as e:
+                raise DecodeError(provider, f"{provider}.schema", str(e)) from None
+            except msgspec.DecodeError as e:
+                raise DecodeError(provider, f"{provider}.json", str(e)) from None
+        return decode
+
+    def decode(raw):
+        try:
+            value = json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise DecodeError(provider, f"{provider}.json", str(e)) from None
+        return _project(value, schema, provider, "$")
+    return decode
+
+
+# Field name -> schema of a TypedDict, resolved once per schema instead of once per decoded object
+@functools.lru_cache(maxsize=None)
+def _fields(schema):
+    return tuple(typing.get_type_hints(schema).items())
+
+
+# Keep only the schema fields of value and check their types, mirrors msgspec's TypedDict decoding
+def _project(value, schema, provider, path):
+    origin = typing.get_origin(schema)
+    if origin is typing.Union:
+        if value is None:
+            return None
+        schema = next(arg for arg in typing.get_args(schema) if arg is not type(None))
+        return _project(value, schema, provider, path)
+    if origin is list:
+        if not isinstance(value, list):
+            raise DecodeError(provider, f"{provider}.schema", f"Expected `array`, got `{type(value).__name__}` - at `{path}`")
+        item_schema = typing.get_args(schema)[0]
+        return [_project(item, item_schema, provider, f"{path}[{i}]") for i, item in enumerate(value)]
+    if isinstance(schema, type) and issubclass(schema, dict):
+        if not isinstance(value, dict):
+            raise DecodeError(provider, f"{provider}.schema", f"Expected `object`, got `{type(value).__name__}` - at `{path}`")
+        return {
+            name: _project(value[name], field_schema, provider, f"{path}.{name}")
+            for name, field_schema in _fields(schema) if name in value
+        }
+    # bool is an int subclass in Python, keep them apart like msgspec does
+    if not isinstance(value, schema) or (schema is int and isinstance(value, bool)):
+        raise DecodeError(provider, f"{provider}.schema", f"Expected `{schema.__name__}`, got `{type(value).__name__}` - at `{path}`")
+    return value
+
+
+decode_serper = _make_decoder("serper", List[SerperSearch])
+decode_icypeas = _make_decoder("icypeas", IcypeasBulk)
+decode_openai = _make_decoder("openai", OpenAICompletion)
+decode_findymail = _make_decoder("findymail", FindymailSearch)
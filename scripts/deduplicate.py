@@ -4,6 +4,7 @@ import re
 # Log which queries were removed due to duplication
 # Input: {<query1>: {url: <found linkedin url or blank>, company: <company_name>, title: <job_title>}...
 #         <queryN>: {url: <found linkedin url or blank>, company: <company_name>, title: <job_title>}...}
+#        Consolidated queries (see queries.gen_consolidated_queries) also carry matched_titles: [...]
 #       QueryTracker: tracker object
 # Return: Dictionary, with {"[query]": { url: <url>, job_titles: [...], company: <company> }}
 def deduplicate_linkedin_urls(url_dict, tracker):
@@ -17,18 +18,18 @@ def deduplicate_linkedin_urls(url_dict, tracker):
     for query, data in url_dict.items():
         try:
             url = data.get('url')
-            job_title = data.get('title')
+            job_titles = data.get('matched_titles') or [data.get('title')]
             company = data.get('company')
             domain = data.get('domain')
             if url:
                 if linkedin_profile_pattern.search(url):
                     if url in seen_urls:
-                        seen_urls[url]['job_titles'].append(job_title)
+                        seen_urls[url]['job_titles'].extend(job_titles)
                         tracker.log(query, f"Duplicate URL found: {url}")
                     else:
                         seen_urls[url] = {
                             'url': url,
-                            'job_titles': [job_title],
+                            'job_titles': list(job_titles),
                             'query': query,
                             'company': company,
                             'domain': domain
@@ -1,8 +1,13 @@
 import aiohttp
 import asyncio
+import contextlib
 import json
 import math
-from .creds import API_KEYS
+from . import cassette
+from .cassette import http_post, CassetteMiss
+from .decoders import decode_icypeas, DecodeError
+from .key_pool import icypeas_keys
+from .retry import TransientError, RETRYABLE_STATUSES, is_retryable, retry_async, dead_letters
 
 # Parallel Process Enrich LinkedIn URLs
 # Use bulk search function to do a request to ICYPEAS API and get data and match the query to the response
@@ -21,19 +26,31 @@ from .creds import API_KEYS
 # }
 # Use async to do multiple requests without going over the 20 requests/sec limit
 # Create batches of the input of linkedin_urls with a maximum of 50 but make it modular for testing purposes
-async def enrich_urls(linkedin_urls, tracker, logger):
+# session, semaphore and rate_limiter can be passed in to share them between runs (see scripts/service.py)
+# hedger: optional Hedger that duplicates batches running past the learned latency threshold
+async def enrich_urls(linkedin_urls, tracker, logger, session=None, semaphore=None, rate_limiter=None, hedger=None):
     enriched_profiles = {}
     BATCH_SIZE = 50
-    MAX_REQUESTS_PER_SECOND = 20  # Adjustable, matches ICYPEAS API limit
+    # 20 per Icypeas key (API limit), each key's requests per second are limited in the key pool and shared
+    # with other runs on this host
+    MAX_REQUESTS_PER_SECOND = icypeas_keys.total_limit()
 
     # Create semaphore to limit concurrent requests
-    semaphore = asyncio.Semaphore(MAX_REQUESTS_PER_SECOND)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_REQUESTS_PER_SECOND)
+    # No limit on top of the per-key limits unless one is passed in
+    if rate_limiter is None:
+        rate_limiter = contextlib.nullcontext()
     
     # Calculate the number of batches needed
     num_profiles = len(linkedin_urls)
     num_batches = math.ceil(num_profiles / BATCH_SIZE)
     batches = []
     keys = list(linkedin_urls.keys())
+    # Dedup order follows the order Serper results arrived in, which differs between runs. Batches are cut
+    # from URL order when recording or replaying so the same request bodies are sent both times.
+    if cassette.active is not None:
+        keys.sort(key=lambda query: linkedin_urls[query]["url"])
 
     # Create batches of URLs
     for i in range(num_batches):
@@ -44,103 +61,156 @@ async def enrich_urls(linkedin_urls, tracker, logger):
         batches.append(batch)
 
     # Process batches asynchronously
-    async def process_batch(batch, batch_idx):
+    async def limited_bulk_search(batch):
+        async with semaphore:
+            async with rate_limiter:
+                if hedger is not None:
+                    # The duplicate takes its own slot and token, the primary keeps the ones held here
+                    # Each response is reported to the key pool as it arrives, so a loser's credits are not lost, but
+                    # only the response that is used is recorded, so tracker rows and profiles count the batch once
+                    return await bulk_search(batch, tracker, logger, session, fetch=lambda: hedger.run(
+                        lambda: fetch_bulk_search(batch, logger, session), lambda: limited_fetch_once(batch)))
+                return await bulk_search(batch, tracker, logger, session)
+
+    async def limited_fetch_once(batch):
         async with semaphore:
-            try:
-                result = await bulk_search(batch, tracker, logger)
-                return result
-            except Exception as e:
+            async with rate_limiter:
+                return await fetch_bulk_search(batch, logger, session)
+
+    # Transient failures are retried outside the semaphore so backoff does not hold a slot,
+    # batches that keep failing are dead-lettered per profile instead of being dropped
+    async def process_batch(batch, batch_idx):
+        try:
+            return await retry_async(limited_bulk_search, batch)
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                for query, item in batch.items():
+                    tracker.log(query, f"Icypeas retries exhausted, dead-lettered: {e}")
+                    dead_letters.add("icypeas", query, item, e)
+            else:
                 tracker.log("bulk_search_error", f"Batch {batch_idx} generated an exception: {e}")
-                return {}
+            return {}
 
     tasks = []
     for batch_idx, batch in enumerate(batches):
         tasks.append(asyncio.create_task(process_batch(batch, batch_idx)))
 
-    # Collect results with rate limiting
-    start_time = asyncio.get_event_loop().time()
-    delay_per_request = 1.0 / MAX_REQUESTS_PER_SECOND
+    # Collect results, request rate is already limited per batch above
     for idx, future in enumerate(await asyncio.gather(*tasks, return_exceptions=True)):
         if isinstance(future, dict):
             enriched_profiles.update(future)
+        elif isinstance(future, CassetteMiss):
+            raise future
         else:
             tracker.log("bulk_search_error", f"Batch {idx} generated an exception: {future}")
 
-        # Rate limiting logic
-        time_taken = asyncio.get_event_loop().time() - start_time
-        if time_taken < delay_per_request and idx < len(tasks) - 1:
-            await asyncio.sleep(delay_per_request - time_taken)
-        start_time = asyncio.get_event_loop().time()
-
     return enriched_profiles
 
 # Bulk search profiles using Icypeas API
 # Maximum of 50 profiles per request
 # Returns a dictionary with the following format:
 # The return order of profiles is the same as the order of the input URLs
-async def bulk_search(input_data, tracker, logger):
+# A shared session can be passed in, otherwise one is opened for this request
+# fetch: optional coroutine factory used instead of fetch_bulk_search, e.g. a hedged fetch
+# Raises TransientError / aiohttp.ClientError for failures worth retrying (see enrich_urls.process_batch)
+async def bulk_search(input_data, tracker, logger, session=None, fetch=None):
+    try:
+        if fetch is None:
+            data = await fetch_bulk_search(input_data, logger, session)
+        else:
+            data = await fetch()
+        return record_bulk_search(input_data, data, tracker, logger)
+    except KeyError as e:
+        tracker.log(list(input_data.keys())[0], f"Missing API key: {e}")
+        return {}
+    except aiohttp.ClientError as e:
+        if is_retryable(e):
+            raise
+        tracker.log(list(input_data.keys())[0], f"Bulk search request error: {e}")
+        return {}
+    except DecodeError as e:
+        tracker.log(list(input_data.keys())[0], f"Bulk search JSON decode error: {e}")
+        return {}
+
+# Send one bulk scrape request without recording its result, so a hedged duplicate that loses is not logged
+# Every response is reported to the key pool here, including a losing duplicate's, it was really sent and paid for
+# Return: decoded response for a 200
+# Raises: TransientError, aiohttp.ClientError, DecodeError, KeyError (no API key), handled in bulk_search
+async def fetch_bulk_search(input_data, logger, session=None):
     bulk_url = "https://app.icypeas.com/api/scrape"
-    API_key = API_KEYS["ICYPEAS_API_KEY"]
 
     body = {
         "type": "profile",
         "data": [v['url'] for v in input_data.values()]
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": API_key
-    }
+    async with icypeas_keys.use() as key:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": key.key
+        }
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await _bulk_search_request(session, bulk_url, body, headers, key, logger)
+        return await _bulk_search_request(session, bulk_url, body, headers, key, logger)
+
+async def _bulk_search_request(session, bulk_url, body, headers, key, logger):
+    async with http_post(session, bulk_url, json=body, headers=headers) as response:
+        if response.status != 200:
+            icypeas_keys.report(key, response.status, logger)
+        if response.status in RETRYABLE_STATUSES:
+            raise TransientError("Icypeas", response.status)
+        response.raise_for_status()
+        data = decode_icypeas(await response.read())
+    # 1.5 credits per profile found, see Logger.output
+    icypeas_keys.report(key, 200, logger, cost=1.5 * sum(
+        1 for profile_data in data.get("data") or [] if profile_data.get("status") == "FOUND"
+    ) if data.get("success", False) else 0)
+    return data
+
+# Log and count a bulk scrape response and map each returned profile back to its query
+def record_bulk_search(input_data, data, tracker, logger):
     result = {}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(bulk_url, json=body, headers=headers) as response:
-                response.raise_for_status()
-                data = await response.json()
-                if not data.get("success", False):
-                    for query in input_data.keys():
-                        tracker.log(query, f"Bulk search API returned unsuccessful: {data}")
-                    return result
-
-                # Use helper function to make sure each query matches the correspondent profile
-                for query, input_item, profile_data in zip(input_data.keys(), input_data.values(), data.get("data")):
-                    result_data = profile_data.get("result")
-                    if profile_data.get("status") == "FOUND":
-                        logger.add_icypeas(1)
-                        first_name = result_data.get("firstname")
-                        last_name = result_data.get("lastname")
-                        if first_name and last_name:
-                            result_data = profile_data.get("result")
-                            worksFor = result_data.get("worksFor")
-                            result[query] = {
-                                "URL": input_item['url'],
-                                "job_titles": input_item['job_titles'],
-                                "company": input_item['company'],
-                                "domain": input_item['domain'],
-                                "icypeas_response": {
-                                    "URL": result_data.get("url"),
-                                    "status": profile_data.get("status"),
-                                    "firstname": first_name,
-                                    "lastname": last_name,
-                                    "worksFor": worksFor
-                                }
-                            }
-                        else:
-                            tracker.log(query, f"Profile not found in ICYPEAS: {input_item['url']}")
-                    else:
-                        tracker.log(query, f"Profile not found in ICYPEAS: {input_item['url']}")
-                
-                return result
-    except aiohttp.ClientResponseError as e:
-        tracker.log(list(input_data.keys())[0], f"Bulk search request error: {e}")
-        return {"success": False, "data": []}
-    except aiohttp.ClientError as e:
-        tracker.log(list(input_data.keys())[0], f"Bulk search request error: {e}")
-        return {"success": False, "data": []}
-    except json.JSONDecodeError as e:
-        tracker.log(list(input_data.keys())[0], f"Bulk search JSON decode error: {e}")
-        return {"success": False, "data": []}
+    if not data.get("success", False):
+        for query in input_data.keys():
+            tracker.log(query, f"Bulk search API returned unsuccessful: {data}")
+        return result
+
+    # Use helper function to make sure each query matches the correspondent profile
+    for query, input_item, profile_data in zip(input_data.keys(), input_data.values(), data.get("data")):
+        result_data = profile_data.get("result")
+        if profile_data.get("status") == "FOUND":
+            logger.add_icypeas(1)
+            first_name = result_data.get("firstname")
+            last_name = result_data.get("lastname")
+            if first_name and last_name:
+                result_data = profile_data.get("result")
+                worksFor = result_data.get("worksFor")
+                result[query] = {
+                    "URL": input_item['url'],
+                    "job_titles": input_item['job_titles'],
+                    "company": input_item['company'],
+                    "domain": input_item['domain'],
+                    "icypeas_response": {
+                        "URL": result_data.get("url"),
+                        "status": profile_data.get("status"),
+                        "firstname": first_name,
+                        "lastname": last_name,
+                        "worksFor": worksFor
+                    }
+                }
+            else:
+                tracker.log(query, f"Profile not found in ICYPEAS: {input_item['url']}")
+        else:
+            tracker.log(query, f"Profile not found in ICYPEAS: {input_item['url']}")
+
+    return result
 
 # Wrapper to run the async function synchronously
-def enrich_urls_sync(linkedin_urls, tracker, logger):
-    return asyncio.run(enrich_urls(linkedin_urls, tracker, logger))
\ No newline at end of file
+# Pass a RunProfiler to sample event-loop lag while the stage runs
+def enrich_urls_sync(linkedin_urls, tracker, logger, profiler=None, hedger=None):
+    if profiler is not None:
+        return profiler.run_async("icypeas", enrich_urls(linkedin_urls, tracker, logger, hedger=hedger))
+    return asyncio.run(enrich_urls(linkedin_urls, tracker, logger, hedger=hedger))
\ No newline at end of file
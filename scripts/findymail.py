@@ -1,7 +1,16 @@
 import aiohttp
 import asyncio
+import contextlib
 import json
-from .creds import API_KEYS
+from .cassette import http_post, CassetteMiss
+from .decoders import decode_findymail, DecodeError
+from .key_pool import findymail_keys
+from .circuit_breaker import DomainBreaker
+from .retry import TransientError, RETRYABLE_STATUSES, is_retryable, retry_async, dead_letters
+
+# Name search endpoint, point this at a local stand-in server to test without spending credits
+FINDYMAIL_SEARCH_URL = "https://app.findymail.com/api/search/name"
+MAX_CONCURRENT_REQUESTS = 300  # Matches FindMyMail API limit, per key (see key_pool.findymail_keys)
 
 # Split up each profile and call findmymail_request asynchronously
 # Findmymail API limit = 300 requests concurrently
@@ -40,11 +49,19 @@ leave blank if not found>
   },
   ...
 '''
-async def findymail(profiles, tracker, logger):
+# session and semaphore can be passed in to share them between runs (see scripts/service.py)
+# hedger: optional Hedger that duplicates lookups running past the learned latency threshold
+# breaker: DomainBreaker that skips domains with repeated misses, loaded from and saved to its state file if None
+async def findymail(profiles, tracker, logger, session=None, semaphore=None, hedger=None, breaker=None):
     # Create a copy of input profiles to avoid modifying original
     result = profiles.copy()
-    MAX_CONCURRENT_REQUESTS = 300  # Matches FindMyMail API limit
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # Concurrent slots are held per key in the key pool and shared with other runs on this host,
+    # a semaphore passed in limits on top of that
+    if semaphore is None:
+        semaphore = contextlib.nullcontext()
+    save_breaker = breaker is None
+    if breaker is None:
+        breaker = DomainBreaker()
 
     async def process_profile(query, profile):
         # Extract necessary information from profile
@@ -53,9 +70,43 @@ async def findymail(profiles, tracker, logger):
         lastname = validation_result.get("lastname")
         domain = profile.get("domain")
 
-        # Make FindMyMail request
-        async with semaphore:
-            email = await findmymail_request(query, firstname, lastname, domain, tracker, logger)
+        # Make FindMyMail request, retried outside the semaphore so backoff does not hold a slot
+        def fetch():
+            return fetch_findymail(firstname, lastname, domain, logger, session)
+
+        async def limited_request():
+            async with semaphore:
+                if hedger is not None:
+                    # The duplicate takes its own slot, the primary keeps the one held here
+                    # Each response is reported to the key pool as it arrives, so a loser's credit is not lost, but
+                    # only the response that is used is recorded, so tracker rows and found emails count once
+                    return await findmymail_request(query, firstname, lastname, domain, tracker, logger, session,
+                                                    fetch=lambda: hedger.run(fetch, limited_fetch_once))
+                return await findmymail_request(query, firstname, lastname, domain, tracker, logger, session)
+
+        async def limited_fetch_once():
+            async with semaphore:
+                return await fetch()
+
+        async def lookup():
+            try:
+                email = await retry_async(limited_request)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                tracker.log(query, f"FindMyMail retries exhausted, dead-lettered: {e}")
+                dead_letters.add("findymail", query, profile, e)
+                email = None
+            # Only an answer without an email counts against the domain, account, rate-limit and transport
+            # errors (None) say nothing about it
+            if email is not None:
+                breaker.record(domain, f"{firstname} {lastname}", bool(email))
+            return email
+
+        sent, email = await breaker.call(domain, lookup)
+        if not sent:
+            tracker.log(query, f"Findymail circuit open for domain: {domain}")
+            logger.add_breaker_skip(1)
         # Update profile with email result
         updated_profile = profile.copy()
         updated_profile["validation_result"]["findmymail"] = email if email else ""
@@ -72,13 +123,17 @@ async def findymail(profiles, tracker, logger):
         if isinstance(future, tuple):
             query, updated_profile = future
             result[query] = updated_profile
+        elif isinstance(future, CassetteMiss):
+            raise future
         else:
             query = next(iter(profiles))  # Fallback to first query if error
             tracker.log(query, f"Error processing profile: {str(future)}")
 
+    if save_breaker:
+        breaker.save()
     return result
 
-async def findmymail_request(query, firstName, lastName, domain, tracker, logger):
+async def findmymail_request(query, firstName, lastName, domain, tracker, logger, session=None, fetch=None):
     """
     Make a single FindMyMail API request.
     
@@ -89,44 +144,103 @@ async def findmymail_request(query, firstName, lastName, domain, tracker, logger
         domain (str): Domain to search
         tracker: Tracker object for logging
         logger: Logger object for tracking credits and results
+        session: Optional shared aiohttp session, a new one is opened if None
+        fetch: Optional coroutine factory used instead of fetch_findymail, e.g. a hedged fetch
         
     Returns:
-        str or None: Found email or None if not found
+        str or None: Found email, "" if Findymail answered without one, None if the request failed
+
+    Raises:
+        TransientError, aiohttp.ClientError: For failures worth retrying (see findymail.process_profile)
     """
-    FINDMYMAIL_API_KEY = API_KEYS["FINDMYMAIL_API_KEY"]
-    findmymail_url = "https://app.findymail.com/api/search/name"
-    headers = {
+    try:
+        if fetch is None:
+            status, response_data = await fetch_findymail(firstName, lastName, domain, logger, session)
+        else:
+            status, response_data = await fetch()
+    except DecodeError as e:
+        tracker.log(query, f"FindMyMail API response could not be decoded: {e}")
+        return None
+    except KeyError as e:
+        tracker.log(query, f"Missing API key: {e}")
+        return None
+    except aiohttp.ClientError as e:
+        if is_retryable(e):
+            raise
+        tracker.log(query, f"FindMyMail API request failed: {str(e)}")
+        return None
+    if status != 200:
+        tracker.log(query, f"FindMyMail API request failed with status code: {status}")
+        return None
+    email = record_contact(query, response_data, firstName, lastName, tracker, logger)
+    return email or ""
+
+# Send one name search without recording its result, so a hedged duplicate that loses is not logged
+# Every response is reported to the key pool here, including a losing duplicate's, it was really sent and paid for
+# Return: (status, decoded response or None when the status is not 200)
+# Raises: TransientError, aiohttp.ClientError, DecodeError, KeyError (no API key), handled in findmymail_request
+async def fetch_findymail(firstName, lastName, domain, logger, session=None):
+    payload = findymail_payload(firstName, lastName, domain)
+    async with findymail_keys.use() as key:
+        headers = findymail_headers(key.key)
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                status, response_data = await _findmymail_post(session, FINDYMAIL_SEARCH_URL, headers, payload, logger, key)
+        else:
+            status, response_data = await _findmymail_post(session, FINDYMAIL_SEARCH_URL, headers, payload, logger, key)
+        return status, response_data
+
+# api_key: key to send, one is picked from the key pool if None
+def findymail_headers(api_key=None):
+    if api_key is None:
+        api_key = findymail_keys.pick().key
+    return {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {FINDMYMAIL_API_KEY}"
+        "Authorization": f"Bearer {api_key}"
     }
-    name = f"{firstName} {lastName}"
-    payload = {
-        "name": name,
+
+def findymail_payload(firstName, lastName, domain, webhook_url=None):
+    return {
+        "name": f"{firstName} {lastName}",
         "domain": domain,
-        "webhook_url": None
+        "webhook_url": webhook_url
     }
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(findmymail_url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    response_data = await response.json()
-                    contact_data = response_data.get('contact', {})
-                    email = contact_data.get('email')
-                    if email:
-                        tracker.log(query, f"Email found for {firstName} {lastName}")
-                        logger.add_findmymail_credit(1)
-                        logger.add_found_email(1)
-                    else:
-                        tracker.log(query, f"Profile validated but no email found")
-                    return email
-                else:
-                    tracker.log(query, f"FindMyMail API request failed with status code: {response.status}")
-                    return None
-    except aiohttp.ClientError as e:
-        tracker.log(query, f"FindMyMail API request failed: {str(e)}")
-        return None
+# Log and count the outcome of a name search response (synchronous response or webhook callback)
+# Return: found email or None
+def record_contact(query, response_data, firstName, lastName, tracker, logger):
+    contact_data = response_data.get('contact') or {}
+    email = contact_data.get('email')
+    if email:
+        tracker.log(query, f"Email found for {firstName} {lastName}")
+        logger.add_findmymail_credit(1)
+        logger.add_found_email(1)
+    else:
+        tracker.log(query, f"Profile validated but no email found")
+    return email
+
+# Send one name search on the given session
+# Return: (status, decoded response or None)
+async def _findmymail_post(session, findmymail_url, headers, payload, logger, key):
+    async with http_post(session, findmymail_url, headers=headers, json=payload) as response:
+        if response.status != 200:
+            findymail_keys.report(key, response.status, logger)
+        if response.status in RETRYABLE_STATUSES:
+            raise TransientError("FindMyMail", response.status)
+        if response.status != 200:
+            return response.status, None
+        try:
+            response_data = decode_findymail(await response.read())
+        except DecodeError:
+            findymail_keys.report(key, response.status, logger)
+            raise
+        # Credits are only used when an email is found
+        findymail_keys.report(key, response.status, logger, cost=int(bool((response_data.get("contact") or {}).get("email"))))
+        return response.status, response_data
 
 # Wrapper to run the async function synchronously
-def findymail_sync(profiles, tracker, logger):
-    return asyncio.run(findymail(profiles, tracker, logger))
\ No newline at end of file
+# Pass a RunProfiler to sample event-loop lag while the stage runs
+def findymail_sync(profiles, tracker, logger, profiler=None, hedger=None):
+    if profiler is not None:
+        return profiler.run_async("findymail", findymail(profiles, tracker, logger, hedger=hedger))
+    return asyncio.run(findymail(profiles, tracker, logger, hedger=hedger))
\ No newline at end of file
@@ -0,0 +1,185 @@
+import asyncio
+import uuid
+import aiohttp
+from aiohttp import web
+from . import findymail as findymail_module
+from .cassette import http_post, CassetteMiss
+from .decoders import decode_findymail, DecodeError
+from .findymail import findymail, findymail_headers, findymail_payload, record_contact
+from .key_pool import findymail_keys
+from .circuit_breaker import DomainBreaker
+from .retry import TransientError, RETRYABLE_STATUSES, retry_async
+
+# Findymail webhook mode
+# Instead of holding a connection open while Findymail searches, every lookup is submitted with a webhook_url
+# pointing at a local callback receiver and the connection is released straight away. Callbacks are matched to
+# their lookup by a correlation id in the callback path. Lookups whose callback does not arrive within
+# WEBHOOK_TIMEOUT seconds (or whose submission fails) fall back to the synchronous findymail() path.
+# Submissions go through the same per-domain circuit breaker as synchronous lookups, a callback without an
+# email counts as a miss.
+#
+# PUBLIC_URL must be reachable by Findymail (e.g. a tunnel or reverse proxy in front of CALLBACK_PORT).
+# To test against a local stand-in, point findymail.FINDYMAIL_SEARCH_URL at it and leave PUBLIC_URL local.
+CALLBACK_HOST = "0.0.0.0"
+CALLBACK_PORT = 8090
+PUBLIC_URL = "http://127.0.0.1:8090"
+CALLBACK_PATH = "/findymail/callback"
+WEBHOOK_TIMEOUT = 120  # seconds to wait for a callback before falling back
+MAX_CONCURRENT_SUBMISSIONS = 100  # connections are only held for the submission round trip
+
+
+# Small aiohttp server that resolves one future per correlation id
+class CallbackReceiver:
+    def __init__(self, host=CALLBACK_HOST, port=CALLBACK_PORT, public_url=PUBLIC_URL):
+        self.host = host
+        self.port = port
+        self.public_url = public_url.rstrip("/")
+        self.pending = {}  # correlation id -> future
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(CALLBACK_PATH + "/{correlation_id}", self.handle_callback)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def expect(self, correlation_id):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[correlation_id] = future
+        return future
+
+    def forget(self, correlation_id):
+        self.pending.pop(correlation_id, None)
+
+    def webhook_url(self, correlation_id):
+        return f"{self.public_url}{CALLBACK_PATH}/{correlation_id}"
+
+    async def handle_callback(self, request):
+        future = self.pending.pop(request.match_info["correlation_id"], None)
+        if future is None:
+            # Late callback for a lookup that already fell back, or an unknown id
+            return web.Response(status=404)
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        if not future.done():
+            future.set_result(body)
+        return web.Response(status=200)
+
+
+# Same input and output as findymail.findymail (see the examples there)
+# breaker: DomainBreaker shared by submissions and fallbacks, loaded from and saved to its state file if None
+async def findymail_webhook(profiles, tracker, logger, session=None, receiver=None, breaker=None):
+    result = profiles.copy()
+    own_receiver = receiver is None
+    if own_receiver:
+        receiver = CallbackReceiver()
+        await receiver.start()
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession()
+    submit_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUBMISSIONS)
+    # One breaker for submissions and fallbacks, so its state file is loaded and saved once per run
+    save_breaker = breaker is None
+    if breaker is None:
+        breaker = DomainBreaker()
+
+    # Submissions hold a slot of the key they are sent with, like synchronous lookups
+    # Return: (accepted response, key), the key's usage is reported once the outcome is known
+    async def submit(correlation_id, firstname, lastname, domain):
+        payload = findymail_payload(firstname, lastname, domain, receiver.webhook_url(correlation_id))
+        async with submit_semaphore, findymail_keys.use() as key:
+            async with http_post(session, findymail_module.FINDYMAIL_SEARCH_URL, headers=findymail_headers(key.key), json=payload) as response:
+                if response.status != 200:
+                    findymail_keys.report(key, response.status, logger)
+                if response.status in RETRYABLE_STATUSES:
+                    raise TransientError("FindMyMail", response.status)
+                response.raise_for_status()
+                try:
+                    return decode_findymail(await response.read()), key
+                except DecodeError:
+                    # Accepted without a usable body, the result comes with the callback
+                    return {}, key
+
+    async def process_profile(query, profile):
+        validation_result = profile.get("validation_result", {})
+        firstname = validation_result.get("firstname")
+        lastname = validation_result.get("lastname")
+        domain = profile.get("domain")
+
+        # Return: email ("" when none was found), or the error to fall back on
+        async def lookup():
+            correlation_id = uuid.uuid4().hex
+            callback = receiver.expect(correlation_id)
+            key = None
+            try:
+                accepted, key = await retry_async(submit, correlation_id, firstname, lastname, domain)
+                # Some responses already carry the contact, no need to wait for the callback then
+                if (accepted.get("contact") or {}).get("email"):
+                    callback_data = accepted
+                else:
+                    callback_data = await asyncio.wait_for(callback, WEBHOOK_TIMEOUT)
+            except (asyncio.TimeoutError, aiohttp.ClientError, TransientError, KeyError) as e:
+                if key is not None:
+                    findymail_keys.report(key, 200, logger)
+                return e
+            finally:
+                receiver.forget(correlation_id)
+
+            # Callbacks may wrap the search response in a payload object
+            callback_data = callback_data.get("payload", callback_data)
+            email = record_contact(query, callback_data, firstname, lastname, tracker, logger)
+            # Credits are only used when an email is found
+            findymail_keys.report(key, 200, logger, cost=int(bool(email)))
+            breaker.record(domain, f"{firstname} {lastname}", bool(email))
+            return email or ""
+
+        sent, email = await breaker.call(domain, lookup)
+        if not sent:
+            tracker.log(query, f"Findymail circuit open for domain: {domain}")
+            logger.add_breaker_skip(1)
+        elif isinstance(email, Exception):
+            # Outside breaker.call, the fallback takes its own probe of the domain
+            tracker.log(query, f"FindMyMail webhook fell back to synchronous lookup: {str(email) or 'callback timeout'}")
+            fallback = await findymail({query: profile}, tracker, logger, session=session, breaker=breaker)
+            return query, fallback[query]
+        updated_profile = profile.copy()
+        updated_profile["validation_result"]["findmymail"] = email if email else ""
+        return query, updated_profile
+
+    try:
+        tasks = [
+            asyncio.create_task(process_profile(query, profile))
+            for query, profile in profiles.items()
+        ]
+        for future in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(future, tuple):
+                query, updated_profile = future
+                result[query] = updated_profile
+            elif isinstance(future, CassetteMiss):
+                raise future
+            else:
+                tracker.log("findymail_webhook_error", f"Error processing profile: {future}")
+    finally:
+        if save_breaker:
+            breaker.save()
+        if own_session:
+            await session.close()
+        if own_receiver:
+            await receiver.stop()
+
+    return result
+
+
+# Wrapper to run the async function synchronously
+# Pass a RunProfiler to sample event-loop lag while the stage runs
+def findymail_webhook_sync(profiles, tracker, logger, profiler=None):
+    if profiler is not None:
+        return profiler.run_async("findymail", findymail_webhook(profiles, tracker, logger))
+    return asyncio.run(findymail_webhook(profiles, tracker, logger))
@@ -0,0 +1,126 @@
+import polars as pl
+from .normalize import COMPANY_KEY
+
+# Frame-backed versions of the CPU-side stages (enabled with FRAME_STAGES in main.py)
+# Queries, URLs and profiles are held as Polars frames between stages, so query generation is a cross join,
+# deduplication a group_by on the URL and the output a single join, all running in Polars instead of
+# per-item Python loops. The network stages still take {query: data} dicts: frames are turned into dicts
+# (frame_to_items) right before a network stage and its result back into a frame (urls_frame) right after.
+QUERY_SUFFIX = " site:linkedin.com/in"
+LINKEDIN_PROFILE_PATTERN = r"linkedin\.com/in/"
+OUTPUT_COLUMNS = ["Full Name", "First Name", "Job title", "LinkedIn URL", "Company", "search_query", "email"]
+VALIDATION_SCHEMA = pl.Struct({
+    "valid": pl.Boolean,
+    "firstname": pl.Utf8,
+    "lastname": pl.Utf8,
+    "currentCompany": pl.Utf8,
+    "currentJobTitle": pl.Utf8,
+    "findmymail": pl.Utf8,
+})
+
+
+# Same queries as queries.gen_queries, in the same order: per company and title the name query, then the domain query
+# Return: frame with columns query, company, title, domain
+def queries_frame(companies_data, job_titles):
+    companies = pl.DataFrame(companies_data, schema={"company": pl.Utf8, "Root Domain": pl.Utf8}, orient="row") \
+        if not isinstance(companies_data, pl.DataFrame) else companies_data.select("company", "Root Domain")
+    pairs = (
+        companies.with_row_index("company_index")
+        .join(pl.DataFrame({"title": job_titles}, schema={"title": pl.Utf8}).with_row_index("title_index"), how="cross")
+    )
+    forms = [
+        pairs.with_columns(pl.lit(form).alias("form"), pl.col(column).alias("search_term"))
+        for form, column in enumerate(["company", "Root Domain"])
+    ]
+    return (
+        pl.concat(forms)
+        .sort("company_index", "title_index", "form")
+        .select(
+            pl.concat_str([pl.col("search_term"), pl.lit(" "), pl.col("title"), pl.lit(QUERY_SUFFIX)]).alias("query"),
+            pl.col("company"),
+            pl.col("title"),
+            pl.col("Root Domain").alias("domain"),
+        )
+        .unique(subset="query", keep="first", maintain_order=True)
+    )
+
+
+# Return: {row[key]: {other columns}} for handing a frame (or a slice of it) to a network stage
+def frame_to_items(frame, key="query"):
+    values = frame.drop(key).to_dicts()
+    return dict(zip(frame[key].to_list(), values))
+
+
+# Serper output {query: {url, company, title, domain[, matched_titles]}} as a frame
+def urls_frame(urls):
+    results = list(urls.values())
+    return pl.DataFrame({
+        "query": list(urls),
+        "url": [result.get("url") for result in results],
+        "company": [result.get("company") for result in results],
+        "domain": [result.get("domain") for result in results],
+        "title": [result.get("title") for result in results],
+        "matched_titles": [result.get("matched_titles") for result in results],
+    }, schema={"query": pl.Utf8, "url": pl.Utf8, "company": pl.Utf8, "domain": pl.Utf8, "title": pl.Utf8, "matched_titles": pl.List(pl.Utf8)}) \
+        .select(
+            "query", "url", "company", "domain",
+            pl.when(pl.col("matched_titles").list.len() > 0)
+            .then(pl.col("matched_titles"))
+            .otherwise(pl.concat_list("title"))
+            .alias("job_titles"),
+        )
+
+
+# Frame version of deduplicate.deduplicate_linkedin_urls: one row per LinkedIn profile URL, owned by the
+# first query that found it and carrying the job titles of every query that found it
+# Return: frame with columns query, url, job_titles, company, domain
+def deduplicate_frame(urls_df, tracker):
+    profiles = urls_df.filter(pl.col("url").str.contains(LINKEDIN_PROFILE_PATTERN))
+    first = pl.col("url").is_first_distinct()
+    for url, query in profiles.filter(~first).select("url", "query").iter_rows():
+        tracker.log(query, f"Duplicate URL found: {url}")
+    # Exploding before the group_by keeps the aggregation on plain strings, both frames are in first-seen URL order
+    job_titles = (
+        profiles.select("url", "job_titles")
+        .explode("job_titles")
+        .group_by("url", maintain_order=True)
+        .agg(pl.col("job_titles"))
+    )
+    return profiles.filter(first).select("query", "url", "company", "domain").with_columns(job_titles["job_titles"]) \
+        .select("query", "url", "job_titles", "company", "domain")
+
+
+# Frame version of main.output_results, same columns and rows
+def output_frame(profiles, raw_df: pl.DataFrame) -> pl.DataFrame:
+    profiles_df = pl.DataFrame({
+        "search_query": list(profiles),
+        "profile": list(profiles.values()),
+    }, schema={
+        "search_query": pl.Utf8,
+        "profile": pl.Struct({"URL": pl.Utf8, "domain": pl.Utf8, "validation_result": VALIDATION_SCHEMA}),
+    })
+    validation = pl.col("profile").struct.field("validation_result")
+    first_name = validation.struct.field("firstname").fill_null("")
+    last_name = validation.struct.field("lastname").fill_null("")
+    profiles_df = (
+        profiles_df
+        .filter(validation.struct.field("valid").fill_null(False))
+        .select(
+            pl.concat_str([first_name, pl.lit(" "), last_name]).str.strip_chars().alias("Full Name"),
+            first_name.alias("First Name"),
+            validation.struct.field("currentJobTitle").fill_null("").alias("Job title"),
+            pl.col("profile").struct.field("URL").fill_null("").alias("LinkedIn URL"),
+            validation.struct.field("currentCompany").fill_null("").alias("Company"),
+            pl.col("search_query"),
+            validation.struct.field("findmymail").fill_null("").alias("email"),
+            pl.col("profile").struct.field("domain").fill_null("").alias("Root Domain"),
+        )
+    )
+
+    if profiles_df.is_empty():
+        if COMPANY_KEY in raw_df.columns:
+            raw_df = raw_df.drop(COMPANY_KEY)
+        return raw_df.with_columns(pl.lit(None, pl.Utf8).alias(column) for column in OUTPUT_COLUMNS)
+    if COMPANY_KEY in raw_df.columns:
+        return raw_df.join(profiles_df, left_on=COMPANY_KEY, right_on="Root Domain", how="left").drop(COMPANY_KEY)
+    return raw_df.join(profiles_df, on="Root Domain", how="left")
@@ -0,0 +1,84 @@
+import asyncio
+import collections
+
+# Request hedging to cut stage tail latency
+# Once a request has been running longer than the HEDGE_PERCENTILE latency seen so far, one duplicate is sent
+# and whichever response arrives first is used, the other request is cancelled.
+# The number of duplicates is capped at HEDGE_BUDGET of all requests so hedging cannot blow up provider usage.
+# Both requests can finish before one of them is cancelled, so the factories should only fetch and report the
+# provider spend of every response they get. The caller logs and counts the returned result once (see
+# enrich_urls.fetch_bulk_search and findymail.fetch_findymail).
+HEDGE_PERCENTILE = 0.95
+HEDGE_BUDGET = 0.02  # at most 2% additional requests
+MIN_SAMPLES = 20  # latencies needed before the threshold is trusted
+LATENCY_WINDOW = 1000  # most recent latencies the threshold is computed from
+RECOMPUTE_EVERY = 50  # new samples between threshold recomputations
+
+
+class Hedger:
+    def __init__(self, name, logger, percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET):
+        self.name = name
+        self.logger = logger
+        self.percentile = percentile
+        self.budget = budget
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.hedges = 0
+        self._threshold = None
+        self._new_samples = 0
+
+    def record(self, latency):
+        self.latencies.append(latency)
+        self._new_samples += 1
+
+    # Percentile latency, recomputed every RECOMPUTE_EVERY samples instead of sorting on every request
+    def threshold(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        if self._threshold is None or self._new_samples >= RECOMPUTE_EVERY:
+            ordered = sorted(self.latencies)
+            self._threshold = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+            self._new_samples = 0
+        return self._threshold
+
+    def _within_budget(self):
+        return self.hedges < self.budget * self.requests
+
+    # Run primary_factory() and hedge it with hedge_factory() (defaults to the same factory) if it is slow
+    # hedge_factory is where the caller acquires any extra concurrency slot the duplicate needs
+    # Return: result of whichever request finished first
+    async def run(self, primary_factory, hedge_factory=None):
+        loop = asyncio.get_running_loop()
+        self.requests += 1
+        start = loop.time()
+        primary = asyncio.ensure_future(primary_factory())
+        threshold = self.threshold()
+        if threshold is not None and self._within_budget():
+            done, _ = await asyncio.wait({primary}, timeout=threshold)
+            # Budget is checked again, other requests may have hedged while this one waited
+            if not done and self._within_budget():
+                return await self._race(primary, hedge_factory or primary_factory, start)
+        try:
+            return await primary
+        finally:
+            self.record(loop.time() - start)
+
+    async def _race(self, primary, hedge_factory, start):
+        loop = asyncio.get_running_loop()
+        self.hedges += 1
+        hedge = asyncio.ensure_future(hedge_factory())
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer a successful response, only fail if both requests failed
+                for future in done:
+                    if not future.cancelled() and future.exception() is None:
+                        self.logger.add_hedge(self.name, future is hedge)
+                        self.record(loop.time() - start)
+                        return future.result()
+            self.logger.add_hedge(self.name, False)
+            return primary.result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -1,5 +1,5 @@
 import requests
-from .creds import API_KEYS
+from .key_pool import icypeas_keys
 
 # Icypeas API Request to find necessary information
 # Input: query, profile_url, tracker
@@ -9,7 +9,7 @@ def icypeas_request(query, profile_url, tracker):
 
     headers = {
         "Content-Type": "application/json",
-        "Authorization": API_KEYS["ICYPEAS_API_KEY"]
+        "Authorization": icypeas_keys.pick().key
     }
     
     try:
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import hashlib
+import random
+import threading
+import time
+from .creds import API_KEYS
+from .rate_coordinator import rate_limiter, concurrency_limiter
+
+# API key pools
+# Every provider entry in creds.API_KEYS can be a single key, a list of keys, or a list of dicts with per-key limits:
+#   "SERPER_API_KEY": [{"key": "...", "rate": 220, "credits": 50000, "name": "main"}, "<second key>", ...]
+# rate is requests per second for rate-limited providers (Serper, Icypeas) or concurrent requests for Findymail,
+# and defaults to the provider's single-account limit. credits are the account's remaining credits, or tokens
+# for OpenAI (unknown if left out). Each request picks an active key at random weighted by its rate, tapered once
+# its remaining credits drop below LOW_CREDITS, and waits on that key's own limiter. Key limiters are shared with other processes on
+# the host like the provider limiters in rate_coordinator.py, so aggregate throughput grows with the number of keys.
+# Keys are removed from rotation on 401/402/403 or when their credits run out, and for KEY_COOLDOWN seconds after
+# THROTTLE_STRIKES 429s in a row (the last active key is never cooled down, retries with backoff handle it).
+LOW_CREDITS = 1000
+KEY_COOLDOWN = 60
+THROTTLE_STRIKES = 3
+DISABLE_STATUSES = {401, 402, 403}
+
+
+# Raised when every key of a provider has been removed from rotation
+class NoActiveKeys(KeyError):
+    pass
+
+
+class PoolKey:
+    def __init__(self, provider, entry, default_limit, kind):
+        if isinstance(entry, str):
+            entry = {"key": entry}
+        self.key = entry["key"]
+        self.label = entry.get("name") or f"...{self.key[-4:]}"
+        self.limit = entry.get("rate", default_limit)
+        self.credits = entry.get("credits")
+        self.requests = 0
+        self.used = 0
+        self.strikes = 0
+        self.cooldown_until = 0
+        self.disabled = None  # reason the key was removed from rotation
+        # Limiter state files are named by a hash so the key itself never ends up on disk
+        key_id = f"{provider.lower()}-{hashlib.sha1(self.key.encode('utf-8')).hexdigest()[:10]}"
+        if not self.limit:
+            self.limiter = None
+        elif kind == "concurrency":
+            self.limiter = concurrency_limiter(key_id, self.limit)
+        else:
+            self.limiter = rate_limiter(key_id, self.limit, 1)
+
+    def weight(self):
+        weight = self.limit or 1
+        if self.credits is not None:
+            weight *= min(1.0, max(0, self.credits - self.used) / LOW_CREDITS)
+        return weight
+
+
+class KeyPool:
+    def __init__(self, provider, config_name, default_limit=None, kind="rate"):
+        self.provider = provider
+        self.config_name = config_name
+        self.default_limit = default_limit
+        self.kind = kind
+        self.lock = threading.Lock()
+        self._keys = None
+
+    # Keys are read from creds on first use so a provider without keys only fails when it is called
+    @property
+    def keys(self):
+        if self._keys is None:
+            entries = API_KEYS[self.config_name]
+            if isinstance(entries, (str, dict)):
+                entries = [entries]
+            self._keys = [PoolKey(self.provider, entry, self.default_limit, self.kind) for entry in entries]
+        return self._keys
+
+    # Sum of the per-key limits, used to size semaphores and worker pools
+    def total_limit(self):
+        return sum(key.limit or 0 for key in self.keys if not key.disabled) or self.default_limit
+
+    # Return: (key, 0) for a chosen active key, or (None, seconds until a cooled-down key is back)
+    def _choose(self):
+        now = time.time()
+        with self.lock:
+            usable = [key for key in self.keys if not key.disabled and key.weight() > 0]
+            if not usable:
+                raise NoActiveKeys(f"No active {self.provider} API keys left in {self.config_name}")
+            active = [key for key in usable if key.cooldown_until <= now]
+            if not active:
+                return None, min(key.cooldown_until for key in usable) - now
+            key = random.choices(active, weights=[key.weight() for key in active])[0]
+            key.requests += 1
+            return key, 0
+
+    # Pick a key without waiting on its limiter (OpenAI, which has no client-side limits)
+    def pick(self):
+        while True:
+            key, wait = self._choose()
+            if key is not None:
+                return key
+            time.sleep(wait)
+
+    # Pick a key and hold its limiter: "async with pool.use() as key:"
+    @contextlib.asynccontextmanager
+    async def use(self):
+        while True:
+            key, wait = self._choose()
+            if key is None:
+                await asyncio.sleep(wait)
+                continue
+            if key.limiter is None:
+                yield key
+                return
+            async with key.limiter:
+                # The key may have been removed from rotation while this request waited on its limiter
+                if key.disabled:
+                    continue
+                yield key
+                return
+
+    # Record the response status for a key, cost is the credits the request used
+    def report(self, key, status, logger=None, cost=0):
+        with self.lock:
+            if status in DISABLE_STATUSES:
+                self._disable(key, f"status {status}")
+            elif status == 429:
+                key.strikes += 1
+                others = [other for other in self.keys if other is not key and not other.disabled and other.cooldown_until <= time.time()]
+                if key.strikes >= THROTTLE_STRIKES and others:
+                    key.cooldown_until = time.time() + KEY_COOLDOWN
+                    key.strikes = 0
+                    print(f"{self.provider} key {key.label} throttled, out of rotation for {KEY_COOLDOWN}s")
+            else:
+                key.strikes = 0
+                key.used += cost
+                if key.credits is not None and key.used >= key.credits:
+                    self._disable(key, "credits used up")
+        if logger is not None:
+            logger.add_key_usage(self.provider, key.label, cost)
+
+    def _disable(self, key, reason):
+        if key.disabled is None:
+            key.disabled = reason
+            print(f"{self.provider} key {key.label} removed from rotation: {reason}")
+
+
+# One pool per provider, shared by every stage module and the service
+serper_keys = KeyPool("Serper", "SERPER_API_KEY", default_limit=220)
+icypeas_keys = KeyPool("Icypeas", "ICYPEAS_API_KEY", default_limit=20)
+findymail_keys = KeyPool("Findymail", "FINDMYMAIL_API_KEY", default_limit=300, kind="concurrency")
+openai_keys = KeyPool("OpenAI", "OPENAI_API_KEY")
@@ -0,0 +1,90 @@
+import csv
+import hashlib
+import json
+import os
+import re
+from .retry import dead_letters
+
+# Run manifest for incremental (delta) runs
+# Records, for every company key of the last run, a hash of everything the network stages read for it
+# (company name, normalized domain and the job titles searched) and the contacts that were produced.
+# A delta run diffs the new input against it: only new or changed companies go through Serper -> Findymail,
+# the contacts of unchanged companies are carried over and merged into the new output.csv.
+# Companies that did not run to completion (queries cut by MAX_SERPER_QUERIES or the Serper time limit, or
+# items dead-lettered during the run) are left out of the manifest so the next delta run picks them up again.
+MANIFEST_FILE = "run_manifest.json"
+MANIFEST_VERSION = 1
+CONSOLIDATED_RANK = re.compile(r" #\d+$")
+
+
+def company_hash(company, job_titles):
+    content = json.dumps([company["company"], company["Root Domain"], sorted(job_titles)])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    def __init__(self, filename=MANIFEST_FILE):
+        self.filename = filename
+        self.companies = {}  # company key -> {"hash": ..., "contacts": {query: profile}}
+        if os.path.exists(filename):
+            with open(filename, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.companies = data.get("companies", {})
+
+    # Split companies into the ones that need a network run and the contacts carried over for the rest
+    # Return: (companies to run, {query: profile} of carried contacts, number of unchanged companies)
+    def diff(self, companies_data, job_titles):
+        to_run = []
+        carried = {}
+        unchanged = 0
+        for company in companies_data:
+            entry = self.companies.get(company["Root Domain"])
+            if entry is not None and entry["hash"] == company_hash(company, job_titles):
+                carried.update(entry["contacts"])
+                unchanged += 1
+            else:
+                to_run.append(company)
+        return to_run, carried, unchanged
+
+    # Rebuild the manifest for the current input and write it
+    # companies_data: every company of the current input, ran: the companies sent to the network stages
+    # generated: all queries generated for ran (before MAX_SERPER_QUERIES), sent: the queries that were searched
+    # emails: final {query: profile} of this run, including carried contacts
+    def update(self, companies_data, ran, job_titles, generated, sent, emails, tracker_file, run_start):
+        incomplete = self._incomplete(generated, sent, tracker_file, run_start)
+        ran_keys = {company["Root Domain"] for company in ran}
+        contacts = {}
+        for query, profile in emails.items():
+            contacts.setdefault(profile.get("domain"), {})[query] = profile
+
+        companies = {}
+        for company in companies_data:
+            key = company["Root Domain"]
+            if key not in ran_keys:
+                if key in self.companies:
+                    companies[key] = self.companies[key]
+            elif key not in incomplete:
+                companies[key] = {"hash": company_hash(company, job_titles), "contacts": contacts.get(key, {})}
+        self.companies = companies
+
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "companies": companies}, f, default=str)
+        os.replace(tmp, self.filename)
+        return len(incomplete)
+
+    # Company keys with work that did not finish in this run
+    def _incomplete(self, generated, sent, tracker_file, run_start):
+        domains = {CONSOLIDATED_RANK.sub("", query): data.get("domain") for query, data in generated.items()}
+        incomplete = {data.get("domain") for query, data in generated.items() if query not in sent}
+        with open(tracker_file, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row["Exit Reason"].startswith("Skipped"):
+                    incomplete.add(domains.get(CONSOLIDATED_RANK.sub("", row["Query"])))
+        for entry in dead_letters.read():
+            if entry["time"] >= run_start:
+                incomplete.add(domains.get(CONSOLIDATED_RANK.sub("", entry["key"])))
+        incomplete.discard(None)
+        return incomplete
+
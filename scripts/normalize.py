@@ -0,0 +1,53 @@
+import polars as pl
+
+# Input normalization before query generation
+# input.csv has one row per product, so the same company shows up on many rows, often with slightly different
+# spellings of the domain ("https://www.Acme.com/shop" vs "acme.com"). The network stages only need each
+# company once: rows are collapsed on a normalized company key here and the results are fanned back out to
+# every original row in main.output_results, which joins on COMPANY_KEY.
+COMPANY_KEY = "_company_key"
+
+
+# Lowercase, strip scheme, "www." and anything after the host (path, query, port)
+def normalized_domain(column="Root Domain"):
+    return (
+        pl.col(column).cast(pl.Utf8)
+        .str.strip_chars()
+        .str.to_lowercase()
+        .str.replace(r"^[a-z][a-z0-9+.-]*://", "")
+        .str.replace(r"^www\.", "")
+        .str.replace(r"[/?#:].*$", "")
+        .str.strip_chars(".")
+    )
+
+
+# Trim and collapse runs of whitespace, case is kept since it is used in the search queries
+def normalized_company(column="company"):
+    return (
+        pl.col(column).cast(pl.Utf8)
+        .str.strip_chars()
+        .str.replace_all(r"\s+", " ")
+    )
+
+
+# Return: input_df with COMPANY_KEY added, the normalized domain (null when the row has no usable domain)
+def add_company_key(input_df):
+    return input_df.with_columns(
+        pl.when(normalized_domain().str.len_chars() > 0)
+        .then(normalized_domain())
+        .otherwise(None)
+        .alias(COMPANY_KEY)
+    )
+
+
+# Collapse rows to one entry per company key, keeping the first company name seen for it
+# Rows without a domain are skipped, Findymail cannot find an email without one
+# Return: list of {"company": <name>, "Root Domain": <normalized domain>} as expected by gen_queries
+def unique_companies(keyed_df):
+    companies = (
+        keyed_df
+        .filter(pl.col(COMPANY_KEY).is_not_null())
+        .select(normalized_company().alias("company"), pl.col(COMPANY_KEY).alias("Root Domain"))
+        .unique(subset="Root Domain", keep="first", maintain_order=True)
+    )
+    return companies.to_dicts()
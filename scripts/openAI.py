@@ -1,123 +1,131 @@
-import requests
-from .creds import API_KEYS
+from .key_pool import openai_keys
+from .cassette import requests_post
+from .decoders import decode_openai, DecodeError
+from .retry import TransientError, RETRYABLE_STATUSES, retry_sync
 import json
 
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"  # point at a local stand-in to test without spending tokens
+
+# The instructions are fixed system messages and the pair being checked is a small JSON user message after them,
+# so every call sends the same prefix and only a few new tokens. Both prefixes are well under the 1024 tokens
+# OpenAI's prompt caching needs, so they are not cached, the saving is the shorter prompt itself
+# (python -m scripts.prompt_check compares it with the original prompts)
+COMPANY_SYSTEM_PROMPT = """You match company names. Decide if the candidate company is the same entity as the target company.
+Focus on the core identity of the company: ignore legal suffixes, punctuation and common abbreviations, and consider parent companies and known acronyms.
+Matches, one pair per line:
+L3Harris Technologies = L3Harris
+Google LLC = Google
+The Coca-Cola Company = Coca-Cola
+International Business Machines = IBM
+General Electric = GE
+The Boeing Company = Boeing
+JPMorgan Chase & Co. = JPMorgan Chase
+Amazon Web Services = Amazon
+Amazon.com = Amazon
+Unilever N.V. = Unilever
+Apple Inc. = Apple
+Microsoft Corporation = Microsoft
+The user message is JSON with "target" and "candidate". Respond with only a JSON object {"match": true} or {"match": false}."""
+
+JOB_TITLE_SYSTEM_PROMPT = """You compare a candidate's current job title to a list of target job titles and decide if they represent the same job function or a closely related role.
+Focus on the job's function and field, not on literal keywords. Roles in the same domain match even with different seniority or exact titles.
+Same-function groups:
+- Executive leadership: CEO, Founder, President, Managing Member, Chief Executive Officer
+- Sales & marketing: VP of Sales, Sales Director, Head of Marketing, Marketing Lead
+- Product/design/development: Product Manager, Product Owner, Product Strategist, Product Development Engineer, Product Designer, Innovation Manager, Design Engineer
+- Packaging: Packaging Engineer, Structural Packaging Engineer, Packaging Specialist, Packaging Design Engineer
+- Software: Software Engineer, Developer, Programmer, Full Stack Developer, Backend Engineer
+Rules:
+1. Seniority: a "Senior" role can match a "Lead" or "Director" role (e.g. "Senior Design Engineer" to "Director of Product Development").
+2. Domain: "Design", "Development" and "Product" are often used interchangeably for similar functions (e.g. a "Design Engineer" may work in "Product Development").
+3. Multiple roles: if the title contains several roles (e.g. "President / Mechanical Engineer"), evaluate each part separately; a match on any part is a full match.
+The user message is JSON {"targets": [...], "candidate": ...}. Respond with only a JSON object {"match": true} or {"match": false}."""
+
+
 # openAI company name fuzzy match
-# Input:: String: Target Company, String: Found Company Name
+# Input:: String: Target Company, String: Found Company Name, Logger for the per-key token report (optional)
 # Return:: Boolean
-def fuzzy_match_company(target_company, current_company_name):
+def fuzzy_match_company(target_company, current_company_name, logger=None):
  
-    API_KEY = API_KEYS["OPENAI_API_KEY"]
-
-    # The prompt to send to the openAI API.
-    prompt = f"""You are a highly accurate system for matching company names. Your task is to determine if a candidate company name refers to the same entity as a target company name.
-
-        Target Company: "{target_company}"
-        Candidate Company: "{current_company_name}"
-
-        **Instructions:**
-        Focus on the core identity of the company, ignoring legal suffixes, punctuation, and common abbreviations. Consider parent companies and known acronyms.
-
-        **Examples of Matches:**
-        * "L3Harris Technologies" vs "L3Harris"
-        * "Google LLC" vs "Google"
-        * "The Coca-Cola Company" vs "Coca-Cola"
-        * "International Business Machines" vs "IBM"
-        * "General Electric" vs "GE"
-        * "The Boeing Company" vs "Boeing"
-        * "JPMorgan Chase & Co." vs "JPMorgan Chase"
-        * "Amazon Web Services" vs "Amazon"
-        * "Unilever N.V." vs "Unilever"
-        * "Apple Inc." vs "Apple"
-        * "Microsoft Corporation" vs "Microsoft"
-        * "Google LLC" vs "Google"
-        * "Amazon.com" vs "Amazon"
-        
-        Respond with ONLY a JSON object:
-        json
-        {{"match": true/false}}
-    """
+    prompt = json.dumps({"target": target_company, "candidate": current_company_name}, ensure_ascii=False)
     # Make the API call.
-    result, usage = openai_request(API_KEY, prompt, model="gpt-4.1-nano")
-
-    if not result:
-        return False, usage
-
-    try:
-        parsed = json.loads(result)
-        return parsed.get("match", False), usage
-    except (json.JSONDecodeError, TypeError):
-        print("Error parsing OpenAI response:", result)
-        return False, usage
+    result, usage = openai_request(prompt, model="gpt-4.1-nano", system=COMPANY_SYSTEM_PROMPT, logger=logger)
+    return parse_match(result), usage
 
 # openAI job title fuzzy match
-# Input:: List[String]: Target Job Titles, String: Found Job Title
+# Input:: List[String]: Target Job Titles, String: Found Job Title, Logger for the per-key token report (optional)
 # Return:: Boolean
-def fuzzy_match_job_title(target_job_titles, current_job_title):
-    API_KEY = API_KEYS["OPENAI_API_KEY"]  # Make sure this dict exists
-
-    prompt = f"""
-        You are comparing a candidate's current job title to a list of target job titles to determine if they represent the same job function or a closely related role.
-
-        Target Job Titles: {target_job_titles}
-        Candidate Job Title: "{current_job_title}"
-
-        **Core Principle:** Focus on the job's **function and field**, not on literal keywords. Roles in the same domain, even with different seniority or exact titles, should be considered a match.
-
-        **Match Examples:**
-        * **Executive Leadership:** "CEO", "Founder", "President", "Managing Member", "Chief Executive Officer"
-        * **Sales & Marketing:** "VP of Sales", "Sales Director", "Head of Marketing", "Marketing Lead"
-        * **Product/Design/Development:** "Product Manager", "Product Owner", "Product Strategist", "Product Development Engineer", "Product Designer", "Innovation Manager", "Design Engineer"
-        * **Packaging:** "Packaging Engineer", "Structural Packaging Engineer", "Packaging Specialist", "Packaging Design Engineer"
-        * **Software:** "Software Engineer", "Developer", "Programmer", "Full Stack Developer", "Backend Engineer"
-
-        **Key Rules:**
-        1.  **Seniority:** A "Senior" role can match a "Lead" or "Director" role (e.g., "Senior Design Engineer" to "Director of Product Development").
-        2.  **Domain:** The terms "Design," "Development," and "Product" are often used interchangeably for similar functions (e.g., a "Design Engineer" may work in "Product Development").
-        3.  **Multiple Roles:** If the job title contains multiple roles (e.g., "President / Mechanical Engineer"), evaluate each part separately. A match on any single part is a full match.
-
-        Respond with ONLY a JSON object:
-        json
-        {{"match": true/false}}
-    """
-
+def fuzzy_match_job_title(target_job_titles, current_job_title, logger=None):
+    prompt = json.dumps({"targets": list(target_job_titles), "candidate": current_job_title}, ensure_ascii=False)
     # Make the API Call
-    result, usage = openai_request(API_KEY, prompt, model="gpt-4.1-nano")
+    result, usage = openai_request(prompt, model="gpt-4.1-nano", system=JOB_TITLE_SYSTEM_PROMPT, logger=logger)
+    return parse_match(result), usage
 
-    if not result:
-        return False, usage
 
+# {"match": true} or {"match": "true"} is a match, anything else is not
+def parse_match(result):
+    if not result:
+        return False
     try:
-        parsed = json.loads(result)
-        return parsed.get("match", False), usage
-    except (json.JSONDecodeError, TypeError):
+        match = json.loads(result).get("match", False)
+    except (json.JSONDecodeError, TypeError, AttributeError):
         print("Error parsing OpenAI response:", result)
-        return False, usage
+        return False
+    if isinstance(match, str):
+        return match.strip().lower() == "true"
+    return match is True
+
 
 
-def openai_request(api_key, prompt, model):
-    api_url = "https://api.openai.com/v1/chat/completions"
+# Chat completion with retries for transient failures (429, 5xx, dropped connections)
+# Raises the last error once retries are exhausted so the caller can dead-letter the profile
+# system: optional fixed instructions sent before the prompt, replies are constrained to a JSON object
+# Every attempt picks a key from the OpenAI key pool, so a retried 429 can go to another key
+# logger: counts the tokens of each request against its key for the per-key report
+def openai_request(prompt, model, system=None, logger=None):
+    return retry_sync(_openai_post, prompt, model, system, logger)
+
+
+def _openai_post(prompt, model, system=None, logger=None):
+    key = openai_keys.pick()
+    api_key = key.key
+    api_url = OPENAI_CHAT_URL
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
+    messages = [{"role": "user", "content": prompt}]
+    if system is not None:
+        messages.insert(0, {"role": "system", "content": system})
     data = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": messages,
         "temperature": 0,
         "stream": False  # Non-streaming so we get token usage
     }
+    if system is not None:
+        data["response_format"] = {"type": "json_object"}
 
-    response = requests.post(api_url, headers=headers, json=data)
+    response = requests_post(api_url, headers=headers, json=data)
+    if response.status_code != 200:
+        openai_keys.report(key, response.status_code, logger)
+    if response.status_code in RETRYABLE_STATUSES:
+        raise TransientError("OpenAI", response.status_code, response.text[:200])
     if response.status_code != 200:
         print(f"OpenAI API request failed: {response.status_code} - {response.text}")
         return None, None
 
-    response_json = response.json()
+    try:
+        response_json = decode_openai(response.content)
+    except DecodeError as e:
+        print(f"OpenAI API response could not be decoded: {e}")
+        openai_keys.report(key, response.status_code, logger)
+        return None, None
 
     # Extract the text response
     content = response_json["choices"][0]["message"]["content"].strip()
     # Extract token usage (may be None if the API doesn't return it)
-    usage = response_json.get("usage").get("total_tokens", 0)
+    usage = (response_json.get("usage") or {}).get("total_tokens", 0)
+    openai_keys.report(key, response.status_code, logger, cost=usage or 0)
 
     return content, usage
\ No newline at end of file
@@ -0,0 +1,80 @@
+import csv
+import json
+import os
+import re
+
+# Yield-aware query ordering
+# Keeps hit/try counts per query feature across runs in STATS_FILE, where a hit is a query that ended
+# with an email found (read from the QueryTracker file at the end of a run). Features:
+#   form:  "domain" or "name", which company form the query searched with
+#   title: the job title searched for
+#   shape: the domain TLD for domain queries, word count and legal suffix for company name queries
+# A query's score is the global hit rate times the lift of each of its features, with every rate
+# smoothed towards the global rate so rarely seen features do not swing the order.
+STATS_FILE = "query_stats.json"
+SMOOTHING = 5  # pseudo-tries at the global rate added to every feature
+LEGAL_SUFFIX = re.compile(r"\b(inc|llc|ltd|corp|corporation|co|gmbh|plc|company)\b\.?", re.IGNORECASE)
+CONSOLIDATED_RANK = re.compile(r" #\d+$")
+
+
+def query_features(query, data):
+    company = data.get("company") or ""
+    domain = data.get("domain") or ""
+    titles = data.get("titles") or [data.get("title") or ""]
+    if domain and query.startswith(str(domain)):
+        form = "domain"
+        shape = "tld:" + str(domain).rsplit(".", 1)[-1].lower()
+    else:
+        form = "name"
+        words = min(len(str(company).split()), 4)
+        shape = f"words:{words}" + ("+suffix" if LEGAL_SUFFIX.search(str(company)) else "")
+    features = [("form", form), ("shape", shape)]
+    features.extend(("title", title.lower()) for title in titles)
+    return features
+
+
+class QueryPrioritizer:
+    def __init__(self, stats_file=STATS_FILE):
+        self.stats_file = stats_file
+        self.stats = {"total": [0, 0]}  # feature kind -> {value: [hits, tries]}, "total" -> [hits, tries]
+        if os.path.exists(stats_file):
+            with open(stats_file, encoding="utf-8") as f:
+                self.stats = json.load(f)
+
+    def global_rate(self):
+        hits, tries = self.stats["total"]
+        return (hits + 1) / (tries + 2)
+
+    def score(self, query, data):
+        base = self.global_rate()
+        score = base
+        for kind, value in query_features(query, data):
+            hits, tries = self.stats.get(kind, {}).get(value, (0, 0))
+            score *= ((hits + SMOOTHING * base) / (tries + SMOOTHING)) / base
+        return score
+
+    # Return: new dict with the same items, most likely to produce an email first
+    def order(self, queries):
+        if not self.stats["total"][1]:
+            return queries
+        ranked = sorted(queries.items(), key=lambda item: self.score(item[0], item[1]), reverse=True)
+        return dict(ranked)
+
+    # Update the stats with this run's queries and their outcomes in the tracker file, then save them
+    def learn(self, queries, tracker_file):
+        hits = set()
+        with open(tracker_file, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row["Exit Reason"].startswith("Email found"):
+                    hits.add(CONSOLIDATED_RANK.sub("", row["Query"]))
+        total = self.stats.setdefault("total", [0, 0])
+        for query, data in queries.items():
+            hit = int(query in hits)
+            total[0] += hit
+            total[1] += 1
+            for kind, value in query_features(query, data):
+                counts = self.stats.setdefault(kind, {}).setdefault(value, [0, 0])
+                counts[0] += hit
+                counts[1] += 1
+        with open(self.stats_file, "w", encoding="utf-8") as f:
+            json.dump(self.stats, f)
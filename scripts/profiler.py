@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Opt-in profiling for a pipeline run (set PROFILE = True in main.py)
+# Everything is written to profiles/<timestamp>/:
+#   <stage>.prof            cProfile stats, open with snakeviz or python -m pstats
+#   <stage>.txt             top functions by cumulative time
+#   <stage>_memory.txt      tracemalloc allocation growth since the previous stage boundary
+#   summary.json            wall time, memory, event-loop lag and thread-pool queue wait per stage
+PROFILE_DIR = "profiles"
+LAG_SAMPLE_INTERVAL = 0.05  # seconds between event-loop lag samples
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# Before 3.12 cProfile only sees the thread that enabled it, so worker threads profile themselves. From 3.12 on it
+# is a process-wide sys.monitoring tool: the stage profile already records every thread, and enabling a second
+# one while it runs raises ValueError ("Another profiling tool is already active").
+PROFILE_WORKER_THREADS = sys.version_info < (3, 12)
+
+
+class RunProfiler:
+    def __init__(self, base_dir=PROFILE_DIR):
+        self.run_dir = os.path.join(base_dir, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.summary = {}
+        self.loop_lag = {}  # stage -> list of lag samples in seconds
+        self.queue_wait = {}  # stage -> list of thread-pool queue waits in seconds
+        self.thread_profiles = {}  # stage -> list of cProfile.Profile from worker threads
+        tracemalloc.start()
+        self.last_snapshot = tracemalloc.take_snapshot()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        tracemalloc.reset_peak()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            self._write_cpu_profile(name, profile)
+            self._write_memory_diff(name)
+            self.summary[name] = {
+                "wall_seconds": round(elapsed, 4),
+                "traced_memory_mb": round(current / 1e6, 2),
+                "peak_memory_mb": round(peak / 1e6, 2),
+                "loop_lag": _distribution(self.loop_lag.get(name, [])),
+                "thread_queue_wait": _distribution(self.queue_wait.get(name, [])),
+            }
+
+    # Replacement for asyncio.run that samples event-loop lag while the coroutine runs
+    def run_async(self, name, coro):
+        async def monitored():
+            monitor = asyncio.create_task(self._lag_monitor(name))
+            try:
+                return await coro
+            finally:
+                monitor.cancel()
+        return asyncio.run(monitored())
+
+    # The loop should wake up every LAG_SAMPLE_INTERVAL, anything later than that is time
+    # the loop spent running callbacks (JSON decoding, tracker writes, ...) instead of polling sockets
+    async def _lag_monitor(self, name):
+        loop = asyncio.get_running_loop()
+        samples = self.loop_lag.setdefault(name, [])
+        while True:
+            before = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            samples.append(max(0.0, loop.time() - before - LAG_SAMPLE_INTERVAL))
+
+    # Build a task for a ThreadPoolExecutor that records how long it waited in the executor queue
+    # and, before Python 3.12, profiles itself in the worker thread (see PROFILE_WORKER_THREADS)
+    # Usage: executor.submit(profiler.worker_task("validate", func, *args))
+    def worker_task(self, name, func, *args, **kwargs):
+        submitted = time.perf_counter()
+
+        def run():
+            waited = time.perf_counter() - submitted
+            profile = cProfile.Profile() if PROFILE_WORKER_THREADS else None
+            if profile is not None:
+                profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                with self.lock:
+                    self.queue_wait.setdefault(name, []).append(waited)
+                    if profile is not None:
+                        self.thread_profiles.setdefault(name, []).append(profile)
+        return run
+
+    def _write_cpu_profile(self, name, profile):
+        stats = pstats.Stats(profile)
+        for thread_profile in self.thread_profiles.pop(name, []):
+            stats.add(thread_profile)
+        stats.dump_stats(os.path.join(self.run_dir, f"{name}.prof"))
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        with open(os.path.join(self.run_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+
+    def _write_memory_diff(self, name):
+        snapshot = tracemalloc.take_snapshot()
+        diff = snapshot.compare_to(self.last_snapshot, "lineno")
+        self.last_snapshot = snapshot
+        with open(os.path.join(self.run_dir, f"{name}_memory.txt"), "w", encoding="utf-8") as f:
+            for line in diff[:TOP_ALLOCATIONS]:
+                f.write(f"{line}\n")
+
+    def write_summary(self):
+        with open(os.path.join(self.run_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(self.summary, f, indent=2)
+        tracemalloc.stop()
+        print(f"Profile written to {self.run_dir}")
+
+
+# Stage context that does nothing when profiling is off
+def profile_stage(profiler, name):
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+
+# Count, mean, p50, p99 and max in milliseconds
+def _distribution(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
@@ -0,0 +1,246 @@
+import json
+import re
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import openAI
+from .openAI import COMPANY_SYSTEM_PROMPT, JOB_TITLE_SYSTEM_PROMPT, parse_match
+
+try:
+    import tiktoken
+except ImportError:  # optional, tokens are estimated from words and punctuation without it
+    tiktoken = None
+
+# Regression check for the fuzzy-match prompts
+# Sends every pair in LABELED_SAMPLES with the original inline prompts (LEGACY_*) and with the current system
+# prefix + JSON user message, and exits with status 1 when the current prompts use more input tokens per check.
+#   python -m scripts.prompt_check           against a local stand-in that answers with the label, checks tokens
+#                                            and response parsing; latency and verdicts are not checked, the
+#                                            stand-in's answers and timing follow from the prompts themselves
+#   python -m scripts.prompt_check --live    against the OpenAI API, also fails when the current prompts take more
+#                                            time per check or the model gives a different verdict (spends tokens)
+# Latency is the median per check over REPEATS rounds, and the live run allows LIVE_LATENCY_TOLERANCE for noise.
+MODEL = "gpt-4.1-nano"
+REPEATS = 3
+LIVE_LATENCY_TOLERANCE = 1.10
+TITLES = ["owner", "CEO", "President", "Product Manager", "Design Engineer", "Marketing Director"]
+
+# (kind, target, candidate, expected verdict)
+LABELED_SAMPLES = [
+    ("company", "L3Harris Technologies", "L3Harris", True),
+    ("company", "International Business Machines", "IBM", True),
+    ("company", "The Coca-Cola Company", "Coca-Cola", True),
+    ("company", "JPMorgan Chase & Co.", "JPMorgan Chase", True),
+    ("company", "Amazon.com", "Amazon Web Services", True),
+    ("company", "Electro-Harmonix", "Electro-Harmonix / New Sensor Corp.", True),
+    ("company", "Corza Ophthalmology", "Corza Ophthalmology, LLC", True),
+    ("company", "Google LLC", "Microsoft Corporation", False),
+    ("company", "General Electric", "General Mills", False),
+    ("company", "Electro-Harmonix", "Harmonix Music Systems", False),
+    ("company", "Corza Ophthalmology", "Vision Partners Group", False),
+    ("job_title", TITLES, "Chief Executive Officer", True),
+    ("job_title", TITLES, "Founder & CEO", True),
+    ("job_title", TITLES, "Senior Design Engineer", True),
+    ("job_title", TITLES, "Product Owner", True),
+    ("job_title", TITLES, "President / Mechanical Engineer", True),
+    ("job_title", TITLES, "Head of Marketing", True),
+    ("job_title", TITLES, "Staff Accountant", False),
+    ("job_title", TITLES, "Registered Nurse", False),
+    ("job_title", TITLES, "Warehouse Associate", False),
+    ("job_title", TITLES, "Paralegal", False),
+]
+
+
+# The prompts as they were before the fixed system prefix, kept as the reference for this check
+def legacy_company_prompt(target_company, current_company_name):
+    return f"""You are a highly accurate system for matching company names. Your task is to determine if a candidate company name refers to the same entity as a target company name.
+
+        Target Company: "{target_company}"
+        Candidate Company: "{current_company_name}"
+
+        **Instructions:**
+        Focus on the core identity of the company, ignoring legal suffixes, punctuation, and common abbreviations. Consider parent companies and known acronyms.
+
+        **Examples of Matches:**
+        * "L3Harris Technologies" vs "L3Harris"
+        * "Google LLC" vs "Google"
+        * "The Coca-Cola Company" vs "Coca-Cola"
+        * "International Business Machines" vs "IBM"
+        * "General Electric" vs "GE"
+        * "The Boeing Company" vs "Boeing"
+        * "JPMorgan Chase & Co." vs "JPMorgan Chase"
+        * "Amazon Web Services" vs "Amazon"
+        * "Unilever N.V." vs "Unilever"
+        * "Apple Inc." vs "Apple"
+        * "Microsoft Corporation" vs "Microsoft"
+        * "Google LLC" vs "Google"
+        * "Amazon.com" vs "Amazon"
+        
+        Respond with ONLY a JSON object:
+        json
+        {{"match": true/false}}
+    """
+
+
+def legacy_job_title_prompt(target_job_titles, current_job_title):
+    return f"""
+        You are comparing a candidate's current job title to a list of target job titles to determine if they represent the same job function or a closely related role.
+
+        Target Job Titles: {target_job_titles}
+        Candidate Job Title: "{current_job_title}"
+
+        **Core Principle:** Focus on the job's **function and field**, not on literal keywords. Roles in the same domain, even with different seniority or exact titles, should be considered a match.
+
+        **Match Examples:**
+        * **Executive Leadership:** "CEO", "Founder", "President", "Managing Member", "Chief Executive Officer"
+        * **Sales & Marketing:** "VP of Sales", "Sales Director", "Head of Marketing", "Marketing Lead"
+        * **Product/Design/Development:** "Product Manager", "Product Owner", "Product Strategist", "Product Development Engineer", "Product Designer", "Innovation Manager", "Design Engineer"
+        * **Packaging:** "Packaging Engineer", "Structural Packaging Engineer", "Packaging Specialist", "Packaging Design Engineer"
+        * **Software:** "Software Engineer", "Developer", "Programmer", "Full Stack Developer", "Backend Engineer"
+
+        **Key Rules:**
+        1.  **Seniority:** A "Senior" role can match a "Lead" or "Director" role (e.g., "Senior Design Engineer" to "Director of Product Development").
+        2.  **Domain:** The terms "Design," "Development," and "Product" are often used interchangeably for similar functions (e.g., a "Design Engineer" may work in "Product Development").
+        3.  **Multiple Roles:** If the job title contains multiple roles (e.g., "President / Mechanical Engineer"), evaluate each part separately. A match on any single part is a full match.
+
+        Respond with ONLY a JSON object:
+        json
+        {{"match": true/false}}
+    """
+
+
+# Original parsing: any truthy "match" value
+def legacy_parse_match(result):
+    if not result:
+        return False
+    try:
+        return bool(json.loads(result).get("match", False))
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        return False
+
+
+# Return: (system message or None, user message) for one sample
+def legacy_messages(kind, target, candidate):
+    if kind == "company":
+        return None, legacy_company_prompt(target, candidate)
+    return None, legacy_job_title_prompt(target, candidate)
+
+
+def current_messages(kind, target, candidate):
+    if kind == "company":
+        return COMPANY_SYSTEM_PROMPT, json.dumps({"target": target, "candidate": candidate}, ensure_ascii=False)
+    return JOB_TITLE_SYSTEM_PROMPT, json.dumps({"targets": list(target), "candidate": candidate}, ensure_ascii=False)
+
+
+VERSIONS = {
+    "legacy": (legacy_messages, legacy_parse_match),
+    "current": (current_messages, parse_match),
+}
+
+
+# Input tokens of a chat request, exact with tiktoken, otherwise about one per word or punctuation mark
+def count_tokens(messages):
+    text = "".join(message["content"] for message in messages)
+    if tiktoken is not None:
+        tokens = len(tiktoken.get_encoding("o200k_base").encode(text))
+    else:
+        tokens = len(re.findall(r"\w+|[^\w\s]", text))
+    return tokens + 4 * len(messages)  # role and separators
+
+
+# Local OpenAI chat completions stand-in, answers is {user message: verdict}
+def start_standin(answers):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            messages = request["messages"]
+            prompt_tokens = count_tokens(messages)
+            content = json.dumps({"match": answers[messages[-1]["content"]]})
+            body = json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Return: {"tokens": [...], "seconds": [...], "verdicts": [...]} per check, in LABELED_SAMPLES order
+def run_version(version):
+    build, parse = VERSIONS[version]
+    tokens, seconds, verdicts = [], [], []
+    for kind, target, candidate, _ in LABELED_SAMPLES:
+        system, prompt = build(kind, target, candidate)
+        times = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            result, usage = openAI.openai_request(prompt, model=MODEL, system=system)
+            times.append(time.perf_counter() - start)
+        tokens.append(usage or 0)
+        seconds.append(statistics.median(times))
+        verdicts.append(parse(result))
+    return {"tokens": tokens, "seconds": seconds, "verdicts": verdicts}
+
+
+def main(argv):
+    live = "--live" in argv
+    server = None
+    if not live:
+        answers = {}
+        for kind, target, candidate, expected in LABELED_SAMPLES:
+            for build, _ in VERSIONS.values():
+                answers[build(kind, target, candidate)[1]] = expected
+        server = start_standin(answers)
+        openAI.OPENAI_CHAT_URL = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    try:
+        results = {version: run_version(version) for version in VERSIONS}
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    failures = []
+    legacy, current = results["legacy"], results["current"]
+    for kind in ("company", "job_title"):
+        rows = [i for i, sample in enumerate(LABELED_SAMPLES) if sample[0] == kind]
+        for measure in ("tokens", "seconds"):
+            before = statistics.mean(legacy[measure][i] for i in rows)
+            after = statistics.mean(current[measure][i] for i in rows)
+            if measure == "seconds" and not live:
+                print(f"{kind:10} {measure:8} not checked against the stand-in")
+                continue
+            print(f"{kind:10} {measure:8} legacy {before:10.4f}  current {after:10.4f}  ({after / before - 1:+.0%})")
+            allowed = before * (LIVE_LATENCY_TOLERANCE if measure == "seconds" else 1)
+            if after > allowed:
+                failures.append(f"{kind} {measure} per check went up: {before:.4f} -> {after:.4f}")
+    for i, (kind, target, candidate, expected) in enumerate(LABELED_SAMPLES):
+        for version in VERSIONS:
+            # The stand-in answers with the label, a different verdict means the answer was not parsed
+            if not live and results[version]["verdicts"][i] != expected:
+                failures.append(f"{version} {kind} {candidate!r}: stand-in answer {expected} parsed as {results[version]['verdicts'][i]}")
+        if live and current["verdicts"][i] != legacy["verdicts"][i]:
+            failures.append(f"{kind} {candidate!r}: verdict changed from {legacy['verdicts'][i]} to {current['verdicts'][i]}")
+        if live and current["verdicts"][i] != expected:
+            print(f"Mislabeled by the current prompt: {kind} {target!r} / {candidate!r}, expected {expected}")
+    if live:
+        print(f"Verdicts matching labels: legacy {sum(v == s[3] for v, s in zip(legacy['verdicts'], LABELED_SAMPLES))}"
+              f"/{len(LABELED_SAMPLES)}, current {sum(v == s[3] for v, s in zip(current['verdicts'], LABELED_SAMPLES))}/{len(LABELED_SAMPLES)}")
+    else:
+        print("Verdicts not checked against the stand-in, run with --live")
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -12,4 +12,26 @@ def gen_queries(companies_data, job_titles, logger):
         for title in job_titles:
             queries[f"{company_name} {title} site:linkedin.com/in"] = {"company": company_name, "title": title, "domain": root_domain}
             queries[f"{root_domain} {title} site:linkedin.com/in"] = {"company": company_name, "title": title, "domain": root_domain}
-    return queries
\ No newline at end of file
+    return queries
+
+# Consolidated permutation of queries, one search per company form instead of one per title:
+#  [Company Name] + (title1 OR title2 OR ...) + "site:linkedin.com/in"
+#  [domain] + (title1 OR title2 OR ...) + "site:linkedin.com/in"
+# Long title lists are split into groups of MAX_TITLES_PER_QUERY to stay under Google's query length limit
+# Serper returns the top N organic results for these and every /in/ profile among them is kept (see serper.py)
+# Input:: JSON/Dictionary with Company Name, Company Website, and Job Titles
+# Return:: JSON/Dictionary with Query as key and Company Name, Job Titles and first Job Title as values
+MAX_TITLES_PER_QUERY = 10
+
+def gen_consolidated_queries(companies_data, job_titles, logger):
+    queries = {}
+    title_groups = [job_titles[i:i + MAX_TITLES_PER_QUERY] for i in range(0, len(job_titles), MAX_TITLES_PER_QUERY)]
+    for company in companies_data:
+        company_name = company["company"]
+        root_domain = company["Root Domain"]
+        for titles in title_groups:
+            title_clause = " OR ".join(f'"{title}"' if " " in title else title for title in titles)
+            data = {"company": company_name, "title": titles[0], "titles": titles, "domain": root_domain}
+            queries[f"{company_name} ({title_clause}) site:linkedin.com/in"] = data
+            queries[f"{root_domain} ({title_clause}) site:linkedin.com/in"] = dict(data)
+    return queries
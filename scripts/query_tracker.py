@@ -3,10 +3,12 @@ import os
 import threading
 
 class QueryTracker:
-    def __init__(self, filename="allqueries.csv"):
+    # append: keep the rows already in the file (later stages of a pipeline run one stage at a time)
+    def __init__(self, filename="allqueries.csv", append=False):
         self.filename = filename
         self.lock = threading.Lock()  # For thread-safe writing
-        self._initialize_file()
+        if not (append and os.path.exists(filename)):
+            self._initialize_file()
 
     def _initialize_file(self):
         with open(self.filename, mode='w', newline='', encoding='utf-8') as f:
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import random
+import struct
+import tempfile
+import time
+from aiolimiter import AsyncLimiter
+
+try:
+    import fcntl
+except ImportError:  # Windows, fall back to per-process limits
+    fcntl = None
+
+# Host-wide provider limits shared by every pipeline process
+# Each provider budget lives in a small state file under STATE_DIR guarded by flock, so two people running
+# main.py (or main.py next to the service) split the contract limit instead of each assuming they own it.
+#   Rate limits:        token bucket file <provider>.bucket holding (tokens, last refill time)
+#   Concurrency limits: <slots> lock files <provider>.slot.<n>, a process holds a slot while it has the
+#                       file flocked, and the kernel drops the lock if the process dies. A process only takes a
+#                       slot while it holds the turn file <provider>.turn, so a process that released a slot
+#                       cannot hand it straight to its own waiters while another process is waiting for one
+SHARED_LIMITS = True
+STATE_DIR = os.path.join(tempfile.gettempdir(), "contactgen-limits")
+
+_BUCKET_FORMAT = "dd"  # tokens, last refill timestamp
+_BUCKET_SIZE = struct.calcsize(_BUCKET_FORMAT)
+_BATCH_SECONDS = 0.05  # tokens taken from the shared bucket at once, as seconds of the rate
+_SLOT_POLL_SECONDS = 0.005  # first wait between scans for a free slot or the turn, doubled up to _SLOT_POLL_MAX
+_SLOT_POLL_MAX = 0.02  # well below a provider request, a freed slot does not sit idle for long
+
+
+# Per-event-loop asyncio primitives, limiters are module-level and outlive the asyncio.run of a single stage
+class _LoopLocal:
+    def __init__(self, factory):
+        self.factory = factory
+        self.loop = None
+        self.value = None
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop, self.value = loop, self.factory()
+        return self.value
+
+
+# Token bucket shared across processes
+# Drop-in for aiolimiter.AsyncLimiter: use as "async with limiter:"
+# Only one coroutine per process touches the bucket file at a time and takes a batch of up to _BATCH_SECONDS
+# worth of tokens, the others wait on a local lock and use the batch, so the flocked file is read once per
+# batch instead of once per request
+class SharedRateLimiter:
+    def __init__(self, provider, max_rate, time_period=1, state_dir=STATE_DIR):
+        self.provider = provider
+        self.rate = max_rate / time_period  # tokens per second
+        self.capacity = max_rate
+        self.batch = max(1, int(self.rate * _BATCH_SECONDS))
+        self.tokens = 0  # taken from the shared bucket, not used yet
+        self.refill_lock = _LoopLocal(asyncio.Lock)
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f"{provider}.bucket")
+
+    async def acquire(self):
+        while self.tokens < 1:
+            async with self.refill_lock.get():
+                # Another coroutine may have refilled while this one waited for the lock
+                if self.tokens >= 1:
+                    break
+                taken, wait = self._take(self.batch)
+                self.tokens += taken
+                if not taken:
+                    await asyncio.sleep(wait)
+        self.tokens -= 1
+
+    # Take up to n tokens
+    # Return: (tokens taken, seconds until the next token is refilled when none were available)
+    def _take(self, n):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            raw = os.pread(fd, _BUCKET_SIZE, 0)
+            if len(raw) == _BUCKET_SIZE:
+                tokens, last = struct.unpack(_BUCKET_FORMAT, raw)
+                tokens = min(self.capacity, tokens + max(0.0, now - last) * self.rate)
+            else:
+                tokens = self.capacity
+            taken = min(n, int(tokens))
+            tokens -= taken
+            os.pwrite(fd, struct.pack(_BUCKET_FORMAT, tokens, now), 0)
+            return taken, (0 if taken else (1 - tokens) / self.rate)
+        finally:
+            os.close(fd)  # closing the descriptor also releases the flock
+
+    async def __aenter__(self):
+        await self.acquire()
+        return None
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return None
+
+
+# Concurrency limit shared across processes
+# Drop-in for asyncio.Semaphore: use as "async with semaphore:"
+# Only one waiting coroutine per process scans the slot files, with exponential backoff while every slot is
+# taken, the others wait on a local lock. Releasing a slot in this process wakes the scanner straight away, but
+# it has to get the host-wide turn first: the process holding the turn keeps it until it has a slot, so a
+# process waiting on the host gets the next free slot instead of losing it to the releasing process every time.
+class SharedSemaphore:
+    def __init__(self, provider, slots, state_dir=STATE_DIR):
+        self.provider = provider
+        self.slots = slots
+        os.makedirs(state_dir, exist_ok=True)
+        self.paths = [os.path.join(state_dir, f"{provider}.slot.{i}") for i in range(slots)]
+        self.turn_path = os.path.join(state_dir, f"{provider}.turn")
+        self.turn_fd = None
+        # Never wait on more host slots than exist
+        self.local = _LoopLocal(lambda: asyncio.Semaphore(slots))
+        self.scan_lock = _LoopLocal(asyncio.Lock)
+        self.released = _LoopLocal(asyncio.Event)
+        self.held = {}  # slot index -> locked file descriptor
+
+    async def acquire(self):
+        local = self.local.get()
+        await local.acquire()
+        try:
+            async with self.scan_lock.get():
+                released = self.released.get()
+                delay = _SLOT_POLL_SECONDS
+                while True:
+                    released.clear()
+                    if self._try_turn():
+                        try:
+                            if self._try_slot():
+                                return
+                            delay = _SLOT_POLL_SECONDS
+                            # Every slot is taken, keep the turn and wait for the next free one
+                            while True:
+                                released.clear()
+                                await self._wait(released, delay)
+                                if self._try_slot():
+                                    return
+                                delay = min(_SLOT_POLL_MAX, delay * 2)
+                        finally:
+                            fcntl.flock(self.turn_fd, fcntl.LOCK_UN)
+                    await self._wait(released, delay)
+                    delay = min(_SLOT_POLL_MAX, delay * 2)
+        except BaseException:
+            local.release()
+            raise
+
+    # Wait until a slot is released in this process or for delay seconds
+    @staticmethod
+    async def _wait(released, delay):
+        try:
+            await asyncio.wait_for(released.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def release(self):
+        _, fd = self.held.popitem()
+        os.close(fd)
+        self.released.get().set()
+        self.local.get().release()
+
+    # Return: True if this process now holds the turn
+    def _try_turn(self):
+        if self.turn_fd is None:
+            self.turn_fd = os.open(self.turn_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(self.turn_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    # Try to lock any free slot file not held by this process, starting at a random slot to spread processes out
+    # Return: True if a slot was locked
+    def _try_slot(self):
+        start = random.randrange(self.slots)
+        for i in range(self.slots):
+            index = (start + i) % self.slots
+            if index in self.held:
+                continue
+            fd = os.open(self.paths[index], os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.held[index] = fd
+                return True
+            except OSError:
+                os.close(fd)
+        return False
+
+    async def __aenter__(self):
+        await self.acquire()
+        return None
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return None
+
+
+# Factories used by the stage modules
+# Return the shared implementation when enabled and supported, otherwise the per-process one
+def rate_limiter(provider, max_rate, time_period=1):
+    if SHARED_LIMITS and fcntl is not None:
+        return SharedRateLimiter(provider, max_rate, time_period)
+    return AsyncLimiter(max_rate, time_period)
+
+
+def concurrency_limiter(provider, slots):
+    if SHARED_LIMITS and fcntl is not None:
+        return SharedSemaphore(provider, slots)
+    return asyncio.Semaphore(slots)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import aiohttp
+
+# Retry handling for transient provider failures
+# Every provider call goes through retry_async/retry_sync: retryable errors (429, 5xx, timeouts, dropped
+# connections) are retried with jittered exponential backoff, anything else fails straight away.
+# Items that are still failing after MAX_ATTEMPTS are appended to the dead-letter file with the stage they
+# failed in, so they can be replayed later with:
+#   python -m scripts.retry replay [deadletter.jsonl] [input.csv]
+MAX_ATTEMPTS = 4
+BASE_DELAY = 0.5  # seconds, doubled on every attempt
+MAX_DELAY = 30.0
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+DEAD_LETTER_FILE = "deadletter.jsonl"
+REPLAY_OUTPUT_FILE = "replay_output.csv"
+
+
+# Raised by a single provider request when the response status is worth retrying
+class TransientError(Exception):
+    def __init__(self, provider, status, detail=""):
+        super().__init__(f"{provider} returned retryable status {status} {detail}".strip())
+        self.provider = provider
+        self.status = status
+
+
+def is_retryable(error):
+    if isinstance(error, TransientError):
+        return True
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)):
+        return True
+    # requests is only used by the OpenAI module, check it by name so it is not imported here
+    module = type(error).__module__ or ""
+    if module.startswith("requests") and type(error).__name__ in ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout", "ChunkedEncodingError"):
+        return True
+    return False
+
+
+# Full jitter: random delay between 0 and the exponential cap for this attempt
+def backoff_delay(attempt):
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+
+async def retry_async(func, *args, attempts=MAX_ATTEMPTS, **kwargs):
+    for attempt in range(attempts):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt == attempts - 1:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+def retry_sync(func, *args, attempts=MAX_ATTEMPTS, **kwargs):
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt == attempts - 1:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+
+# Append-only JSON lines file of items that ran out of retries
+# Each line: {"stage": ..., "key": <query>, "item": <stage input for that query>, "error": ..., "time": ...}
+class DeadLetterQueue:
+    def __init__(self, filename=DEAD_LETTER_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def add(self, stage, key, item, error):
+        line = json.dumps({"stage": stage, "key": key, "item": item, "error": str(error), "time": time.time()}, default=str)
+        with self.lock:
+            with open(self.filename, mode='a', encoding='utf-8') as f:
+                f.write(line + "\n")
+            self.count += 1
+
+    def read(self):
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+# Shared by all stage modules
+dead_letters = DeadLetterQueue()
+
+
+# Replay a dead-letter file: every item re-enters the pipeline at the stage it failed in and runs
+# through the remaining stages. Items that fail again are written to a fresh dead-letter file.
+def replay(filename=DEAD_LETTER_FILE, input_path="input.csv", output_path=REPLAY_OUTPUT_FILE):
+    import polars as pl
+    from main import output_results
+    from .Logger import Logger
+    from .query_tracker import QueryTracker
+    from .serper import get_linkedin_urls_sync
+    from .deduplicate import deduplicate_linkedin_urls
+    from .enrich_urls import enrich_urls_sync
+    from .validateprofile import validate_profiles
+    from .findymail import findymail_sync
+    from .normalize import add_company_key
+
+    replaying = filename + ".replaying"
+    if not os.path.exists(filename):
+        print(f"No dead-letter file at {filename}")
+        return
+    os.replace(filename, replaying)
+    entries = DeadLetterQueue(replaying).read()
+    print(f"Replaying {len(entries)} dead-lettered items")
+
+    by_stage = {"serper": {}, "icypeas": {}, "openai": {}, "findymail": {}}
+    for entry in entries:
+        by_stage.setdefault(entry["stage"], {})[entry["key"]] = entry["item"]
+
+    logger = Logger()
+    tracker = QueryTracker("replay_queries.csv")
+
+    urls = get_linkedin_urls_sync(by_stage["serper"], tracker, logger) if by_stage["serper"] else {}
+    to_enrich = deduplicate_linkedin_urls(urls, tracker)
+    to_enrich.update(by_stage["icypeas"])
+    to_validate = enrich_urls_sync(to_enrich, tracker, logger) if to_enrich else {}
+    to_validate.update(by_stage["openai"])
+    to_email = validate_profiles(to_validate, tracker, logger) if to_validate else {}
+    logger.add_matches(len(to_email))
+    to_email.update(by_stage["findymail"])
+    emails = findymail_sync(to_email, tracker, logger) if to_email else {}
+
+    output_results(emails, add_company_key(pl.read_csv(input_path))).write_csv(output_path)
+    os.remove(replaying)
+    logger.output()
+    print(f"Replay output written to {output_path}, {dead_letters.count} items failed again and were dead-lettered")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "replay":
+        print("Usage: python -m scripts.retry replay [deadletter.jsonl] [input.csv]")
+        sys.exit(1)
+    replay(*sys.argv[2:4])
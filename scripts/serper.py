@@ -1,44 +1,76 @@
 import aiohttp
 import asyncio
+import contextlib
 import re
 import json
-from aiolimiter import AsyncLimiter
-from .creds import API_KEYS
+from .cassette import http_post, CassetteMiss
+from .decoders import decode_serper, DecodeError
+from .key_pool import serper_keys
+from .retry import TransientError, RETRYABLE_STATUSES, is_retryable, retry_async, dead_letters
+
+# Number of organic results requested and scanned for consolidated queries (see queries.gen_consolidated_queries)
+CONSOLIDATED_TOP_N = 10
+LINKEDIN_PROFILE_PATTERN = re.compile(r'linkedin\.com/in/')
+
+# Search one query with retries for transient failures
+# Queries that still fail after the last attempt are dead-lettered so they can be replayed later
+async def serper_search(data, tracker, logger, semaphore, session, rate_limiter, cache=None):
+    try:
+        return await retry_async(serper_request, data, tracker, logger, semaphore, session, rate_limiter, cache)
+    except Exception as e:
+        if not is_retryable(e):
+            raise
+        tracker.log(data[0], f"Serper retries exhausted, dead-lettered: {e}")
+        dead_letters.add("serper", data[0], data[1], e)
+        return {data[0]: {"url": "", "company": data[1]["company"], "title": data[1]["title"], "domain": data[1]["domain"]}}
 
 # Use Serper API to get a single LinkedIn profile URL
-async def serper_request(data, tracker, logger, semaphore, session, rate_limiter):
+# Raises TransientError / aiohttp.ClientError for failures worth retrying (see serper_search)
+async def serper_request(data, tracker, logger, semaphore, session, rate_limiter, cache=None):
     company = data[1]["company"]
     title = data[1]["title"]
     domain = data[1]["domain"]
     serper_api_url = "https://google.serper.dev/search"
-    serper_api_key = API_KEYS["SERPER_API_KEY"]
-    headers = {
-        'X-API-KEY': serper_api_key,
-        'Content-Type': 'application/json'
-    }
     
     try:
-        payload = json.dumps([{"q": data[0]}])
+        search = {"q": data[0]}
+        if "titles" in data[1]:
+            search["num"] = CONSOLIDATED_TOP_N
+        payload = json.dumps([search])
         async with semaphore:
-            async with rate_limiter:  # Apply rate limiting here
-                async with session.post(serper_api_url, headers=headers, data=payload) as response:
-                    response_data = await response.json()
-                    organic_results = response_data[0].get('organic', [])
-                    if response.status == 200:
-                        logger.add_serper(1)
-                        if organic_results:
-                            link = organic_results[0].get('link', '')
-                            if link and bool(re.search(r'linkedin\.com/in/', link)):
-                                logger.add_urls_found(1)
-                                return {data[0]: {"url": link, "company": company, "title": title, "domain": domain}}
-                            tracker.log(data[0], f"No valid LinkedIn URL found. Serper link: {link}")
-                            print(f"No valid LinkedIn URL found for query '{data[0]}'. Link: {link}")
-                        tracker.log(data[0], f"Empty result from Serper API: {response_data}")
-                        return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
-                    else:
+            # Rate limiting: the key's own limit, plus the optional shared limit passed in
+            async with rate_limiter, serper_keys.use() as key:
+                headers = {
+                    'X-API-KEY': key.key,
+                    'Content-Type': 'application/json'
+                }
+                async with http_post(session, serper_api_url, headers=headers, data=payload) as response:
+                    serper_keys.report(key, response.status, logger, cost=int(response.status == 200))
+                    if response.status in RETRYABLE_STATUSES:
+                        raise TransientError("Serper", response.status)
+                    # Error bodies are not search results, only a 200 is decoded
+                    if response.status != 200:
                         tracker.log(data[0], f"Failed API request: {response.status}")
                         return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
+                    response_data = decode_serper(await response.read())
+                    organic_results = response_data[0].get('organic', [])
+                    logger.add_serper(1)
+                    if cache is not None:
+                        cache[data[0]] = organic_results
+                    if "titles" in data[1]:
+                        return consolidated_results(data, organic_results, tracker, logger)
+                    if organic_results:
+                        link = organic_results[0].get('link', '')
+                        if link and bool(re.search(r'linkedin\.com/in/', link)):
+                            logger.add_urls_found(1)
+                            return {data[0]: {"url": link, "company": company, "title": title, "domain": domain}}
+                        tracker.log(data[0], f"No valid LinkedIn URL found. Serper link: {link}")
+                        print(f"No valid LinkedIn URL found for query '{data[0]}'. Link: {link}")
+                    tracker.log(data[0], f"Empty result from Serper API: {response_data}")
+                    return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
     except aiohttp.ClientError as e:
+        if is_retryable(e):
+            raise
         tracker.log(data[0], f"Error during API call: {e}")
         print(f"Error during API call: {e}")
         return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
@@ -46,54 +78,136 @@ async def serper_request(data, tracker, logger, semaphore, session, rate_limiter
         tracker.log(data[0], f"Missing API key: {e}")
         print(f"Missing API key: {e}")
         return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
-    except json.JSONDecodeError as e:
+    except DecodeError as e:
         tracker.log(data[0], f"Error parsing JSON response: {e}")
         print(f"Error parsing JSON response: {e}")
         return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
 
+# Collect every LinkedIn /in/ profile from the top N results of a consolidated (multi-title OR) query
+# and attribute each one to the titles that appear in its result title or snippet.
+# A profile that mentions none of the titles is attributed to all of them and left to validation.
+# Return: {"<query> #<rank>": {url, company, title, matched_titles, domain}} or the usual empty result
+def consolidated_results(data, organic_results, tracker, logger):
+    company = data[1]["company"]
+    titles = data[1]["titles"]
+    domain = data[1]["domain"]
+    results = {}
+    for rank, organic in enumerate(organic_results[:CONSOLIDATED_TOP_N], start=1):
+        link = organic.get('link', '')
+        if not link or not LINKEDIN_PROFILE_PATTERN.search(link):
+            continue
+        text = f"{organic.get('title', '')} {organic.get('snippet', '')}".lower()
+        matched_titles = [title for title in titles if title.lower() in text] or list(titles)
+        results[f"{data[0]} #{rank}"] = {
+            "url": link, "company": company, "title": matched_titles[0],
+            "matched_titles": matched_titles, "domain": domain
+        }
+    if not results:
+        tracker.log(data[0], f"No valid LinkedIn URL found in top {CONSOLIDATED_TOP_N} results")
+        return {data[0]: {"url": "", "company": company, "title": data[1]["title"], "domain": domain}}
+    logger.add_urls_found(len(results))
+    return results
+
+# Resolve a query from a cache of earlier Serper organic results (service mode keeps one warm across jobs)
+# Return: same shape as serper_request
+def cached_serper_result(data, organic_results, tracker, logger):
+    if "titles" in data[1]:
+        return consolidated_results(data, organic_results, tracker, logger)
+    company = data[1]["company"]
+    title = data[1]["title"]
+    domain = data[1]["domain"]
+    if organic_results:
+        link = organic_results[0].get('link', '')
+        if link and bool(re.search(r'linkedin\.com/in/', link)):
+            logger.add_urls_found(1)
+            return {data[0]: {"url": link, "company": company, "title": title, "domain": domain}}
+    tracker.log(data[0], "Empty result from Serper API (cached)")
+    return {data[0]: {"url": "", "company": company, "title": title, "domain": domain}}
+
 # Find LinkedIn URLs in a dictionary of queries using serper_request function 
-async def get_linkedin_urls(query_dict, tracker, logger):
-    MAX_CONCURRENT_REQUESTS = 220
-    MAX_REQUESTS_PER_SECOND = 220  # Target rate (Serper API limit)
+# session, rate_limiter and semaphore can be passed in to share them between runs (see scripts/service.py),
+# otherwise a fresh set is created for this call
+# cache: optional dict of {query: organic results} that is read before and filled after each request
+# time_limit: optional seconds after which no new queries are started, the rest are logged as skipped
+async def get_linkedin_urls(query_dict, tracker, logger, session=None, rate_limiter=None, semaphore=None, cache=None, time_limit=None):
+    # 220 per Serper key (API limit), each key's requests per second are limited in the key pool and shared
+    # with other runs on this host
+    MAX_CONCURRENT_REQUESTS = serper_keys.total_limit()
     linkedin_urls = {}
     
     # Create semaphore to limit concurrent requests
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
     
-    # Create rate limiter: 300 requests per second
-    rate_limiter = AsyncLimiter(MAX_REQUESTS_PER_SECOND, 1)  # 300 requests per 1 second
+    # No limit on top of the per-key limits unless one is passed in
+    if rate_limiter is None:
+        rate_limiter = contextlib.nullcontext()
 
-    queries = list(query_dict.items())
-    if not queries:
+    if not query_dict:
         return linkedin_urls
     
-    async with aiohttp.ClientSession(connector=connector) as session: 
-        # Create all tasks immediately without rate limiting
-        tasks = [
-            asyncio.create_task(serper_request(query, tracker, logger, semaphore, session, rate_limiter))
-            for query in queries
-        ]
-        
-        # Collect results as they complete
-        for completed_task in asyncio.as_completed(tasks):
+    if session is None:
+        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            return await _run_serper_workers(query_dict, linkedin_urls, tracker, logger, semaphore, session, rate_limiter, cache, MAX_CONCURRENT_REQUESTS, time_limit)
+    return await _run_serper_workers(query_dict, linkedin_urls, tracker, logger, semaphore, session, rate_limiter, cache, MAX_CONCURRENT_REQUESTS, time_limit)
+
+# Feed queries through a bounded queue to a fixed pool of worker coroutines
+# Only num_workers coroutines and 2 * num_workers queued queries are alive at any time, whatever the number of
+# queries, and results are written straight into linkedin_urls keyed by query
+async def _run_serper_workers(query_dict, linkedin_urls, tracker, logger, semaphore, session, rate_limiter, cache, num_workers, time_limit):
+    queue = asyncio.Queue(maxsize=2 * num_workers)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_limit if time_limit is not None else None
+
+    async def worker():
+        while True:
+            query = await queue.get()
+            if query is None:
+                return
             try:
-                result = await completed_task
-                if isinstance(result, dict):
-                    linkedin_urls.update(result)
+                linkedin_urls.update(await serper_search(query, tracker, logger, semaphore, session, rate_limiter, cache))
+            except CassetteMiss:
+                raise
             except Exception as e:
-                query_key = queries[tasks.index(completed_task)][0]
-                tracker.log(query_key, f"Task exception: {e}")
-                print(f"Task exception for query '{query_key}': {e}")
-                linkedin_urls[query_key] = {
-                    "url": "", 
-                    "company": queries[tasks.index(completed_task)][1]["company"], 
-                    "title": queries[tasks.index(completed_task)][1]["title"],
-                    "domain": queries[tasks.index(completed_task)][1]["domain"]
+                tracker.log(query[0], f"Task exception: {e}")
+                print(f"Task exception for query '{query[0]}': {e}")
+                linkedin_urls[query[0]] = {
+                    "url": "",
+                    "company": query[1]["company"],
+                    "title": query[1]["title"],
+                    "domain": query[1]["domain"]
                 }
-    
+
+    async def feed():
+        for query in query_dict.items():
+            if cache and query[0] in cache:
+                linkedin_urls.update(cached_serper_result(query, cache[query[0]], tracker, logger))
+            elif deadline is not None and loop.time() >= deadline:
+                tracker.log(query[0], "Skipped: Serper time limit reached")
+            else:
+                await queue.put(query)
+        for _ in workers:
+            await queue.put(None)
+
+    # The feeder runs as a task next to the workers: when a worker dies (CassetteMiss) nothing drains the bounded
+    # queue any more, so the feeder and the other workers are cancelled and the error is raised instead of hanging
+    workers = [asyncio.create_task(worker()) for _ in range(num_workers)]
+    tasks = workers + [asyncio.create_task(feed())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+
     return linkedin_urls
 
 # Wrapper to run the async function
-def get_linkedin_urls_sync(query_dict, tracker, logger):
-    return asyncio.run(get_linkedin_urls(query_dict, tracker, logger))
\ No newline at end of file
+# Pass a RunProfiler to sample event-loop lag while the stage runs
+def get_linkedin_urls_sync(query_dict, tracker, logger, profiler=None, time_limit=None):
+    if profiler is not None:
+        return profiler.run_async("serper", get_linkedin_urls(query_dict, tracker, logger, time_limit=time_limit))
+    return asyncio.run(get_linkedin_urls(query_dict, tracker, logger, time_limit=time_limit))
\ No newline at end of file
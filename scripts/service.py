@@ -0,0 +1,392 @@
+import asyncio
+import collections
+import concurrent.futures
+import os
+import shutil
+import time
+import uuid
+import aiohttp
+import polars as pl
+from aiohttp import web
+from .Logger import Logger
+from .query_tracker import QueryTracker
+from .queries import gen_queries
+from .serper import get_linkedin_urls
+from .deduplicate import deduplicate_linkedin_urls
+from .enrich_urls import enrich_urls
+from .validateprofile import validate_profiles_async
+from .findymail import findymail
+from .circuit_breaker import DomainBreaker
+from .normalize import add_company_key, unique_companies
+from .key_pool import serper_keys, icypeas_keys, findymail_keys
+
+# Long-running service mode
+# Keeps one warm aiohttp session, one set of provider rate limiters, one validation thread pool and a Serper
+# result cache for the lifetime of the process, and runs submitted input files as jobs over them.
+#
+# Start:   python -m scripts.service
+# Submit:  curl -X POST --data-binary @input.csv -H "Content-Type: text/csv" http://127.0.0.1:8080/jobs
+#          curl -X POST -d '{"path": "input.csv"}' -H "Content-Type: application/json" http://127.0.0.1:8080/jobs
+# Poll:    curl http://127.0.0.1:8080/jobs/<id>
+# Result:  curl http://127.0.0.1:8080/jobs/<id>/result
+HOST = "127.0.0.1"
+PORT = 8080
+JOBS_DIR = "jobs"
+MAX_CONCURRENT_JOBS = 8
+SERPER_CACHE_SIZE = 200_000  # queries kept in the Serper result cache, least recently used are dropped first
+SERPER_CACHE_TTL = 24 * 3600  # seconds before a cached query is searched again
+FINISHED_JOB_TTL = 24 * 3600  # seconds a finished job and its directory are kept for polling and download
+MAX_FINISHED_JOBS = 500
+VALIDATION_THREADS = 70  # profiles validated at once across all jobs, each holds a thread while it waits on OpenAI
+
+# Provider concurrency shared by every job is the sum of the per-key limits in scripts/key_pool.py
+# The per-key rate and Findymail concurrency budgets are also shared with main.py runs through scripts/rate_coordinator.py
+
+
+# Concurrency gate shared by all jobs that hands out free slots round-robin between jobs,
+# so a job with 100k waiting requests cannot starve a job with 50 waiting requests.
+# Use for_job(job_id) to get an async context manager usable in place of an asyncio.Semaphore,
+# with an optional inner limiter (e.g. the host-wide Findymail slots) entered once the fair slot is granted
+class FairGate:
+    def __init__(self, slots):
+        self.free = slots
+        self.waiters = {}  # job_id -> deque of futures waiting for a slot
+        self.order = collections.deque()  # job ids with waiters, in round-robin order
+
+    def for_job(self, job_id, inner=None):
+        return _JobSlot(self, job_id, inner)
+
+    async def acquire(self, job_id):
+        if self.free > 0 and not self.order:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        job_waiters = self.waiters.get(job_id)
+        if job_waiters is None:
+            job_waiters = self.waiters[job_id] = collections.deque()
+            self.order.append(job_id)
+        job_waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot was granted right before the cancellation, hand it to the next waiter
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.order:
+            job_id = self.order.popleft()
+            job_waiters = self.waiters[job_id]
+            future = job_waiters.popleft()
+            if job_waiters:
+                self.order.append(job_id)
+            else:
+                del self.waiters[job_id]
+            # Cancelled waiters are skipped lazily here
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class _JobSlot:
+    def __init__(self, gate, job_id, inner=None):
+        self.gate = gate
+        self.job_id = job_id
+        self.inner = inner
+
+    async def __aenter__(self):
+        await self.gate.acquire(self.job_id)
+        if self.inner is not None:
+            try:
+                await self.inner.__aenter__()
+            except BaseException:
+                self.gate.release()
+                raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if self.inner is not None:
+                await self.inner.__aexit__(exc_type, exc, tb)
+        finally:
+            self.gate.release()
+        return False
+
+
+# Serper result cache shared by all jobs: {query: organic results} with a size bound and an expiry
+# Supports the dict operations get_linkedin_urls uses ("in", [], []=, len)
+class SerperCache:
+    def __init__(self, max_size=SERPER_CACHE_SIZE, ttl=SERPER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # query -> (time stored, organic results), oldest use first
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, query):
+        entry = self.entries.get(query)
+        if entry is None:
+            return False
+        if time.time() - entry[0] >= self.ttl:
+            del self.entries[query]
+            return False
+        return True
+
+    def __getitem__(self, query):
+        if query not in self:
+            raise KeyError(query)
+        self.entries.move_to_end(query)
+        return self.entries[query][1]
+
+    def __setitem__(self, query, organic_results):
+        self.entries[query] = (time.time(), organic_results)
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+# One submitted input file and everything needed to report on it
+class Job:
+    def __init__(self, job_id, input_path, job_dir):
+        self.id = job_id
+        self.input_path = input_path
+        self.dir = job_dir
+        self.output_path = os.path.join(job_dir, "output.csv")
+        self.status = "queued"
+        self.stage = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.logger = Logger()
+        self.tracker = QueryTracker(os.path.join(job_dir, "allqueries.csv"))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "input_companies": self.logger.total_input_companies,
+            "queries": self.logger.total_queries_processed,
+            "urls_found": self.logger.total_urls_found,
+            "matches": self.logger.total_matches,
+            "emails_found": self.logger.total_emails_found,
+        }
+
+
+# Holds the warm state and runs jobs from a queue with MAX_CONCURRENT_JOBS runners
+class PipelineService:
+    def __init__(self, jobs_dir=JOBS_DIR, max_concurrent_jobs=MAX_CONCURRENT_JOBS):
+        self.jobs_dir = jobs_dir
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.jobs = {}
+        self.queue = None
+        self.runners = []
+        self.session = None
+        self.serper_cache = SerperCache()
+        # One breaker for every job, so concurrent jobs see each other's misses and do not overwrite its state file
+        self.breaker = None
+        self.validation_executor = None
+
+    async def start(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        serper_slots = serper_keys.total_limit()
+        icypeas_slots = icypeas_keys.total_limit()
+        findymail_slots = findymail_keys.total_limit()
+        connector = aiohttp.TCPConnector(limit=serper_slots + icypeas_slots + findymail_slots)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.serper_gate = FairGate(serper_slots)
+        self.icypeas_gate = FairGate(icypeas_slots)
+        self.findymail_gate = FairGate(findymail_slots)
+        # OpenAI calls are blocking, a job gets validation threads round-robin with the other jobs
+        self.validation_executor = concurrent.futures.ThreadPoolExecutor(max_workers=VALIDATION_THREADS)
+        self.openai_gate = FairGate(VALIDATION_THREADS)
+        self.breaker = DomainBreaker()
+        self.queue = asyncio.Queue()
+        self.runners = [asyncio.create_task(self._runner()) for _ in range(self.max_concurrent_jobs)]
+
+    async def stop(self):
+        for runner in self.runners:
+            runner.cancel()
+        await asyncio.gather(*self.runners, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+        if self.validation_executor is not None:
+            self.validation_executor.shutdown(wait=False)
+        if self.breaker is not None:
+            self.breaker.save()
+
+    def submit(self, input_path=None, csv_bytes=None):
+        self.prune_jobs()
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        if csv_bytes is not None:
+            input_path = os.path.join(job_dir, "input.csv")
+            with open(input_path, "wb") as f:
+                f.write(csv_bytes)
+        job = Job(job_id, input_path, job_dir)
+        self.jobs[job_id] = job
+        self.queue.put_nowait(job)
+        return job
+
+    async def _runner(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run_job(job)
+            finally:
+                self.breaker.save()
+                self.queue.task_done()
+
+    # Forget finished jobs older than FINISHED_JOB_TTL and the oldest beyond MAX_FINISHED_JOBS, and delete their directories
+    def prune_jobs(self):
+        now = time.time()
+        finished = sorted(
+            (job for job in self.jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at,
+        )
+        excess = len(finished) - MAX_FINISHED_JOBS
+        for i, job in enumerate(finished):
+            if i < excess or now - job.finished_at >= FINISHED_JOB_TTL:
+                del self.jobs[job.id]
+                shutil.rmtree(job.dir, ignore_errors=True)
+
+    async def run_job(self, job):
+        # Imported here to avoid a circular import, main imports the stage modules too
+        from main import output_results
+
+        job.status = "running"
+        job.started_at = time.time()
+        logger = job.logger
+        tracker = job.tracker
+        try:
+            job.stage = "queries"
+            input_df = pl.read_csv(job.input_path)
+            str_job_titles = input_df["job titles"][0]
+            job_titles = [title.strip() for title in str_job_titles.split(",")]
+            input_df = add_company_key(input_df)
+            companies_data = unique_companies(input_df)
+            logger.total_input_companies = len(companies_data)
+            queries = gen_queries(companies_data, job_titles, logger)
+            logger.add_queries(len(queries))
+
+            job.stage = "search"
+            urls = await get_linkedin_urls(
+                queries, tracker, logger,
+                session=self.session,
+                semaphore=self.serper_gate.for_job(job.id),
+                cache=self.serper_cache,
+            )
+
+            job.stage = "dedup"
+            deduplicated_urls = deduplicate_linkedin_urls(urls, tracker)
+            logger.add_deduplicated(len(deduplicated_urls))
+
+            job.stage = "enrich"
+            icypeas_profiles = await enrich_urls(
+                deduplicated_urls, tracker, logger,
+                session=self.session,
+                semaphore=self.icypeas_gate.for_job(job.id),
+            )
+
+            job.stage = "validate"
+            validated_profiles = await validate_profiles_async(
+                icypeas_profiles, tracker, logger,
+                executor=self.validation_executor,
+                semaphore=self.openai_gate.for_job(job.id),
+            )
+            logger.add_matches(len(validated_profiles))
+
+            job.stage = "email"
+            emails = await findymail(
+                validated_profiles, tracker, logger,
+                session=self.session,
+                semaphore=self.findymail_gate.for_job(job.id),
+                breaker=self.breaker,
+            )
+
+            job.stage = "output"
+            output_results(emails, input_df).write_csv(job.output_path)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Job {job.id} failed in stage {job.stage}: {e}")
+        finally:
+            job.finished_at = time.time()
+
+
+# HTTP handlers
+async def submit_job(request):
+    service = request.app["service"]
+    if request.content_type == "application/json":
+        body = await request.json()
+        input_path = body.get("path")
+        if not input_path or not os.path.isfile(input_path):
+            raise web.HTTPBadRequest(text=f"Input file not found: {input_path}")
+        job = service.submit(input_path=input_path)
+    else:
+        csv_bytes = await request.read()
+        if not csv_bytes:
+            raise web.HTTPBadRequest(text="Empty request body, send CSV content or a JSON {\"path\": ...}")
+        job = service.submit(csv_bytes=csv_bytes)
+    return web.json_response(job.to_dict(), status=202)
+
+
+async def list_jobs(request):
+    service = request.app["service"]
+    return web.json_response([job.to_dict() for job in service.jobs.values()])
+
+
+async def job_status(request):
+    job = _get_job(request)
+    return web.json_response(job.to_dict())
+
+
+async def job_result(request):
+    job = _get_job(request)
+    if job.status != "done":
+        raise web.HTTPConflict(text=f"Job {job.id} is {job.status}")
+    return web.FileResponse(job.output_path, headers={"Content-Type": "text/csv"})
+
+
+def _get_job(request):
+    job = request.app["service"].jobs.get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text="Unknown job")
+    return job
+
+
+def create_app(service=None):
+    app = web.Application(client_max_size=1024 ** 3)
+    app["service"] = service or PipelineService()
+
+    async def on_startup(app):
+        await app["service"].start()
+
+    async def on_cleanup(app):
+        await app["service"].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/jobs", submit_job)
+    app.router.add_get("/jobs", list_jobs)
+    app.router.add_get("/jobs/{job_id}", job_status)
+    app.router.add_get("/jobs/{job_id}/result", job_result)
+    return app
+
+
+def serve(host=HOST, port=PORT):
+    web.run_app(create_app(), host=host, port=port)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,306 @@
+import csv
+import hashlib
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import unicodedata
+from urllib.parse import unquote
+
+# Suppression index of contacts that were already delivered or must not be contacted
+# Holds canonical LinkedIn URLs, (full name, domain) pairs and emails from past output.csv files and
+# do-not-contact lists. The pipeline drops suppressed profiles right after deduplication (URL) and before
+# Findymail (URL, name and domain), so they never cost Icypeas, OpenAI or Findymail credits, and drops
+# contacts whose found email is suppressed before the output is written.
+# Lookups go through a memory-mapped Bloom filter (BLOOM_FILE, about 1% false positives at BITS_PER_ENTRY)
+# and only keys the filter reports as present are checked exactly in SQLite (INDEX_DB), so a miss costs a
+# few bit reads whatever the size of the index and a hit one primary-key lookup.
+#   python -m scripts.suppression add output.csv old/output_*.csv do_not_contact.csv
+#   python -m scripts.suppression check https://www.linkedin.com/in/someone
+#   python -m scripts.suppression stats
+# CSV files are read by header: "LinkedIn URL" or "url", "email", and "Full Name" or "name" with "Root Domain"
+# or "domain". The input company's "Contact Email" column is not an "email" column and is not suppressed.
+SUPPRESSION_DIR = "suppression"
+BLOOM_FILE = "bloom.bin"
+INDEX_DB = "index.db"
+BITS_PER_ENTRY = 10
+NUM_HASHES = 7
+MIN_CAPACITY = 1_000_000
+BATCH_SIZE = 50_000
+URL_COLUMNS = ("linkedin url", "url")
+EMAIL_COLUMNS = ("email",)
+NAME_COLUMNS = ("full name", "name")
+DOMAIN_COLUMNS = ("root domain", "domain")
+LINKEDIN_PROFILE = re.compile(r"linkedin\.com/in/([^/?#\s]+)", re.IGNORECASE)
+# magic, bits, hashes, capacity, entries
+HEADER = struct.Struct("<8sQQQQ")
+MAGIC = b"SUPBLOOM"
+
+
+# linkedin.com/in/<slug>, whatever the scheme, subdomain, trailing slash or query string
+def canonical_url(url):
+    match = LINKEDIN_PROFILE.search(url or "")
+    if match is None:
+        return None
+    return f"linkedin.com/in/{unquote(match.group(1)).lower()}"
+
+
+# Same normalization as normalize.normalized_domain, for single values
+def canonical_domain(domain):
+    domain = (domain or "").strip().lower()
+    domain = re.sub(r"^[a-z][a-z0-9+.-]*://", "", domain)
+    domain = re.sub(r"^www\.", "", domain)
+    return re.sub(r"[/?#:].*$", "", domain).strip(".")
+
+
+# Lowercase, accents removed, whitespace collapsed
+def canonical_name(name):
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(name.lower().split())
+
+
+def url_key(url):
+    url = canonical_url(url)
+    return f"url:{url}" if url else None
+
+
+def contact_key(full_name, domain):
+    name, domain = canonical_name(full_name), canonical_domain(domain)
+    return f"name:{name}|{domain}" if name and domain else None
+
+
+def email_key(email):
+    email = (email or "").strip().lower()
+    return f"email:{email}" if "@" in email else None
+
+
+class BloomFilter:
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, self.bits, self.hashes, self.capacity, self.entries = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a suppression Bloom filter")
+
+    @classmethod
+    def create(cls, path, capacity):
+        bits = -(-capacity * BITS_PER_ENTRY // 8) * 8
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, bits, NUM_HASHES, capacity, 0))
+            f.truncate(HEADER.size + bits // 8)
+        return cls(path, writable=True)
+
+    # Double hashing on one 128-bit digest
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.map[HEADER.size + (position >> 3)] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.map[HEADER.size + (position >> 3)] & (1 << (position & 7)) for position in self._positions(key))
+
+    def flush(self, entries):
+        self.entries = entries
+        HEADER.pack_into(self.map, 0, MAGIC, self.bits, self.hashes, self.capacity, entries)
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class SuppressionIndex:
+    def __init__(self, directory=SUPPRESSION_DIR, writable=False):
+        self.directory = directory
+        self.writable = writable
+        self.bloom_path = os.path.join(directory, BLOOM_FILE)
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, INDEX_DB))
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.bloom = None
+        if os.path.exists(self.bloom_path):
+            self.bloom = BloomFilter(self.bloom_path, writable=writable)
+
+    def __contains__(self, key):
+        if key is None or self.bloom is None or key not in self.bloom:
+            return False
+        return self.db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    # Return: number of keys that were not in the index yet
+    def add(self, keys):
+        added = 0
+        batch = []
+        for key in keys:
+            if key:
+                batch.append(key)
+            if len(batch) >= BATCH_SIZE:
+                added += self._add_batch(batch)
+                batch = []
+        if batch:
+            added += self._add_batch(batch)
+        return added
+
+    def _add_batch(self, batch):
+        before = self.db.total_changes
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO entries (key) VALUES (?)", ((key,) for key in batch))
+        added = self.db.total_changes - before
+        entries = (self.bloom.entries if self.bloom else 0) + added
+        if self.bloom is None or entries > self.bloom.capacity:
+            self.rebuild()
+        else:
+            for key in batch:
+                self.bloom.add(key)
+            self.bloom.flush(entries)
+        return added
+
+    # Size a new filter for twice the current entries and fill it from SQLite
+    def rebuild(self):
+        entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        tmp = self.bloom_path + ".tmp"
+        bloom = BloomFilter.create(tmp, max(MIN_CAPACITY, 2 * entries))
+        for (key,) in self.db.execute("SELECT key FROM entries"):
+            bloom.add(key)
+        bloom.flush(entries)
+        bloom.close()
+        if self.bloom is not None:
+            self.bloom.close()
+        os.replace(tmp, self.bloom_path)
+        self.bloom = BloomFilter(self.bloom_path, writable=self.writable)
+
+    def close(self):
+        if self.bloom is not None:
+            self.bloom.close()
+        self.db.close()
+
+
+# Return: SuppressionIndex, or None when no index has been built in directory
+def open_index(directory=SUPPRESSION_DIR):
+    if not os.path.exists(os.path.join(directory, BLOOM_FILE)):
+        return None
+    return SuppressionIndex(directory)
+
+
+# Keys for every row of a past output or do-not-contact CSV
+def keys_from_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [column.strip().lower() for column in next(reader, [])]
+
+        def column(names):
+            return next((header.index(name) for name in names if name in header), None)
+
+        url, email, name, domain = column(URL_COLUMNS), column(EMAIL_COLUMNS), column(NAME_COLUMNS), column(DOMAIN_COLUMNS)
+        for row in reader:
+            if url is not None and url < len(row):
+                yield url_key(row[url])
+            if email is not None and email < len(row):
+                yield email_key(row[email])
+            if name is not None and domain is not None and max(name, domain) < len(row):
+                yield contact_key(row[name], row[domain])
+
+
+# Pipeline filters, each takes and returns the stage's {query: data} dict
+
+# After deduplication: {query: {url, job_titles, company, domain}}
+def suppress_urls(deduplicated_urls, index, tracker, logger):
+    kept = {}
+    for query, data in deduplicated_urls.items():
+        if url_key(data.get("url")) in index:
+            tracker.log(query, f"Suppressed, previously delivered LinkedIn URL: {data.get('url')}")
+        else:
+            kept[query] = data
+    logger.add_suppressed(len(deduplicated_urls) - len(kept))
+    return kept
+
+
+# Before Findymail: {query: {URL, domain, validation_result: {firstname, lastname, ...}}}
+def suppress_profiles(validated_profiles, index, tracker, logger):
+    kept = {}
+    for query, profile in validated_profiles.items():
+        validation = profile.get("validation_result", {})
+        full_name = " ".join(f"{validation.get('firstname') or ''} {validation.get('lastname') or ''}".split())
+        if url_key(profile.get("URL")) in index:
+            tracker.log(query, f"Suppressed, previously delivered LinkedIn URL: {profile.get('URL')}")
+        elif contact_key(full_name, profile.get("domain")) in index:
+            tracker.log(query, f"Suppressed, previously delivered contact: {full_name} at {profile.get('domain')}")
+        else:
+            kept[query] = profile
+    logger.add_suppressed(len(validated_profiles) - len(kept))
+    return kept
+
+
+# After Findymail: the same profiles with validation_result.findmymail set when an email was found
+def suppress_emails(emails, index, tracker, logger):
+    kept = {}
+    for query, profile in emails.items():
+        email = profile.get("validation_result", {}).get("findmymail")
+        if email_key(email) in index:
+            tracker.log(query, f"Suppressed, previously delivered email: {email}")
+        else:
+            kept[query] = profile
+    logger.add_suppressed(len(emails) - len(kept))
+    return kept
+
+
+# Run one of the filters above against the index in directory, items pass unchanged when there is no index
+def apply(suppress, items, tracker, logger, directory=SUPPRESSION_DIR):
+    if not items:
+        return items
+    index = open_index(directory)
+    if index is None:
+        return items
+    try:
+        return suppress(items, index, tracker, logger)
+    finally:
+        index.close()
+
+
+def main(argv):
+    command = argv[0] if argv else None
+    if command == "add" and len(argv) > 1:
+        index = SuppressionIndex(writable=True)
+        try:
+            for path in argv[1:]:
+                print(f"{path}: {index.add(keys_from_csv(path))} new entries")
+        finally:
+            index.close()
+    elif command == "rebuild":
+        index = SuppressionIndex(writable=True)
+        try:
+            index.rebuild()
+            print(f"Rebuilt {index.bloom_path} with {index.bloom.entries} entries")
+        finally:
+            index.close()
+    elif command == "check" and len(argv) > 1:
+        index = open_index()
+        value = argv[1]
+        key = url_key(value) or email_key(value)
+        print(f"{key}: {'suppressed' if index is not None and key in index else 'not suppressed'}")
+        if index is not None:
+            index.close()
+    elif command == "stats":
+        index = open_index()
+        if index is None:
+            print(f"No suppression index in {SUPPRESSION_DIR}/")
+            return 1
+        print(f"{index.bloom.entries} entries, filter capacity {index.bloom.capacity}, {index.bloom.bits // 8 / 1e6:.1f}MB")
+        index.close()
+    else:
+        print("Usage: python -m scripts.suppression add <file.csv>... | rebuild | check <url or email> | stats")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,12 @@
+import asyncio
 import concurrent.futures
 import json
 import re
+import polars as pl
 from .openAI import fuzzy_match_company, fuzzy_match_job_title
+from .retry import is_retryable, dead_letters
+from .cassette import CassetteMiss
+from .normalize import normalized_domain
 
 # Fuzzy match company parameters: target_company, current_company_name
 # Output: result (boolean), usage
@@ -39,14 +44,16 @@ Sequential Steps for validation: (They have to be followed in order)
 Works for:
 Check if "worksFor" field is not empty
 then if it is not empty
-Go through and check each entry in "worksFor" and get the first one that 
-matches the endDate criteria that means it is their current job
+Go through and check each entry in "worksFor" and get every one that 
+matches the endDate criteria that means it is a current job (people can hold several)
+This runs for the whole batch at once in current_role_candidates, see current_roles_frame
 if no current job found log using tracker function: log(query, exit reason) with reason "No current job found"
 then exit validation
-then set current_job into a variable
+then order the current jobs best candidate first
 
 Company:
-Check if "name" field in "worksFor" fuzzy matches the target_company
+A current job whose normalized company name equals the target company (or the domain name) matches without the LLM
+Otherwise check if "name" field of each current job fuzzy matches the target_company, the first match is the current job
 if no match found log using tracker function: log(query, exit reason) 
 with reason "Current Company does not Fuzzy Match target company: {current_company} : {target_company}"
 then exit validation
@@ -99,17 +106,19 @@ pass into validate_profile helper function one profile in the following format
     }
 }
 '''
-def validate_profiles(cleaned_enrichments, tracker, logger):
+def validate_profiles(cleaned_enrichments, tracker, logger, profiler=None):
     """
     Processes multiple profiles in parallel using a ThreadPoolExecutor.
     
     Args:
         cleaned_enrichments (dict): The dictionary containing all profiles to be validated.
+        profiler (RunProfiler, optional): Records thread-pool queue wait and worker CPU profiles.
 
     Returns:
         dict: A dictionary containing the validation results for each profile.
     """
     results = {}
+    candidates = screen_profiles(cleaned_enrichments, tracker)
     
     # Use ThreadPoolExecutor for thread-based parallelization
     workers = 70
@@ -118,10 +127,16 @@ def validate_profiles(cleaned_enrichments, tracker, logger):
     with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
 
         # Dictionary to hold the futures, mapping each future to its query name
-        future_to_query = {
-            executor.submit(validate_profile, query_name, data, tracker, logger): query_name
-            for query_name, data in cleaned_enrichments.items()
-        }
+        if profiler is None:
+            future_to_query = {
+                executor.submit(validate_profile, query_name, cleaned_enrichments[query_name], tracker, logger, roles): query_name
+                for query_name, roles in candidates.items()
+            }
+        else:
+            future_to_query = {
+                executor.submit(profiler.worker_task("validate", validate_profile, query_name, cleaned_enrichments[query_name], tracker, logger, roles)): query_name
+                for query_name, roles in candidates.items()
+            }
         
         # Iterate over completed futures as they become available
         for future in concurrent.futures.as_completed(future_to_query):
@@ -130,6 +145,8 @@ def validate_profiles(cleaned_enrichments, tracker, logger):
                 result = future.result()
                 if result:
                     results.update(result)
+            except CassetteMiss:
+                raise
             except Exception as exc:
                 query_name = future_to_query[future]
                 print(f"{query_name} generated an exception: {exc}")
@@ -139,6 +156,46 @@ def validate_profiles(cleaned_enrichments, tracker, logger):
     return results
 
 
+# Same input and output as validate_profiles, for scripts/service.py
+# Each profile is validated on executor once it holds a slot of semaphore (e.g. a FairGate slot), so concurrent
+# jobs share one thread pool and one OpenAI concurrency budget instead of starting a pool of their own
+async def validate_profiles_async(cleaned_enrichments, tracker, logger, executor, semaphore):
+    loop = asyncio.get_running_loop()
+    candidates = await loop.run_in_executor(executor, screen_profiles, cleaned_enrichments, tracker)
+
+    async def validate(query_name, roles):
+        async with semaphore:
+            return await loop.run_in_executor(executor, validate_profile, query_name, cleaned_enrichments[query_name], tracker, logger, roles)
+
+    results = {}
+    tasks = [asyncio.create_task(validate(query_name, roles)) for query_name, roles in candidates.items()]
+    try:
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+    for query_name, outcome in zip(candidates, outcomes):
+        if isinstance(outcome, CassetteMiss):
+            raise outcome
+        if isinstance(outcome, Exception):
+            print(f"{query_name} generated an exception: {outcome}")
+            tracker.log(query_name, f"Validation failed due to exception: {outcome}")
+        elif outcome:
+            results.update(outcome)
+    return results
+
+
+# Batch step: find every current role of every profile and reject profiles without one before any LLM call
+# Return: {query: [role, ...]} current roles best candidate first, for the profiles that are left
+def screen_profiles(cleaned_enrichments, tracker):
+    candidates, rejected = current_role_candidates(cleaned_enrichments)
+    for query_name, reason in rejected.items():
+        tracker.log(query_name, reason)
+    settled = sum(1 for roles in candidates.values() if roles[0]["company_rule"])
+    print(f"{len(rejected)} profiles rejected without a current role, {settled} company checks settled by rules")
+    return candidates
+
+
 # This is a helper function that will process one profile in the following format:
 '''
 "query1": {
@@ -157,7 +214,7 @@ def validate_profiles(cleaned_enrichments, tracker, logger):
     }
 }
 '''
-def validate_profile(query, data, tracker, logger):
+def validate_profile(query, data, tracker, logger, roles=None):
     """
     Validates a single profile against a target company and job titles.
     
@@ -166,6 +223,8 @@ def validate_profile(query, data, tracker, logger):
         data (dict): The profile data to validate.
         tracker (object): A tracker object for logging.
         logger (object): A logger object for tracking OpenAI usage.
+        roles (list, optional): Current roles from current_role_candidates, best candidate first.
+            Found from the profile's worksFor when not given.
 
     Returns:
         dict: The validation result for the profile.
@@ -184,35 +243,54 @@ def validate_profile(query, data, tracker, logger):
         tracker.log(query, f"Works for data from Icypeas result is empty {data.get('URL')}")
         return {}
     
-    # Sequential Step 1: Find the current job
-    current_work_entry = current_work(worksFor)
-    if not current_work_entry:
+    # Sequential Step 1: Find the current roles, best candidate first
+    if roles is None:
+        roles = current_roles(worksFor, target_company, data.get("domain"))
+    if not roles:
         tracker.log(query, "No current job found")
         return {}
 
-    current_company_name = current_work_entry.get("name")
-    current_job_title = current_work_entry.get("jobTitle")
-
-    # Sequential Step 2: Fuzzy match company
+    # Sequential Step 2: Match company, roles settled by the normalized-name rules skip the LLM
+    # Otherwise the candidates are fuzzy matched in order and the first match is the role that gets validated
     company_usage = 0
-    try:
-        company_match, usage = fuzzy_match_company(target_company, current_company_name)
-        company_usage += usage
-    except Exception as e:
-        tracker.log(query, f"Error in company fuzzy match: {str(e)}")
-        return {}
+    current_work_entry = None
+    for role in roles[:MAX_CANDIDATE_ROLES]:
+        if role["company_rule"]:
+            current_work_entry = role
+            break
+        try:
+            company_match, usage = fuzzy_match_company(target_company, role.get("name"), logger)
+            company_usage += usage
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            tracker.log(query, f"Error in company fuzzy match: {str(e)}")
+            if is_retryable(e):
+                dead_letters.add("openai", query, data, e)
+            return {}
+        if company_match:
+            current_work_entry = role
+            break
 
-    if not company_match:
+    if current_work_entry is None:
+        current_company_name = roles[0].get("name")
         tracker.log(query, f"Current Company does not Fuzzy Match target company: {current_company_name} : {target_company} url: {data.get('URL')}")
         return {}
 
+    current_company_name = current_work_entry.get("name")
+    current_job_title = current_work_entry.get("jobTitle")
+
     # Sequential Step 3: Fuzzy match job title
     job_title_usage = 0
     try:
-        job_title_match, usage = fuzzy_match_job_title(job_titles, current_job_title)
+        job_title_match, usage = fuzzy_match_job_title(job_titles, current_job_title, logger)
         job_title_usage += usage
+    except CassetteMiss:
+        raise
     except Exception as e:
         tracker.log(query, f"Error in job title fuzzy match: {str(e)}")
+        if is_retryable(e):
+            dead_letters.add("openai", query, data, e)
         return {}
 
     if not job_title_match:
@@ -253,4 +331,135 @@ def current_work(worksFor):
         end_date = work.get("endDate")
         if end_date in ["0001-01-01T00:00:00.000Z", "0000-01-01T00:00:00.000Z"]:
             return work
-    return None
\ No newline at end of file
+    return None
+
+
+CURRENT_END_DATES = frozenset(["0001-01-01T00:00:00.000Z", "0000-01-01T00:00:00.000Z"])
+# Company checks sent to the LLM per profile when several current roles fail the rules
+MAX_CANDIDATE_ROLES = 3
+LEGAL_SUFFIXES = r"\b(the|inc|llc|ltd|limited|corp|corporation|co|company|gmbh|plc|ag|sa|bv|nv)\b"
+# Second-level labels that belong to a country's public suffix: acme.co.uk, acme.com.au
+SECOND_LEVEL_SUFFIXES = ["co", "com", "net", "org", "gov", "edu", "ac", "ltd", "plc", "or", "ne", "go"]
+# The label in front of the public suffix: "https://shop.acme.co.uk/x" -> "acme"
+_DOMAIN_NAME = rf"([^.]+)\.(?:(?:{'|'.join(SECOND_LEVEL_SUFFIXES)})\.[a-z]{{2}}|[^.]+)$"
+ENTRY_SCHEMA = {"profile": pl.Int64, "role_index": pl.Int64, "name": pl.Utf8, "jobTitle": pl.Utf8, "endDate": pl.Utf8}
+PROFILE_SCHEMA = {"profile": pl.Int64, "query": pl.Utf8, "target": pl.Utf8, "domain": pl.Utf8}
+
+
+# Applied in order to the lowercased name: "&" -> "and", drop punctuation, legal suffixes and whitespace
+COMPANY_NAME_STEPS = [("&", " and "), (r"[^\w\s]", " "), (LEGAL_SUFFIXES, " "), (r"\s+", "")]
+_COMPANY_NAME_PATTERNS = [(re.compile(pattern), replacement) for pattern, replacement in COMPANY_NAME_STEPS]
+
+
+# Company name as compared by the rules: "The Coca-Cola Company" -> "cocacola"
+def normalized_company_name(expr):
+    expr = expr.str.to_lowercase()
+    for pattern, replacement in COMPANY_NAME_STEPS:
+        expr = expr.str.replace_all(pattern, replacement)
+    return expr
+
+
+# Registrable name of a domain column, compared with the role company: "acme-corp.co.uk" -> "acmecorp"
+def domain_name(column="domain"):
+    host = normalized_domain(column)
+    return pl.coalesce(host.str.extract(_DOMAIN_NAME, 1), host).str.replace_all(r"[^a-z0-9]", "")
+
+
+# Same as normalized_company_name for one name
+def normalized_company_key(name):
+    name = (name or "").lower()
+    for pattern, replacement in _COMPANY_NAME_PATTERNS:
+        name = pattern.sub(replacement, name)
+    return name
+
+
+def current_roles_frame(cleaned_enrichments):
+    """
+    Flattens the worksFor entries of all profiles into one table of current roles.
+
+    Args:
+        cleaned_enrichments (dict): The profiles to validate, as passed to validate_profiles.
+
+    Returns:
+        pl.DataFrame: Up to MAX_CANDIDATE_ROLES rows per profile with query, role_index, name, jobTitle and
+            company_rule (role company equals the target company or the domain name after normalization),
+            best candidate role of each profile first.
+    """
+    # Columns are filled directly, a row-oriented DataFrame costs more than the regex work below. Per-profile
+    # values go into their own small frame and are joined to the current roles only.
+    entries = {name: [] for name in ENTRY_SCHEMA}
+    profiles = {name: [] for name in PROFILE_SCHEMA}
+    entry_profiles, indexes, names, job_titles, end_dates = entries.values()
+    for number, (query, profile) in enumerate(cleaned_enrichments.items()):
+        works_for = (profile.get("icypeas_response") or {}).get("worksFor")
+        if not works_for:
+            continue
+        for column, value in zip(profiles.values(), (number, query, profile.get("company"), profile.get("domain"))):
+            column.append(value)
+        for index, work in enumerate(works_for):
+            entry_profiles.append(number)
+            indexes.append(index)
+            names.append(work.get("name"))
+            job_titles.append(work.get("jobTitle"))
+            end_dates.append(work.get("endDate"))
+
+    # Normalized names are columns of their own, used twice in one expression they would be computed twice
+    role_company = pl.col("role_company")
+    return (
+        pl.DataFrame(entries, schema=ENTRY_SCHEMA)
+        .filter(pl.col("endDate").is_in(list(CURRENT_END_DATES)))
+        # A left join keeps the entries in profile and role order
+        .join(pl.DataFrame(profiles, schema=PROFILE_SCHEMA), on="profile", how="left")
+        .with_columns(
+            normalized_company_name(pl.col("name")).alias("role_company"),
+            normalized_company_name(pl.col("target")).alias("target_company"),
+            domain_name("domain").alias("domain_name"),
+        )
+        .with_columns(
+            ((role_company.str.len_chars() > 0) & (
+                (role_company == pl.col("target_company")) | (role_company == pl.col("domain_name"))
+            )).fill_null(False).alias("company_rule")
+        )
+        # Sorting on the profile number is cheaper than on the query
+        .sort("profile", "company_rule", descending=[False, True], maintain_order=True)
+        .group_by("profile", maintain_order=True).head(MAX_CANDIDATE_ROLES)
+        .select("query", "role_index", "name", "jobTitle", "company_rule")
+    )
+
+
+def current_role_candidates(cleaned_enrichments):
+    """
+    Finds the current roles of every profile in one batch and rejects the profiles that cannot match.
+
+    Args:
+        cleaned_enrichments (dict): The profiles to validate, as passed to validate_profiles.
+
+    Returns:
+        tuple: ({query: [role, ...]} current roles best candidate first, {query: rejection reason})
+    """
+    candidates = {}
+    if cleaned_enrichments:
+        frame = current_roles_frame(cleaned_enrichments)
+        for query, role_index, name, job_title, company_rule in zip(*(frame[column].to_list() for column in frame.columns)):
+            candidates.setdefault(query, []).append(
+                {"role_index": role_index, "name": name, "jobTitle": job_title, "company_rule": company_rule}
+            )
+
+    rejected = {}
+    for query, data in cleaned_enrichments.items():
+        if query in candidates:
+            continue
+        icypeas_result = data.get("icypeas_response")
+        if not icypeas_result:
+            rejected[query] = f"No Icypeas result found: {data.get('URL')}"
+        elif not icypeas_result.get("worksFor"):
+            rejected[query] = f"Works for data from Icypeas result is empty {data.get('URL')}"
+        else:
+            rejected[query] = "No current job found"
+    return candidates, rejected
+
+
+# Single-profile version of current_roles_frame for callers outside the batch
+def current_roles(worksFor, target_company=None, domain=None):
+    frame = current_roles_frame({"": {"company": target_company, "domain": domain, "icypeas_response": {"worksFor": worksFor}}})
+    return frame.drop("query").to_dicts()
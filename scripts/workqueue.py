@@ -0,0 +1,322 @@
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+import uuid
+
+# Durable work queue for multi-node runs
+# Every unit of work (a Serper query, an Icypeas URL, a profile to validate, a profile to email) is a row in a
+# SQLite database that lives on a volume all nodes can reach. Any number of worker processes lease a batch of
+# items for one stage, run it through the normal stage functions and acknowledge it; acknowledging marks the
+# items done and enqueues their follow-up items for the next stage in the same transaction. Leases that are not
+# acknowledged within LEASE_SECONDS (crashed or stuck worker) become available to other workers again.
+# Deduplication of LinkedIn URLs across nodes happens through the urls table's primary key; a duplicate's job
+# titles are kept on the owner's urls row and merged into the owner's items as they are queued.
+#
+#   python -m scripts.workqueue submit   queue.db [input.csv]     create the queue from an input file
+#   python -m scripts.workqueue worker   queue.db                 run a worker until the queue is drained
+#   python -m scripts.workqueue status   queue.db                 item counts per stage and status
+#   python -m scripts.workqueue assemble queue.db [output.csv]    write the output once every item is done, gives up
+#                                                                 after ASSEMBLE_IDLE_SECONDS without progress
+#
+# The database uses SQLite's default rollback journal, which works over NFS/SMB shares as long as the share
+# supports POSIX locks; WAL mode would not.
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 2
+ASSEMBLE_IDLE_SECONDS = 2 * LEASE_SECONDS
+# Items leased per batch, matched to how each stage batches its provider calls
+BATCH_SIZES = {"query": 220, "enrich": 50, "validate": 70, "email": 300}
+# Later stages first so contacts come out while queries are still being searched
+STAGE_ORDER = ["email", "validate", "enrich", "query"]
+NEXT_STAGE = {"query": "enrich", "enrich": "validate", "validate": "email"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_until REAL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    UNIQUE(stage, key)
+);
+CREATE INDEX IF NOT EXISTS items_lease ON items(stage, status, lease_until);
+CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, key TEXT NOT NULL, job_titles TEXT NOT NULL DEFAULT '[]');
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def set_meta(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO meta(name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+    def get_meta(self, name, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def enqueue(self, stage, items):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO items(stage, key, payload) VALUES (?, ?, ?)",
+                [(stage, key, json.dumps(payload)) for key, payload in items.items()]
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    # Mark expired leases that already used MAX_ATTEMPTS (the item crashed or hung its worker every time) failed
+    def fail_expired(self, stages=STAGE_ORDER, now=None):
+        self.db.execute(
+            f"UPDATE items SET status = 'failed', lease_until = NULL, result = ? "
+            f"WHERE stage IN ({', '.join('?' * len(stages))}) AND status = 'leased' AND lease_until < ? AND attempts >= ?",
+            (json.dumps({"error": f"lease expired {MAX_ATTEMPTS} times"}), *stages, now or time.time(), MAX_ATTEMPTS)
+        )
+
+    # Lease up to limit pending (or expired) items of a stage
+    # Return: {item id: (key, payload)}
+    def lease(self, stage, worker, limit):
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.fail_expired([stage], now)
+            rows = self.db.execute(
+                "SELECT id, key, payload FROM items WHERE stage = ? AND "
+                "(status = 'pending' OR (status = 'leased' AND lease_until < ?)) LIMIT ?",
+                (stage, now, limit)
+            ).fetchall()
+            self.db.executemany(
+                "UPDATE items SET status = 'leased', lease_until = ?, worker = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + LEASE_SECONDS, worker, row[0]) for row in rows]
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return {row[0]: (row[1], json.loads(row[2])) for row in rows}
+
+    # Mark leased items done, store their results and enqueue follow-up items in one transaction
+    # results: {item id: result or None}, follow_up: {key: payload} for next_stage
+    # Job titles of duplicates stored on the owner's urls row are merged into its follow-up payload
+    # Return: number of items marked done, fewer than results when a lease expired and another worker took the item
+    def ack(self, worker, results, next_stage=None, follow_up=None):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            acked = self.db.executemany(
+                "UPDATE items SET status = 'done', lease_until = NULL, result = ? WHERE id = ? AND worker = ?",
+                [(json.dumps(result) if result is not None else None, item_id, worker) for item_id, result in results.items()]
+            ).rowcount
+            if next_stage and follow_up:
+                for key, payload in follow_up.items():
+                    if "job_titles" in payload:
+                        for (stored,) in self.db.execute("SELECT job_titles FROM urls WHERE key = ?", (key,)):
+                            payload["job_titles"] = list(dict.fromkeys(payload["job_titles"] + json.loads(stored)))
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO items(stage, key, payload) VALUES (?, ?, ?)",
+                    [(next_stage, key, json.dumps(payload)) for key, payload in follow_up.items()]
+                )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return acked
+
+    # Give leased items back after a failed batch, items past MAX_ATTEMPTS are marked failed
+    def release(self, worker, item_ids, error):
+        self.db.executemany(
+            "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_until = NULL, result = ? WHERE id = ? AND worker = ?",
+            [(MAX_ATTEMPTS, json.dumps({"error": str(error)}), item_id, worker) for item_id in item_ids]
+        )
+
+    # Claim a LinkedIn URL for a query, cross-node replacement for deduplicate_linkedin_urls
+    # Return: key of the query that already owns the URL, or None if this query now owns it
+    def claim_url(self, url, key):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("INSERT OR IGNORE INTO urls(url, key) VALUES (?, ?)", (url, key))
+            owner = self.db.execute("SELECT key FROM urls WHERE url = ?", (url,)).fetchone()[0]
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return None if owner == key else owner
+
+    # Add a duplicate's job titles to the owner's urls row, and to its enrich item while that is still pending
+    # Items queued later (the owner's enrich item once its query batch is acknowledged, or its validate item when the
+    # enrich item was already leased) pick the titles up from the urls row in ack
+    def add_job_titles(self, owner_key, job_titles):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for url, stored in self.db.execute("SELECT url, job_titles FROM urls WHERE key = ?", (owner_key,)).fetchall():
+                merged = list(dict.fromkeys(json.loads(stored) + list(job_titles)))
+                self.db.execute("UPDATE urls SET job_titles = ? WHERE url = ?", (json.dumps(merged), url))
+            row = self.db.execute(
+                "SELECT id, payload FROM items WHERE stage = 'enrich' AND key = ? AND status = 'pending'", (owner_key,)
+            ).fetchone()
+            if row:
+                payload = json.loads(row[1])
+                payload["job_titles"] = list(dict.fromkeys(payload["job_titles"] + list(job_titles)))
+                self.db.execute("UPDATE items SET payload = ? WHERE id = ?", (json.dumps(payload), row[0]))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def counts(self):
+        return self.db.execute("SELECT stage, status, COUNT(*) FROM items GROUP BY stage, status").fetchall()
+
+    def unfinished(self):
+        return self.db.execute("SELECT COUNT(*) FROM items WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def finished(self):
+        return self.db.execute("SELECT COUNT(*) FROM items WHERE status IN ('done', 'failed')").fetchone()[0]
+
+    def results(self, stage):
+        rows = self.db.execute("SELECT key, result FROM items WHERE stage = ? AND status = 'done' AND result IS NOT NULL", (stage,))
+        return {key: json.loads(result) for key, result in rows}
+
+
+def submit(db_path, input_path="input.csv"):
+    import polars as pl
+    from .Logger import Logger
+    from .queries import gen_queries
+    from .normalize import add_company_key, unique_companies
+
+    input_df = pl.read_csv(input_path)
+    job_titles = [title.strip() for title in input_df["job titles"][0].split(",")]
+    companies_data = unique_companies(add_company_key(input_df))
+    logger = Logger()
+    queries = gen_queries(companies_data, job_titles, logger)
+    queue = WorkQueue(db_path)
+    queue.set_meta("input_path", os.path.abspath(input_path))
+    queue.enqueue("query", queries)
+    print(f"Queued {len(queries)} queries for {len(companies_data)} companies in {db_path}")
+
+
+# Run the stage function for one leased batch
+# Return: ({item id: result}, {key: payload for the next stage})
+def process_batch(queue, stage, leased, tracker, logger):
+    from .serper import get_linkedin_urls_sync
+    from .enrich_urls import enrich_urls_sync
+    from .validateprofile import validate_profiles
+    from .findymail import findymail_sync
+
+    items = {key: payload for key, payload in leased.values()}
+    ids = {key: item_id for item_id, (key, _) in leased.items()}
+
+    if stage == "query":
+        urls = get_linkedin_urls_sync(items, tracker, logger)
+        follow_up = {}
+        for key, data in urls.items():
+            url = data.get("url")
+            if not url or "linkedin.com/in/" not in url:
+                continue
+            job_titles = data.get("matched_titles") or [data.get("title")]
+            owner = queue.claim_url(url, key)
+            if owner is None:
+                follow_up[key] = {"url": url, "job_titles": list(job_titles), "company": data.get("company"), "domain": data.get("domain")}
+            else:
+                tracker.log(key, f"Duplicate URL found: {url}")
+                if owner in follow_up:
+                    # The owner is in this batch, its enrich item is queued with this batch's ack
+                    follow_up[owner]["job_titles"] = list(dict.fromkeys(follow_up[owner]["job_titles"] + list(job_titles)))
+                else:
+                    queue.add_job_titles(owner, job_titles)
+        logger.add_deduplicated(len(follow_up))
+        return {item_id: None for item_id in leased}, follow_up
+
+    if stage == "enrich":
+        return {item_id: None for item_id in leased}, enrich_urls_sync(items, tracker, logger)
+
+    if stage == "validate":
+        validated = validate_profiles(items, tracker, logger)
+        logger.add_matches(len(validated))
+        return {item_id: None for item_id in leased}, validated
+
+    emails = findymail_sync(items, tracker, logger)
+    return {ids[key]: profile for key, profile in emails.items() if key in ids}, None
+
+
+def worker(db_path):
+    from .Logger import Logger
+    from .query_tracker import QueryTracker
+
+    queue = WorkQueue(db_path)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    tracker = QueryTracker(f"allqueries-{worker_id}.csv")
+    logger = Logger()
+    print(f"Worker {worker_id} started on {db_path}")
+    while True:
+        leased = None
+        for stage in STAGE_ORDER:
+            leased = queue.lease(stage, worker_id, BATCH_SIZES[stage])
+            if leased:
+                break
+        if not leased:
+            if not queue.unfinished():
+                break
+            # Other workers hold the remaining leases, wait for their follow-up items or expired leases
+            time.sleep(POLL_SECONDS)
+            continue
+        try:
+            results, follow_up = process_batch(queue, stage, leased, tracker, logger)
+            acked = queue.ack(worker_id, results, NEXT_STAGE.get(stage), follow_up)
+            if acked < len(results):
+                print(f"Worker {worker_id} lost {len(results) - acked} of {len(results)} {stage} leases to other workers before acknowledging")
+        except Exception as e:
+            print(f"Worker {worker_id} failed a {stage} batch of {len(leased)} items: {e}")
+            queue.release(worker_id, list(leased), e)
+    print(f"Worker {worker_id} done, queue drained")
+    logger.output()
+
+
+def status(db_path):
+    for stage, item_status, count in WorkQueue(db_path).counts():
+        print(f"{stage:10} {item_status:8} {count}")
+
+
+def assemble(db_path, output_path="output.csv"):
+    import polars as pl
+    from main import output_results
+    from .normalize import add_company_key
+
+    queue = WorkQueue(db_path)
+    # Progress is counted in finished items, an acknowledged batch can leave the unfinished count unchanged
+    finished, last_progress = None, time.monotonic()
+    while True:
+        queue.fail_expired()
+        unfinished = queue.unfinished()
+        if not unfinished:
+            break
+        if queue.finished() != finished:
+            finished, last_progress = queue.finished(), time.monotonic()
+        elif time.monotonic() - last_progress > ASSEMBLE_IDLE_SECONDS:
+            print(f"No progress on {unfinished} unfinished items for {ASSEMBLE_IDLE_SECONDS}s, is a worker running? Not writing {output_path}")
+            sys.exit(1)
+        print(f"Waiting for {unfinished} unfinished items...")
+        time.sleep(POLL_SECONDS * 5)
+    emails = queue.results("email")
+    input_df = add_company_key(pl.read_csv(queue.get_meta("input_path")))
+    output_results(emails, input_df).write_csv(output_path)
+    print(f"Wrote {len(emails)} contacts to {output_path}")
+
+
+if __name__ == "__main__":
+    commands = {"submit": submit, "worker": worker, "status": status, "assemble": assemble}
+    if len(sys.argv) < 3 or sys.argv[1] not in commands:
+        print("Usage: python -m scripts.workqueue {submit,worker,status,assemble} queue.db [file]")
+        sys.exit(1)
+    commands[sys.argv[1]](*sys.argv[2:4])
@@ -0,0 +1,21 @@
+import pytest
+
+from scripts import benchmark
+from scripts.validateprofile import current_role_candidates
+
+
+def test_loop_and_frame_find_the_same_current_roles():
+    enrichments = benchmark.synthetic_enrichments(200)
+    enrichments["q0"]["company"] = "The Coca-Cola Company"
+    enrichments["q0"]["icypeas_response"]["worksFor"].append({"name": "Coca Cola", "jobTitle": "CEO", "endDate": benchmark.CURRENT_END_DATE})
+    enrichments["q1"]["domain"] = "coca-cola.co.uk"
+    enrichments["q1"]["icypeas_response"]["worksFor"] += [
+        {"name": f"Side {j}", "jobTitle": "Advisor", "endDate": benchmark.CURRENT_END_DATE} for j in range(4)
+    ] + [{"name": "CocaCola", "jobTitle": "CEO", "endDate": benchmark.CURRENT_END_DATE}]
+    assert benchmark.current_roles_loop(enrichments) == current_role_candidates(enrichments)[0]
+
+
+@pytest.mark.skipif(benchmark.resource is None, reason="peak memory is traced without the resource module")
+def test_peak_memory_includes_frame_buffers():
+    # The frame step allocates most of its memory in Arrow buffers that tracemalloc does not see
+    assert benchmark.step_peak("current_roles_frame", 100_000) > 20_000_000
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import socket
+
+import aiohttp
+from aiohttp import web
+
+from scripts import findymail as findymail_module
+from scripts import findymail_webhook
+from scripts.circuit_breaker import DomainBreaker
+from scripts.Logger import Logger
+
+
+class Tracker:
+    def __init__(self):
+        self.rows = []
+
+    def log(self, query, message):
+        self.rows.append((query, message))
+
+
+def test_breaker_counts_names_not_lookups():
+    breaker = DomainBreaker(filename=None, threshold=3)
+    for _ in range(5):
+        breaker.record("acme.com", "Jane Doe", False)
+    assert not breaker.is_open("acme.com")
+    breaker.record("acme.com", "john roe", False)
+    breaker.record("acme.com", "Mary Major", False)
+    assert breaker.is_open("acme.com")
+    breaker.record("acme.com", "Jane Doe", True)
+    assert not breaker.is_open("acme.com")
+
+
+def test_breaker_drops_state_without_names(tmp_path):
+    path = tmp_path / "breakers.json"
+    path.write_text(json.dumps({"acme.com": {"failures": 5, "updated": 4102444800}}))
+    assert not DomainBreaker(filename=str(path)).is_open("acme.com")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Findymail stand-in that accepts every submission and calls its webhook back without an email
+async def run_webhook_stage(monkeypatch, names):
+    async def search(request):
+        payload = await request.json()
+
+        async def call_back():
+            async with aiohttp.ClientSession() as session:
+                await session.post(payload["webhook_url"], json={"payload": {"contact": None}})
+
+        asyncio.get_running_loop().create_task(call_back())
+        return web.json_response({"status": "queued"})
+
+    app = web.Application()
+    app.router.add_post("/search", search)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    monkeypatch.setattr(findymail_module, "FINDYMAIL_SEARCH_URL", f"http://127.0.0.1:{port}/search")
+
+    callback_port = free_port()
+    receiver = findymail_webhook.CallbackReceiver("127.0.0.1", callback_port, f"http://127.0.0.1:{callback_port}")
+    await receiver.start()
+    profiles = {
+        f"q{i}": {"domain": "dead.com", "validation_result": {"firstname": first, "lastname": last}}
+        for i, (first, last) in enumerate(names)
+    }
+    tracker, breaker = Tracker(), DomainBreaker(filename=None, threshold=3)
+    try:
+        result = await findymail_webhook.findymail_webhook(profiles, tracker, Logger(), receiver=receiver, breaker=breaker)
+    finally:
+        await receiver.stop()
+        await runner.cleanup()
+    return result, tracker, breaker
+
+
+def test_webhook_misses_open_the_breaker(monkeypatch):
+    names = [("Ann", "A"), ("Bob", "B"), ("Cid", "C"), ("Dee", "D"), ("Eve", "E")]
+    result, tracker, breaker = asyncio.run(run_webhook_stage(monkeypatch, names))
+    assert breaker.is_open("dead.com")
+    skipped = [query for query, message in tracker.rows if message.startswith("Findymail circuit open")]
+    assert sorted(skipped) == ["q3", "q4"]
+    assert all(profile["validation_result"]["findmymail"] == "" for profile in result.values())
+
+
+def test_webhook_repeated_name_does_not_open_the_breaker(monkeypatch):
+    result, tracker, breaker = asyncio.run(run_webhook_stage(monkeypatch, [("Ann", "A")] * 5))
+    assert not breaker.is_open("dead.com")
+    assert not any(message.startswith("Findymail circuit open") for _, message in tracker.rows)
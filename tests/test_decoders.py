@@ -0,0 +1,57 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+from scripts import decoders
+
+PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "decoders.py")
+
+ICYPEAS = {
+    "success": True,
+    "extra": "skipped",
+    "data": [
+        {"status": "FOUND", "result": {"url": "u", "firstname": "Jane", "lastname": "Doe", "photo": "skipped",
+                                       "worksFor": [{"name": "Acme", "jobTitle": "CEO", "endDate": None, "skills": []}]}},
+        {"status": "NOT_FOUND", "result": None},
+    ],
+}
+
+
+# A second copy of the module loaded with msgspec unavailable, scripts.decoders itself is left alone so the
+# DecodeError other modules imported stays the same class
+@pytest.fixture
+def fallback(monkeypatch):
+    monkeypatch.setitem(sys.modules, "msgspec", None)
+    spec = importlib.util.spec_from_file_location("decoders_without_msgspec", PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.msgspec is None
+    return module
+
+
+def test_fallback_projects_the_schema_fields(fallback):
+    decoded = fallback.decode_icypeas(json.dumps(ICYPEAS).encode("utf-8"))
+    assert decoded == {
+        "success": True,
+        "data": [
+            {"status": "FOUND", "result": {"url": "u", "firstname": "Jane", "lastname": "Doe",
+                                           "worksFor": [{"name": "Acme", "jobTitle": "CEO", "endDate": None}]}},
+            {"status": "NOT_FOUND", "result": None},
+        ],
+    }
+    if decoders.msgspec is not None:
+        assert decoded == decoders.decode_icypeas(json.dumps(ICYPEAS).encode("utf-8"))
+
+
+def test_fallback_rejects_the_wrong_shape(fallback):
+    with pytest.raises(fallback.DecodeError) as error:
+        fallback.decode_findymail(b'{"contact": {"email": 5}}')
+    assert error.value.code == "findymail.schema"
+    with pytest.raises(fallback.DecodeError) as error:
+        fallback.decode_serper(b"<html>")
+    assert error.value.code == "serper.json"
+    with pytest.raises(fallback.DecodeError):
+        fallback.decode_openai(b'{"choices": [], "usage": {"total_tokens": true}}')
@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import json
+
+from scripts import enrich_urls, findymail
+from scripts.Logger import Logger
+
+
+class Tracker:
+    def __init__(self):
+        self.rows = []
+
+    def log(self, query, message):
+        self.rows.append((query, message))
+
+
+class Response:
+    status = 200
+
+    def __init__(self, body):
+        self.body = json.dumps(body).encode("utf-8")
+
+    async def read(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+def answer_with(monkeypatch, module, body):
+    @contextlib.asynccontextmanager
+    async def http_post(session, url, **kwargs):
+        yield Response(body)
+
+    monkeypatch.setattr(module, "http_post", http_post)
+
+
+# Both the primary and its duplicate got a response before either was cancelled, the first one is used
+def both_arrived(fetch):
+    async def hedged():
+        first, _ = await asyncio.gather(fetch(), fetch())
+        return first
+    return hedged
+
+
+def credits(logger, provider):
+    return sum(counts[1] for counts in logger.key_usage[provider].values())
+
+
+def test_findymail_loser_spend_is_reported_once_per_response(monkeypatch):
+    answer_with(monkeypatch, findymail, {"contact": {"email": "jane@acme.com"}})
+    tracker, logger = Tracker(), Logger()
+    fetch = both_arrived(lambda: findymail.fetch_findymail("Jane", "Doe", "acme.com", logger, session=object()))
+    email = asyncio.run(findymail.findmymail_request("q", "Jane", "Doe", "acme.com", tracker, logger, fetch=fetch))
+    assert email == "jane@acme.com"
+    assert credits(logger, "Findymail") == 2
+    assert logger.total_emails_found == 1
+    assert tracker.rows == [("q", "Email found for Jane Doe")]
+
+
+def test_icypeas_loser_spend_is_reported_once_per_response(monkeypatch):
+    profile = {"status": "FOUND", "result": {"firstname": "Jane", "lastname": "Doe", "url": "u", "worksFor": []}}
+    answer_with(monkeypatch, enrich_urls, {"success": True, "data": [profile]})
+    batch = {"q": {"url": "https://www.linkedin.com/in/jane", "job_titles": ["CEO"], "company": "Acme", "domain": "acme.com"}}
+    tracker, logger = Tracker(), Logger()
+    fetch = both_arrived(lambda: enrich_urls.fetch_bulk_search(batch, logger, session=object()))
+    result = asyncio.run(enrich_urls.bulk_search(batch, tracker, logger, fetch=fetch))
+    assert list(result) == ["q"]
+    assert credits(logger, "Icypeas") == 3
+    assert logger.icypeas_profiles == 1
@@ -0,0 +1,24 @@
+from scripts import openAI, prompt_check
+
+
+def test_standin_run_passes(monkeypatch, capsys):
+    monkeypatch.setattr(prompt_check, "REPEATS", 1)
+    monkeypatch.setattr(openAI, "OPENAI_CHAT_URL", openAI.OPENAI_CHAT_URL)
+    assert prompt_check.main([]) == 0
+    out = capsys.readouterr().out
+    assert "seconds  not checked against the stand-in" in out
+    assert "Verdicts not checked against the stand-in" in out
+
+
+def test_standin_run_fails_on_more_tokens(monkeypatch, capsys):
+    build, parse = prompt_check.VERSIONS["current"]
+
+    def padded(kind, target, candidate):
+        system, prompt = build(kind, target, candidate)
+        return system + " Answer carefully." * 200, prompt
+
+    monkeypatch.setattr(prompt_check, "REPEATS", 1)
+    monkeypatch.setattr(openAI, "OPENAI_CHAT_URL", openAI.OPENAI_CHAT_URL)
+    monkeypatch.setitem(prompt_check.VERSIONS, "current", (padded, parse))
+    assert prompt_check.main([]) == 1
+    assert "REGRESSION company tokens per check went up" in capsys.readouterr().out
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from scripts import rate_coordinator
+from scripts.rate_coordinator import SharedSemaphore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Holds the only slot with several coroutines that release and re-acquire it for HOLD_SECONDS each
+HOLDER = textwrap.dedent("""
+    import asyncio, sys, time
+    from scripts.rate_coordinator import SharedSemaphore
+
+    async def main(state_dir, seconds):
+        semaphore = SharedSemaphore("fairness", 1, state_dir=state_dir)
+        end = time.monotonic() + seconds
+
+        async def hold():
+            while time.monotonic() < end:
+                async with semaphore:
+                    await asyncio.sleep(0.05)
+
+        await semaphore.acquire()
+        print("holding", flush=True)
+        semaphore.release()
+        await asyncio.gather(*(hold() for _ in range(4)))
+
+    asyncio.run(main(sys.argv[1], float(sys.argv[2])))
+""")
+
+
+@pytest.mark.skipif(rate_coordinator.fcntl is None, reason="shared limits need fcntl")
+def test_waiting_process_gets_a_slot_released_by_a_busy_process(tmp_path):
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLDER, str(tmp_path), "3"],
+        stdout=subprocess.PIPE, text=True, cwd=ROOT, env={**os.environ, "PYTHONPATH": os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")])},
+    )
+    try:
+        assert holder.stdout.readline().strip() == "holding"
+        time.sleep(0.2)
+
+        async def acquire():
+            semaphore = SharedSemaphore("fairness", 1, state_dir=str(tmp_path))
+            start = time.monotonic()
+            await asyncio.wait_for(semaphore.acquire(), 2)
+            semaphore.release()
+            return time.monotonic() - start
+
+        # One hold plus a few polls, not the holder's whole run
+        assert asyncio.run(acquire()) < 0.3
+    finally:
+        holder.kill()
+        holder.wait()
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from scripts import serper
+from scripts.cassette import CassetteMiss
+
+
+class Tracker:
+    def __init__(self):
+        self.rows = []
+
+    def log(self, query, message):
+        self.rows.append((query, message))
+
+
+def test_replay_miss_stops_the_stage_instead_of_hanging(monkeypatch):
+    async def miss(query, *args, **kwargs):
+        raise CassetteMiss(query[0])
+
+    monkeypatch.setattr(serper, "serper_search", miss)
+    queries = {f"q{i}": {"company": "Acme", "title": "CEO", "domain": "acme.com"} for i in range(20)}
+
+    async def run():
+        await asyncio.wait_for(
+            serper._run_serper_workers(queries, {}, Tracker(), None, None, None, None, None, num_workers=2, time_limit=None),
+            timeout=5,
+        )
+
+    with pytest.raises(CassetteMiss):
+        asyncio.run(run())
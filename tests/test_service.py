@@ -0,0 +1,57 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from scripts import validateprofile
+from scripts.service import FairGate
+
+CURRENT = "0001-01-01T00:00:00.000Z"
+
+
+class Tracker:
+    def log(self, query, message):
+        pass
+
+
+def enrichments(job, n):
+    return {
+        f"{job}{i}": {"company": "Acme", "domain": "acme.com",
+                      "icypeas_response": {"worksFor": [{"name": "Acme", "jobTitle": "CEO", "endDate": CURRENT}]}}
+        for i in range(n)
+    }
+
+
+def test_jobs_share_validation_threads_round_robin(monkeypatch):
+    lock = threading.Lock()
+    running, most = [0], [0]
+    finished = {}
+
+    def validate_profile(query, data, tracker, logger, roles=None):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return {query: {"query": query}}
+
+    monkeypatch.setattr(validateprofile, "validate_profile", validate_profile)
+
+    async def run():
+        gate = FairGate(2)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            async def job(name, n):
+                result = await validateprofile.validate_profiles_async(
+                    enrichments(name, n), Tracker(), None, executor, gate.for_job(name)
+                )
+                finished[name] = time.monotonic()
+                return result
+
+            return await asyncio.gather(job("big", 60), job("small", 4))
+
+    big, small = asyncio.run(run())
+    assert len(big) == 60 and len(small) == 4
+    assert most[0] <= 2
+    # The small job gets every other slot instead of waiting for the big one
+    assert finished["small"] < finished["big"]
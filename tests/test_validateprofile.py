@@ -0,0 +1,28 @@
+import polars as pl
+
+from scripts.validateprofile import MAX_CANDIDATE_ROLES, current_role_candidates, domain_name
+
+CURRENT = "0001-01-01T00:00:00.000Z"
+
+
+def test_domain_name_skips_the_public_suffix():
+    domains = ["acme.com", "acme.co.uk", "https://www.Acme-Corp.com.au/shop", "shop.acme.de", "acme", None]
+    names = pl.DataFrame({"domain": domains}, schema={"domain": pl.Utf8}).select(domain_name("domain"))["domain"].to_list()
+    assert names == ["acme", "acme", "acmecorp", "acme", "acme", None]
+
+
+def test_current_roles_are_filtered_and_capped_in_the_frame():
+    works_for = [{"name": "Old", "jobTitle": "CEO", "endDate": "2019-06-01T00:00:00.000Z"}]
+    works_for += [{"name": f"Board {i}", "jobTitle": "Advisor", "endDate": CURRENT} for i in range(5)]
+    works_for += [{"name": "ACME Ltd", "jobTitle": "CEO", "endDate": "0000-01-01T00:00:00.000Z"}]
+    enrichments = {
+        "q": {"company": "Something Else", "domain": "acme.co.uk", "icypeas_response": {"worksFor": works_for}},
+        "past": {"company": "Old", "domain": "old.com", "icypeas_response": {"worksFor": works_for[:1]}},
+    }
+    candidates, rejected = current_role_candidates(enrichments)
+    roles = candidates["q"]
+    assert len(roles) == MAX_CANDIDATE_ROLES
+    # The domain rule puts the acme.co.uk role first, the rest keep their worksFor order
+    assert [role["role_index"] for role in roles] == [6, 1, 2]
+    assert [role["company_rule"] for role in roles] == [True, False, False]
+    assert rejected == {"past": "No current job found"}
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from scripts import serper, workqueue
+from scripts.workqueue import WorkQueue
+
+
+class Tracker:
+    def log(self, query, message):
+        pass
+
+
+class Logger:
+    def add_deduplicated(self, count):
+        pass
+
+
+def run_query_batch(queue, monkeypatch, urls):
+    monkeypatch.setattr(serper, "get_linkedin_urls_sync", lambda items, tracker, logger: {key: urls[key] for key in items})
+    leased = queue.lease("query", "w1", workqueue.BATCH_SIZES["query"])
+    results, follow_up = workqueue.process_batch(queue, "query", leased, Tracker(), Logger())
+    queue.ack("w1", results, "enrich", follow_up)
+
+
+def search_result(url, title):
+    return {"url": url, "title": title, "company": "Acme", "domain": "acme.com"}
+
+
+def enrich_titles(queue):
+    return {key: payload["job_titles"] for key, payload in queue.lease("enrich", "w2", 100).values()}
+
+
+def test_duplicate_in_the_same_batch_merges_titles(tmp_path, monkeypatch):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue("query", {"a": {}, "b": {}})
+    url = "https://www.linkedin.com/in/jane"
+    run_query_batch(queue, monkeypatch, {"a": search_result(url, "CEO"), "b": search_result(url, "Founder")})
+    assert enrich_titles(queue) == {"a": ["CEO", "Founder"]}
+
+
+def test_duplicate_in_a_later_batch_merges_titles(tmp_path, monkeypatch):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    url = "https://www.linkedin.com/in/jane"
+    urls = {"a": search_result(url, "CEO"), "b": search_result(url, "Founder")}
+    # Another worker claimed the URL for "a" and has not acknowledged its query batch yet
+    assert queue.claim_url(url, "a") is None
+    queue.enqueue("query", {"b": {}})
+    run_query_batch(queue, monkeypatch, urls)
+    queue.ack("w0", {}, "enrich", {"a": {"url": url, "job_titles": ["CEO"], "company": "Acme", "domain": "acme.com"}})
+    assert enrich_titles(queue) == {"a": ["CEO", "Founder"]}
+
+
+def test_assemble_gives_up_without_progress(tmp_path, monkeypatch):
+    path = str(tmp_path / "queue.db")
+    WorkQueue(path).enqueue("query", {"a": {}})
+    monkeypatch.setattr(workqueue, "ASSEMBLE_IDLE_SECONDS", 0.05)
+    monkeypatch.setattr(workqueue, "POLL_SECONDS", 0.01)
+    start = time.monotonic()
+    with pytest.raises(SystemExit):
+        workqueue.assemble(path, str(tmp_path / "output.csv"))
+    assert time.monotonic() - start < 5
+    assert not (tmp_path / "output.csv").exists()
+
+
+def test_leases_that_expired_too_often_fail(tmp_path, monkeypatch):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue("query", {"a": {}})
+    queue.db.execute("UPDATE items SET status = 'leased', lease_until = 0, attempts = ?", (workqueue.MAX_ATTEMPTS,))
+    queue.fail_expired()
+    assert queue.unfinished() == 0
+    assert queue.counts() == [("query", "failed", 1)]